@@ -0,0 +1,544 @@
+"""Client library of the acquisition server's framed protocol (wire.py).
+
+Frames are read with recv_into() straight into one reusable buffer, so a
+capture costs no allocation beyond the NumPy views handed out. A Frame
+and the arrays it returns are views into that buffer and stay valid until
+the next frame is received; copy what has to outlive it.
+
+    with AcquisitionClient("192.168.0.240", 22222) as client:
+        frame = client.capture()
+        a = frame.channels()["A"]
+        for frame in client.captures(1000, depth=4):    # pipelined
+            ...
+        for frame in client.stream(rate=50):            # server push
+            ...
+
+AsyncAcquisitionClient offers the same calls as coroutines for asyncio
+programs. Every client keeps a ClientStats with the round-trip latency of
+its requests and the age of every capture when it arrived.
+"""
+import asyncio
+import socket
+import time
+
+import numpy as np
+
+import compression
+import decode
+import wire
+from acquisition import CAPTURE_WORDS
+from pypcie.poll import WaitStats
+
+
+class ServerError(RuntimeError):
+    """ The server answered a request with a MSG_ERROR frame.
+
+    :param int request_id: the failed request.
+
+    """
+
+    def __init__(self, request_id, message):
+        super().__init__("request %d: %s" % (request_id, message))
+        self.request_id = request_id
+
+
+class ClientStats(object):
+    """ Counters and latencies of a client.
+
+    ``latency`` records request -> capture round trips, ``age`` the time
+    from acquisition to arrival of every capture, pushed ones included
+    (meaningful with synchronized clocks only). Both are WaitStats with
+    power-of-two buckets, the ``keep`` most recent round trips are also
+    kept exactly in ``latencies``.
+
+    :param int keep: round trips kept in ``latencies``, 0 for none.
+
+    """
+
+    def __init__(self, keep=0):
+        self.frames = 0
+        self.captures = 0
+        self.bytes = 0
+        self.errors = 0
+        self.gaps = 0
+        self.latency = WaitStats()
+        self.age = WaitStats()
+        self.latencies = np.zeros(keep)
+        self.__kept = 0
+        self.__last_seq = None
+
+    def record(self, header, latency=None):
+        self.frames += 1
+        self.bytes += wire.HEADER.size + header.length
+        if header.type != wire.MSG_CAPTURE:
+            return
+        self.captures += 1
+        if self.__last_seq is None or header.seq > self.__last_seq:
+            if self.__last_seq is not None and \
+                    header.seq > self.__last_seq + 1:
+                self.gaps += 1
+            self.__last_seq = header.seq
+        self.age.record(1, max(time.time() - header.timestamp, 0.0))
+        if latency is not None:
+            self.latency.record(1, latency)
+            if len(self.latencies):
+                self.latencies[self.__kept % len(self.latencies)] = latency
+                self.__kept += 1
+
+    def kept(self):
+        """ The round trips in ``latencies``, oldest first when it has
+        wrapped around. """
+        n = len(self.latencies)
+        if self.__kept <= n:
+            return self.latencies[:self.__kept]
+        k = self.__kept % n
+        return np.concatenate((self.latencies[k:], self.latencies[:k]))
+
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "captures": self.captures,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "gaps": self.gaps,
+            "latency_mean_s": self.latency.total_time /
+            (self.latency.count or 1),
+            "latency_p99_s": self.latency.percentile(99),
+            "latency_max_s": self.latency.max_time,
+            "age_p99_s": self.age.percentile(99),
+        }
+
+
+class Frame(object):
+    """ A received MSG_CAPTURE frame, a view into the client's buffer.
+
+    :param wire.Header header: the frame header.
+    :param memoryview payload: the payload bytes.
+    :param float latency: request round trip in seconds, None for pushed
+                          frames.
+
+    """
+
+    __slots__ = ("header", "payload", "latency")
+
+    def __init__(self, header, payload, latency=None):
+        self.header = header
+        self.payload = payload
+        self.latency = latency
+
+    @property
+    def seq(self):
+        return self.header.seq
+
+    @property
+    def timestamp(self):
+        return self.header.timestamp
+
+    @property
+    def dac_value(self):
+        return self.header.dac_value
+
+    @property
+    def request_id(self):
+        return self.header.request_id
+
+    @property
+    def layout(self):
+        """ decode.ChannelLayout of the capture. """
+        return wire.LAYOUTS.get(self.header.layout, decode.LAYOUT_AB)
+
+    def planes(self, out=None):
+        """ The capture as a (2, N) array, row 0 the low and row 1 the
+        high half-word: a view for raw payloads unless ``out`` is given,
+        decoded into ``out`` (or a new array) otherwise.
+
+        :param numpy.ndarray out: preallocated (2, N) uint16 or int16
+                                  array.
+        :rtype: numpy.ndarray
+        """
+        encoding = self.header.encoding
+        if encoding == wire.ENC_PEAKS:
+            raise ValueError("peaks-only frame has no samples")
+        if out is None:
+            return wire.decode_payload(self.payload, self.header.count,
+                                       encoding)
+        if encoding == wire.ENC_RAW:
+            return decode.decode_into(self.payload, out)
+        if encoding == wire.ENC_DELTA:
+            compression.decode_planes(self.payload, out.view(np.uint16))
+            return out
+        out[...] = wire.decode_payload(self.payload, self.header.count,
+                                       encoding)
+        return out
+
+    def channels(self, signed=False):
+        """ Split into named channels, see decode.split().
+
+        :rtype: dict
+        """
+        layout = self.layout
+        if self.header.encoding == wire.ENC_RAW:
+            return decode.split(self.payload, layout, signed)
+        planes = self.planes()
+        if signed:
+            planes = planes.view(decode.SIGNED_SAMPLE_DTYPE)
+        return {layout.low: planes[0], layout.high: planes[1]}
+
+    def peaks(self):
+        """ The peak records of a peaks-only frame, see peaks.PEAK_DTYPE.
+
+        :rtype: numpy.ndarray
+        """
+        if self.header.encoding != wire.ENC_PEAKS:
+            raise ValueError("not a peaks-only frame")
+        return wire.decode_payload(self.payload, self.header.count,
+                                   wire.ENC_PEAKS)
+
+    def copy(self):
+        """ A Frame owning a copy of the payload. """
+        return Frame(self.header, memoryview(bytes(self.payload)),
+                     self.latency)
+
+
+class _ClientBase(object):
+    """ Frame bookkeeping shared by the sync and asyncio clients. """
+
+    def __init__(self, words, keep_latencies):
+        self.stats = ClientStats(keep_latencies)
+        self.encoding = wire.ENC_RAW
+        self.codec = None
+        self._buf = bytearray(wire.HEADER.size + 4 * words)
+        self._view = memoryview(self._buf)
+        self._next_id = 0
+        # request_id -> send time of requests in flight
+        self._pending = {}
+        # open subscriptions
+        self._streams = set()
+
+    def _new_id(self):
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        return self._next_id
+
+    def _request_frame(self, start, count, dac_value):
+        request_id = self._new_id()
+        self._pending[request_id] = time.perf_counter()
+        return request_id, wire.request_frame(
+            request_id, wire.Request(start, count, dac_value))
+
+    def _payload_view(self, header):
+        """ Payload part of the buffer, grown if the frame is larger. """
+        end = wire.HEADER.size + header.length
+        if end > len(self._buf):
+            head = bytes(self._view[:wire.HEADER.size])
+            self._buf = bytearray(end)
+            self._view = memoryview(self._buf)
+            self._view[:wire.HEADER.size] = head
+        return self._view[wire.HEADER.size:end]
+
+    def _frame(self, header, payload):
+        """ Account for a received frame, raise ServerError for errors.
+
+        :returns: Frame for captures, the header for anything else.
+        """
+        latency = None
+        if header.type in (wire.MSG_CAPTURE, wire.MSG_ERROR) and \
+                header.request_id not in self._streams:
+            sent = self._pending.pop(header.request_id, None)
+            if sent is not None:
+                latency = time.perf_counter() - sent
+        self.stats.record(header, latency)
+        if header.type == wire.MSG_ERROR:
+            self.stats.errors += 1
+            self._streams.discard(header.request_id)
+            raise ServerError(header.request_id,
+                              bytes(payload).decode("utf-8", "replace"))
+        if header.type == wire.MSG_CAPTURE:
+            return Frame(header, payload, latency)
+        if header.type == wire.MSG_UNSUBSCRIBE:
+            self._streams.discard(header.request_id)
+        return header
+
+    def _hello(self, payload):
+        hello = wire.Hello.unpack(payload)
+        self.encoding = hello.encoding
+        self.codec = hello.codec
+        return hello
+
+
+class AcquisitionClient(_ClientBase):
+    """ Blocking client.
+
+    :param str host: server address.
+    :param int port: server port.
+    :param int encoding: wire.ENC_* payload encoding to negotiate.
+    :param int codec: compression.CODEC_* of ENC_DELTA, the best
+                      available if None.
+    :param float timeout: socket timeout in seconds, None to block.
+    :param int words: capture size the buffer is sized for, it grows if
+                      needed.
+    :param int keep_latencies: round trips kept exactly in
+                               ``stats.latencies``.
+
+    """
+
+    def __init__(self, host="127.0.0.1", port=22222, encoding=wire.ENC_RAW,
+                 codec=None, timeout=None, words=CAPTURE_WORDS,
+                 keep_latencies=0):
+        super().__init__(words, keep_latencies)
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if encoding != wire.ENC_RAW:
+            self.negotiate(encoding, codec)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def _recv_exactly(self, view):
+        while len(view):
+            n = self.sock.recv_into(view)
+            if not n:
+                raise ConnectionError("connection closed by server")
+            view = view[n:]
+
+    def _read(self):
+        self._recv_exactly(self._view[:wire.HEADER.size])
+        header = wire.Header.unpack(self._view)
+        payload = self._payload_view(header)
+        self._recv_exactly(payload)
+        return header, payload
+
+    def receive(self):
+        """ Receive the next frame.
+
+        :returns: Frame for captures, the wire.Header of other frames.
+        :raises ServerError: for a MSG_ERROR frame.
+        """
+        return self._frame(*self._read())
+
+    def _receive_capture(self):
+        while True:
+            frame = self.receive()
+            if isinstance(frame, Frame):
+                return frame
+
+    def negotiate(self, encoding, codec=None):
+        """ Select the payload encoding of the connection.
+
+        :returns: the wire.Hello the server accepted.
+        """
+        if codec is None:
+            codec = compression.default_codec()
+        self.sock.sendall(wire.hello_frame(wire.Hello(encoding, codec)))
+        while True:
+            header, payload = self._read()
+            if header.type == wire.MSG_HELLO:
+                return self._hello(payload)
+            self._frame(header, payload)
+
+    def request(self, start=0, count=0, dac_value=None):
+        """ Send a capture request without waiting for the answer.
+
+        :returns: the request id.
+        """
+        request_id, data = self._request_frame(start, count, dac_value)
+        self.sock.sendall(data)
+        return request_id
+
+    def capture(self, start=0, count=0, dac_value=None):
+        """ Request one capture and wait for it.
+
+        :rtype: Frame
+        """
+        self.request(start, count, dac_value)
+        return self._receive_capture()
+
+    def captures(self, n, depth=4, start=0, count=0, dac_value=None):
+        """ Yield ``n`` captures keeping ``depth`` requests in flight.
+
+        Every frame is only valid until the next one is yielded.
+        """
+        sent = 0
+        for _ in range(min(depth, n)):
+            self.request(start, count, dac_value)
+            sent += 1
+        for _ in range(n):
+            frame = self._receive_capture()
+            if sent < n:
+                self.request(start, count, dac_value)
+                sent += 1
+            yield frame
+
+    def subscribe(self, rate=0.0, start=0, count=0, dac_value=None):
+        """ Start a server push stream, see :meth:`stream`.
+
+        :returns: the request id of the stream.
+        """
+        request_id = self._new_id()
+        self._streams.add(request_id)
+        self.sock.sendall(wire.subscribe_frame(request_id, wire.Subscription(
+            start, count, dac_value, rate)))
+        return request_id
+
+    def unsubscribe(self, request_id):
+        """ End a stream, frames already on their way are still received.
+        """
+        self.sock.sendall(wire.unsubscribe_frame(request_id))
+
+    def stream(self, rate=0.0, start=0, count=0, dac_value=None, n=None):
+        """ Subscribe and yield pushed captures, ``n`` of them or until the
+        generator is closed, then unsubscribe. """
+        request_id = self.subscribe(rate, start, count, dac_value)
+        received = 0
+        try:
+            while n is None or received < n:
+                frame = self._receive_capture()
+                if frame.request_id == request_id:
+                    received += 1
+                    yield frame
+        finally:
+            self.unsubscribe(request_id)
+            # drain the stream up to its end marker
+            while request_id in self._streams:
+                self.receive()
+
+
+class AsyncAcquisitionClient(_ClientBase):
+    """ asyncio client, use :meth:`connect` to create one. Only one task
+    may receive at a time.
+
+    :param sock: connected non-blocking socket.
+
+    """
+
+    def __init__(self, sock, words=CAPTURE_WORDS, keep_latencies=0):
+        super().__init__(words, keep_latencies)
+        self.sock = sock
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=22222,
+                      encoding=wire.ENC_RAW, codec=None,
+                      words=CAPTURE_WORDS, keep_latencies=0):
+        """ Connect and negotiate the payload encoding, see
+        AcquisitionClient for the parameters.
+
+        :rtype: AsyncAcquisitionClient
+        """
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            await loop.sock_connect(sock, (host, port))
+        except BaseException:
+            sock.close()
+            raise
+        client = cls(sock, words, keep_latencies)
+        if encoding != wire.ENC_RAW:
+            await client.negotiate(encoding, codec)
+        return client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    async def _recv_exactly(self, view):
+        loop = asyncio.get_running_loop()
+        while len(view):
+            n = await loop.sock_recv_into(self.sock, view)
+            if not n:
+                raise ConnectionError("connection closed by server")
+            view = view[n:]
+
+    async def _send(self, data):
+        await asyncio.get_running_loop().sock_sendall(self.sock, data)
+
+    async def _read(self):
+        await self._recv_exactly(self._view[:wire.HEADER.size])
+        header = wire.Header.unpack(self._view)
+        payload = self._payload_view(header)
+        await self._recv_exactly(payload)
+        return header, payload
+
+    async def receive(self):
+        """ Receive the next frame, see AcquisitionClient.receive(). """
+        return self._frame(*await self._read())
+
+    async def _receive_capture(self):
+        while True:
+            frame = await self.receive()
+            if isinstance(frame, Frame):
+                return frame
+
+    async def negotiate(self, encoding, codec=None):
+        """ Select the payload encoding of the connection.
+
+        :rtype: wire.Hello
+        """
+        if codec is None:
+            codec = compression.default_codec()
+        await self._send(wire.hello_frame(wire.Hello(encoding, codec)))
+        while True:
+            header, payload = await self._read()
+            if header.type == wire.MSG_HELLO:
+                return self._hello(payload)
+            self._frame(header, payload)
+
+    async def request(self, start=0, count=0, dac_value=None):
+        request_id, data = self._request_frame(start, count, dac_value)
+        await self._send(data)
+        return request_id
+
+    async def capture(self, start=0, count=0, dac_value=None):
+        await self.request(start, count, dac_value)
+        return await self._receive_capture()
+
+    async def captures(self, n, depth=4, start=0, count=0, dac_value=None):
+        """ Async generator of ``n`` pipelined captures. """
+        sent = 0
+        for _ in range(min(depth, n)):
+            await self.request(start, count, dac_value)
+            sent += 1
+        for _ in range(n):
+            frame = await self._receive_capture()
+            if sent < n:
+                await self.request(start, count, dac_value)
+                sent += 1
+            yield frame
+
+    async def subscribe(self, rate=0.0, start=0, count=0, dac_value=None):
+        request_id = self._new_id()
+        self._streams.add(request_id)
+        await self._send(wire.subscribe_frame(request_id, wire.Subscription(
+            start, count, dac_value, rate)))
+        return request_id
+
+    async def unsubscribe(self, request_id):
+        await self._send(wire.unsubscribe_frame(request_id))
+
+    async def stream(self, rate=0.0, start=0, count=0, dac_value=None,
+                     n=None):
+        """ Async generator of pushed captures, see
+        AcquisitionClient.stream(). """
+        request_id = await self.subscribe(rate, start, count, dac_value)
+        received = 0
+        try:
+            while n is None or received < n:
+                frame = await self._receive_capture()
+                if frame.request_id == request_id:
+                    received += 1
+                    yield frame
+        finally:
+            await self.unsubscribe(request_id)
+            while request_id in self._streams:
+                await self.receive()
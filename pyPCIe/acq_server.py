@@ -0,0 +1,769 @@
+"""Asyncio acquisition server.
+
+One event loop serves all clients. The FPGA is owned by a single device
+task: clients hand it capture requests through a queue, it runs the
+trigger -> wait -> drain cycle in a one-thread executor so the loop never
+blocks, and it is the only code that writes TRIGGER. Requests arriving
+within a short window are coalesced onto one capture, which is broadcast to
+all of them, and a capture younger than a TTL is served from cache, so the
+device load does not grow with the number of viewers. Every client has a
+reader coroutine for its requests and a sender coroutine draining a
+bounded outbound queue; when a client does not keep up, its oldest queued
+capture is dropped.
+
+Clients that open with a wire.py frame speak the framed protocol: every
+MSG_REQUEST is answered by a MSG_CAPTURE frame with sequence number,
+timestamp, layout and DAC value, for the requested word range and DAC
+value. A MSG_SUBSCRIBE frame turns the connection into a stream: while
+any client is subscribed the device task keeps acquiring on its own, as
+fast as the device goes or as slow as the subscriptions allow, and pushes
+every capture to each subscriber whose rate limit admits it, through the
+same drop-oldest outbound queue.
+
+Other clients get the original protocol: a request byte (or any data)
+asks for one capture, the reply is the bare raw BRAM image.
+
+A MSG_HELLO frame selects the payload encoding of the connection: raw
+words, 12-bit packed samples, delta coded and compressed channels, or
+only the peaks and wavelengths the server detects in every capture
+(peaks.py), a few dozen bytes instead of the 64 KiB capture. An encoded
+payload is computed once per capture, range and encoding and
+shared by all clients asking for it.
+
+Captures are acquired into a pool of preallocated buffers and sent
+straight from them: every queued frame is a list of buffers (header bytes
+and a memoryview of the capture) that the sender hands to one sendmsg()
+call together with the other frames waiting, no payload is ever copied.
+Queued frames hold a reference on their capture, a buffer goes back to
+the pool when the last frame using it has been sent or dropped.
+
+    python acq_server.py --host 0.0.0.0 --port 22222 [--sim]
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import socket
+import time
+
+import compression
+import fpga_regs
+import peaks
+import wire
+from acquisition import AcquisitionEngine, Capture, CAPTURE_WORDS
+
+# outbound captures queued per client before the oldest is dropped
+CLIENT_QUEUE = 4
+# seconds to collect requests before triggering one capture for all
+COALESCE_WINDOW = 0.002
+# seconds a capture is served to new requests, 0 always triggers anew
+CAPTURE_TTL = 0.0
+RECV_SIZE = 1024
+# seconds subscribers wait after a failed acquisition before the next one
+FAILURE_BACKOFF = 0.1
+# capture buffers kept for reuse
+POOL_SIZE = 8
+# buffers handed to one sendmsg() call, well below IOV_MAX
+SEND_IOV = 64
+# encoded payloads kept for clients wanting the same one
+ENCODED_CACHE = 16
+
+
+class ServerStats(object):
+    """ Counters of an AcquisitionServer. """
+
+    def __init__(self):
+        self.clients = 0
+        self.connections = 0
+        self.requests = 0
+        self.captures = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.failed = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.sendmsg_calls = 0
+        self.allocated = 0
+        self.encoded = 0
+        self.encoded_bytes = 0
+        self.subscribers = 0
+        self.pushed = 0
+        self.throttled = 0
+
+    def summary(self):
+        return dict(vars(self))
+
+
+class _SocketReader(object):
+    """ Exact-size reads from a non-blocking socket on the running loop.
+    """
+
+    def __init__(self, sock, data=b""):
+        self.sock = sock
+        self.buf = bytearray(data)
+
+    async def readexactly(self, n):
+        """ Read ``n`` bytes, EOFError if the peer closes first. """
+        loop = asyncio.get_running_loop()
+        while len(self.buf) < n:
+            data = await loop.sock_recv(self.sock,
+                                        max(RECV_SIZE, n - len(self.buf)))
+            if not data:
+                raise EOFError("connection closed by peer")
+            self.buf += data
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+
+class CapturePool(object):
+    """ Reference counted capture buffers.
+
+    :meth:`get` hands out a buffer with one reference, :meth:`retain` and
+    :meth:`release` add and drop references; a buffer without references
+    is reused by a later :meth:`get`. Only the event loop thread may call
+    these methods.
+
+    :param int words: capture size in 32-bit words.
+    :param int size: buffers kept for reuse, more are allocated on demand
+                     while all are in use.
+    :param ServerStats stats: ``allocated`` counts new buffers.
+
+    """
+
+    def __init__(self, words=CAPTURE_WORDS, size=POOL_SIZE, stats=None):
+        self.words = words
+        self.size = size
+        self.stats = stats
+        self.__refs = {}
+        self.__free = [Capture(words) for _ in range(size)]
+
+    def get(self):
+        """ Get an unused buffer, holding one reference on it.
+
+        :rtype: acquisition.Capture
+        """
+        if self.__free:
+            capture = self.__free.pop()
+        else:
+            capture = Capture(self.words)
+            if self.stats is not None:
+                self.stats.allocated += 1
+        self.__refs[capture] = 1
+        return capture
+
+    def retain(self, capture):
+        self.__refs[capture] += 1
+
+    def release(self, capture):
+        refs = self.__refs[capture] - 1
+        if refs:
+            self.__refs[capture] = refs
+            return
+        del self.__refs[capture]
+        if len(self.__free) < self.size:
+            self.__free.append(capture)
+
+    def in_use(self):
+        """ Number of buffers with references. """
+        return len(self.__refs)
+
+
+class _Frame(object):
+    """ An outbound reply: buffers to send back to back and the pooled
+    capture they point into, if any. """
+
+    __slots__ = ("buffers", "capture")
+
+    def __init__(self, buffers, capture=None):
+        self.buffers = buffers
+        self.capture = capture
+
+
+class _Session(object):
+    """ State of a framed connection. """
+
+    def __init__(self, out):
+        self.out = out
+        self.encoding = wire.ENC_RAW
+        self.codec = compression.CODEC_ZLIB
+        # request_id -> Subscriber
+        self.subscribers = {}
+
+
+class Subscriber(object):
+    """ A stream of captures pushed to a client.
+
+    :param deliver: called with every capture the subscriber gets.
+    :param int dac_value: DAC value of the captures, None for the engine's.
+    :param float rate: captures per second, 0 for every capture.
+
+    """
+
+    def __init__(self, deliver, dac_value=None, rate=0.0):
+        self.deliver = deliver
+        self.dac_value = dac_value
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.due = 0.0
+
+    def offer(self, capture, now):
+        """ Deliver a capture unless the rate limit says to skip it.
+
+        :rtype: bool
+        """
+        if now < self.due:
+            return False
+        # at most one interval of credit, no bursts after a stall
+        self.due = max(self.due, now - self.interval) + self.interval
+        self.deliver(capture)
+        return True
+
+
+class DeviceOwner(object):
+    """ Serializes all access to the FPGA.
+
+    :meth:`capture` registers a request with the device task started by
+    :meth:`run`. The task collects the requests arriving within
+    ``coalesce_window`` seconds, acquires one capture for all of them in a
+    dedicated executor thread and hands every request the same Capture
+    object. Captures come from a CapturePool; the owner keeps a reference
+    on the latest one, whoever keeps a capture for longer must retain it.
+    While subscribers are
+    registered with :meth:`subscribe` the task also acquires without
+    requests, whenever a subscriber is due, and offers every capture to all
+    subscribers with the capture's DAC value.
+
+    :param control_bar: Bar holding the control registers.
+    :param samples_bar: Bar holding the sample BRAM.
+    :param int words: capture size in 32-bit words.
+    :param dac_value: DAC value per capture, see AcquisitionEngine.
+    :param ServerStats stats: counters to update.
+    :param float coalesce_window: seconds to wait for more requests before
+                                  triggering.
+    :param float ttl: seconds the latest capture answers new requests
+                      without triggering, 0 disables the cache.
+    :param int pool_size: capture buffers kept for reuse.
+
+    """
+
+    def __init__(self, control_bar, samples_bar, words=CAPTURE_WORDS,
+                 dac_value=None, stats=None,
+                 coalesce_window=COALESCE_WINDOW, ttl=CAPTURE_TTL,
+                 pool_size=POOL_SIZE):
+        self.engine = AcquisitionEngine(control_bar, samples_bar, words,
+                                        dac_value=dac_value)
+        self.stats = ServerStats() if stats is None else stats
+        self.pool = CapturePool(words, pool_size, self.stats)
+        self.coalesce_window = coalesce_window
+        self.ttl = ttl
+        self.latest = None
+        self.__latest_dac = None
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="device")
+        # DAC value (None: engine default) -> futures waiting for it
+        self.__waiters = {}
+        self.__subscribers = []
+        # created by run(), an Event made outside of a running loop binds
+        # to the wrong loop before Python 3.10
+        self.__wakeup = None
+
+    def cached(self, dac_value=None):
+        """ The latest capture if it is younger than the TTL and was taken
+        with the requested DAC value, else None. """
+        if self.latest is not None and self.ttl > 0 and \
+                self.__latest_dac == dac_value and \
+                time.time() - self.latest.timestamp < self.ttl:
+            return self.latest
+        return None
+
+    async def capture(self, dac_value=None):
+        """ Get a capture triggered after this call, or a cached one.
+
+        :param int dac_value: DAC value to acquire with, None for the
+                              engine's. Only requests with the same DAC
+                              value share a capture.
+        :rtype: acquisition.Capture
+        :raises fpga_regs.WaitTimeout: if the FPGA did not finish.
+        :raises ValueError: if the DAC value is out of range.
+        :raises Exception: whatever else failed the acquisition.
+        """
+        capture = self.cached(dac_value)
+        if capture is not None:
+            self.stats.cache_hits += 1
+            return capture
+        future = asyncio.get_running_loop().create_future()
+        self.__waiters.setdefault(dac_value, []).append(future)
+        self.__wake()
+        return await future
+
+    def subscribe(self, subscriber):
+        """ Start pushing captures to a Subscriber. """
+        self.__subscribers.append(subscriber)
+        self.stats.subscribers += 1
+        self.__wake()
+
+    def __wake(self):
+        # before run() started there is nobody to wake, it looks at the
+        # waiters and subscribers first
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    def unsubscribe(self, subscriber):
+        """ Stop pushing captures to a Subscriber, if it is registered. """
+        if subscriber in self.__subscribers:
+            self.__subscribers.remove(subscriber)
+            self.stats.subscribers -= 1
+
+    def __next_due(self):
+        """ The subscriber due first, None without subscribers. """
+        if not self.__subscribers:
+            return None
+        return min(self.__subscribers, key=lambda s: s.due)
+
+    def __publish(self, capture, dac_value):
+        now = time.time()
+        for subscriber in list(self.__subscribers):
+            if subscriber.dac_value != dac_value:
+                continue
+            if subscriber.offer(capture, now):
+                self.stats.pushed += 1
+            else:
+                self.stats.throttled += 1
+
+    async def run(self):
+        """ Device task, serves capture requests and subscribers until
+        cancelled. """
+        loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        while True:
+            if not self.__waiters:
+                subscriber = self.__next_due()
+                delay = None if subscriber is None else \
+                    subscriber.due - time.time()
+                if delay is None or delay > 0:
+                    # idle until a request, a new subscriber or the next
+                    # subscriber due
+                    self.__wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.__wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                dac_value = subscriber.dac_value
+            elif self.coalesce_window > 0:
+                await asyncio.sleep(self.coalesce_window)
+            if self.__waiters:
+                # oldest DAC value first, requests arriving from now on
+                # wait for the next capture
+                dac_value = next(iter(self.__waiters))
+            batch = [f for f in self.__waiters.pop(dac_value, ())
+                     if not f.cancelled()]
+            if not batch and not any(s.dac_value == dac_value
+                                     for s in self.__subscribers):
+                continue
+            capture = self.pool.get()
+            try:
+                await loop.run_in_executor(
+                    self.__executor, self.engine.acquire_into, capture,
+                    dac_value)
+            except Exception as e:
+                # fail this batch only, the device task has to keep
+                # serving everybody else
+                self.pool.release(capture)
+                self.stats.failed += 1
+                for future in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                retry = time.time() + FAILURE_BACKOFF
+                for subscriber in self.__subscribers:
+                    if subscriber.dac_value == dac_value:
+                        subscriber.due = max(subscriber.due, retry)
+                continue
+            self.stats.captures += 1
+            self.stats.coalesced += max(len(batch) - 1, 0)
+            # waiters resume before the next capture completes, so they
+            # can retain this one while it is still the latest
+            if self.latest is not None:
+                self.pool.release(self.latest)
+            self.latest = capture
+            self.__latest_dac = dac_value
+            for future in batch:
+                if not future.cancelled():
+                    future.set_result(capture)
+            self.__publish(capture, dac_value)
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+
+
+class AcquisitionServer(object):
+    """ TCP server handing out captures of a DeviceOwner.
+
+    :param DeviceOwner owner: the device.
+    :param str host: address to listen on.
+    :param int port: TCP port.
+    :param bytes request: request byte, every occurrence asks for one
+                          capture. None makes every received chunk a
+                          request.
+    :param int queue_size: outbound captures queued per client.
+    :param bool verbose: log requests.
+    :param int layout: wire.LAYOUT_* channel layout of the captures.
+    :param peaks.PeakDetector detector: peak detection of peaks-only
+                                        clients, one with the default
+                                        parameters is made on first use
+                                        if None.
+
+    """
+
+    def __init__(self, owner, host="0.0.0.0", port=22222, request=b"s",
+                 queue_size=CLIENT_QUEUE, verbose=False,
+                 layout=wire.LAYOUT_AB, detector=None):
+        self.owner = owner
+        self.layout = layout
+        self.detector = detector
+        self.stats = owner.stats
+        self.host = host
+        self.port = port
+        self.request = request
+        self.queue_size = queue_size
+        self.verbose = verbose
+        self.sock = None
+        self.__encoded = collections.OrderedDict()
+
+    def listen(self, backlog=128):
+        """ Bind the listening socket, port 0 picks a free port. """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(backlog)
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        return self.sock
+
+    def _queue(self, out, frame):
+        """ Queue an outbound _Frame (None: close), dropping the oldest one
+        when full. """
+        if out.full():
+            self._release(out.get_nowait())
+            self.stats.dropped += 1
+        if frame is not None and frame.capture is not None:
+            self.owner.pool.retain(frame.capture)
+        out.put_nowait(frame)
+
+    def _error(self, out, request_id, message):
+        self._queue(out, _Frame([wire.error_frame(request_id, message)]))
+
+    def _release(self, frame):
+        if frame is not None and frame.capture is not None:
+            self.owner.pool.release(frame.capture)
+
+    async def _writable(self, sock):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = sock.fileno()
+        loop.add_writer(fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            loop.remove_writer(fd)
+
+    async def _sendmsg(self, sock, buffers):
+        """ Send buffers back to back with as few sendmsg() calls as the
+        socket buffer allows. """
+        # empty buffers (e.g. a capture without peaks) would make every
+        # call send 0 bytes without ever finishing
+        buffers = [memoryview(b).cast("B") for b in buffers if len(b)]
+        first = 0
+        while first < len(buffers):
+            try:
+                n = sock.sendmsg(buffers[first:first + SEND_IOV])
+            except (BlockingIOError, InterruptedError):
+                await self._writable(sock)
+                continue
+            self.stats.sendmsg_calls += 1
+            self.stats.sent_bytes += n
+            # skip what went out, a partial buffer continues next call
+            while first < len(buffers) and n >= len(buffers[first]):
+                n -= len(buffers[first])
+                first += 1
+            if n:
+                buffers[first] = buffers[first][n:]
+
+    async def _sender(self, sock, out):
+        """ Send queued frames, all frames waiting at once in one batch.
+        """
+        frames = []
+        try:
+            while True:
+                frames.append(await out.get())
+                while not out.empty() and frames[-1] is not None:
+                    frames.append(out.get_nowait())
+                closing = frames[-1] is None
+                if closing:
+                    frames.pop()
+                await self._sendmsg(sock, [data for frame in frames
+                                           for data in frame.buffers])
+                self.stats.sent += len(frames)
+                for frame in frames:
+                    self._release(frame)
+                frames = []
+                if closing:
+                    return
+        finally:
+            for frame in frames:
+                self._release(frame)
+
+    async def _serve_requests(self, sock, out):
+        loop = asyncio.get_running_loop()
+        buf = bytearray(RECV_SIZE)
+        n = await loop.sock_recv_into(sock, buf)
+        if n and buf[:1] == wire.MAGIC[:1]:
+            await self._serve_frames(sock, out, _SocketReader(sock, buf[:n]))
+            return
+        while n:
+            count = 1 if self.request is None else \
+                buf[:n].count(self.request)
+            for _ in range(count):
+                self.stats.requests += 1
+                if self.verbose:
+                    print("[Server] Request received from client.")
+                capture = await self.owner.capture()
+                self._queue(out, _Frame([capture.raw], capture))
+            n = await loop.sock_recv_into(sock, buf)
+
+    def _encode(self, capture, start, stop, encoding, codec):
+        """ Encoded payload of a capture range, cached for other clients.
+
+        :returns: ``(encoding used, payload)``
+        """
+        if encoding == wire.ENC_PEAKS:
+            # detection always covers the whole capture
+            start, stop, codec = 0, 0, 0
+        key = (capture.seq, start, stop, encoding, codec)
+        try:
+            return self.__encoded[key]
+        except KeyError:
+            pass
+        if encoding == wire.ENC_PEAKS:
+            if self.detector is None:
+                self.detector = peaks.PeakDetector()
+            result = (wire.ENC_PEAKS,
+                      self.detector.detect_capture(capture.raw).tobytes())
+        else:
+            result = wire.encode_payload(
+                memoryview(capture.raw)[4 * start:4 * stop], encoding,
+                codec)
+        self.stats.encoded += 1
+        self.stats.encoded_bytes += len(result[1])
+        self.__encoded[key] = result
+        if len(self.__encoded) > ENCODED_CACHE:
+            self.__encoded.popitem(last=False)
+        return result
+
+    def _capture_frame(self, session, capture, start, stop, request_id):
+        if session.encoding == wire.ENC_RAW:
+            return _Frame([wire.capture_header(capture, start, stop,
+                                               request_id, self.layout),
+                           memoryview(capture.raw)[4 * start:4 * stop]],
+                          capture)
+        encoding, payload = self._encode(capture, start, stop,
+                                         session.encoding, session.codec)
+        if encoding == wire.ENC_RAW:
+            # samples above 12 bits, the raw words go out zero-copy
+            return _Frame([wire.capture_header(capture, start, stop,
+                                               request_id, self.layout),
+                           payload], capture)
+        count = len(payload) // peaks.PEAK_DTYPE.itemsize \
+            if encoding == wire.ENC_PEAKS else None
+        return _Frame([wire.capture_header(capture, start, stop, request_id,
+                                           self.layout, encoding,
+                                           len(payload), count), payload])
+
+    def _subscribe(self, session, request_id, payload):
+        """ Register a subscription of a framed client.
+
+        :rtype: Subscriber
+        """
+        subscription = wire.Subscription.unpack(payload)
+        start, stop = subscription.roi(self.owner.engine.words)
+        if subscription.dac_value is not None:
+            # a stream cannot report a failing DAC value per capture
+            self.owner.engine.regs.register("DACVALUE").field(
+                "VALUE").insert(0, subscription.dac_value)
+        subscriber = Subscriber(
+            lambda capture: self._queue(session.out, self._capture_frame(
+                session, capture, start, stop, request_id)),
+            subscription.dac_value, subscription.rate)
+        self.owner.subscribe(subscriber)
+        return subscriber
+
+    async def _serve_frames(self, sock, out, reader):
+        """ Serve a client speaking the framed protocol. """
+        session = _Session(out)
+        try:
+            await self._serve_frame_loop(session, reader)
+        finally:
+            for subscriber in session.subscribers.values():
+                self.owner.unsubscribe(subscriber)
+
+    async def _serve_frame_loop(self, session, reader):
+        out = session.out
+        subscribers = session.subscribers
+        while True:
+            try:
+                data = await reader.readexactly(wire.HEADER.size)
+            except EOFError:
+                return
+            header = wire.Header.unpack(data)
+            if header.length > wire.MAX_REQUEST_PAYLOAD:
+                raise wire.ProtocolError("request payload of %d bytes" %
+                                         (header.length))
+            payload = await reader.readexactly(header.length)
+            if header.type == wire.MSG_SUBSCRIBE:
+                if header.request_id in subscribers:
+                    self._error(out, header.request_id,
+                                "stream %d already open" %
+                                (header.request_id))
+                    continue
+                try:
+                    subscribers[header.request_id] = self._subscribe(
+                        session, header.request_id, payload)
+                except ValueError as e:
+                    self._error(out, header.request_id, str(e))
+                continue
+            if header.type == wire.MSG_UNSUBSCRIBE:
+                subscriber = subscribers.pop(header.request_id, None)
+                if subscriber is not None:
+                    self.owner.unsubscribe(subscriber)
+                self._queue(out, _Frame(
+                    [wire.unsubscribe_frame(header.request_id)]))
+                continue
+            if header.type == wire.MSG_HELLO:
+                try:
+                    hello = wire.Hello.unpack(payload).supported()
+                except ValueError as e:
+                    self._error(out, header.request_id, str(e))
+                    continue
+                session.encoding = hello.encoding
+                session.codec = hello.codec
+                self._queue(out, _Frame([wire.hello_frame(
+                    hello, header.request_id)]))
+                continue
+            if header.type != wire.MSG_REQUEST:
+                self._error(out, header.request_id,
+                            "unsupported message type %d" % (header.type))
+                continue
+            self.stats.requests += 1
+            try:
+                request = wire.Request.unpack(payload)
+                start, stop = request.roi(self.owner.engine.words)
+                capture = await self.owner.capture(request.dac_value)
+            except Exception as e:
+                self._error(out, header.request_id, str(e) or repr(e))
+                continue
+            self._queue(out, self._capture_frame(session, capture, start,
+                                                 stop, header.request_id))
+
+    async def handle_client(self, sock, addr):
+        """ Serve one connection until the peer closes it. """
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        out = asyncio.Queue(self.queue_size)
+        sender = asyncio.create_task(self._sender(sock, out))
+        reader = asyncio.create_task(self._serve_requests(sock, out))
+        self.stats.clients += 1
+        self.stats.connections += 1
+        try:
+            done, _ = await asyncio.wait([reader, sender],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+            # peer closed its side, send what is queued
+            self._queue(out, None)
+            await sender
+        except fpga_regs.WaitTimeout as e:
+            print("[Server] Acquisition failed: %s" % (e))
+        except wire.ProtocolError as e:
+            print("[Server] Protocol error: %s" % (e))
+        except (ConnectionError, EOFError, OSError):
+            pass
+        except Exception as e:
+            print("[Server] Acquisition failed: %r" % (e))
+        finally:
+            reader.cancel()
+            sender.cancel()
+            # let the sender drop its writer callback before the socket
+            # goes, then give back the captures of unsent frames
+            await asyncio.gather(reader, sender, return_exceptions=True)
+            while not out.empty():
+                self._release(out.get_nowait())
+            self.stats.clients -= 1
+            sock.close()
+            print("[Server] Connection from %s:%d closed" % addr[:2])
+
+    async def serve_forever(self):
+        """ Run the device task and accept clients until cancelled. """
+        if self.sock is None:
+            self.listen()
+        loop = asyncio.get_running_loop()
+        device = asyncio.create_task(self.owner.run())
+        clients = set()
+        print("[Server] Listening on %s:%d" % (self.host, self.port))
+        try:
+            while True:
+                sock, addr = await loop.sock_accept(self.sock)
+                print("[Server] Accepted connection from %s:%d" % addr[:2])
+                task = asyncio.create_task(self.handle_client(sock, addr))
+                clients.add(task)
+                task.add_done_callback(clients.discard)
+        finally:
+            for task in list(clients) + [device]:
+                task.cancel()
+            self.sock.close()
+            self.owner.close()
+
+
+def run(bars, host, port, dac_value=None, request=b"s", verbose=True,
+        coalesce_window=COALESCE_WINDOW, ttl=CAPTURE_TTL):
+    """ Serve captures of a [control BAR, samples BAR] pair until Ctrl+C.
+    """
+    owner = DeviceOwner(bars[0], bars[1], dac_value=dac_value,
+                        coalesce_window=coalesce_window, ttl=ttl)
+    server = AcquisitionServer(owner, host, port, request, verbose=verbose)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\n[Server] Shutting down gracefully.")
+        print("[Server] %s" % (server.stats.summary()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Acquisition server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=22222)
+    parser.add_argument("--dac", type=int, default=0x14)
+    parser.add_argument("--window", type=float, default=COALESCE_WINDOW,
+                        help="seconds to coalesce requests onto a capture")
+    parser.add_argument("--ttl", type=float, default=CAPTURE_TTL,
+                        help="seconds a capture is served from cache")
+    parser.add_argument("--sim", action="store_true",
+                        help="serve captures of the simulated FPGA")
+    args = parser.parse_args()
+
+    if args.sim:
+        import fpga_sim
+        with fpga_sim.FpgaModel(fpga_sim.synthetic_captures(), 0.001) as m:
+            run([m.control, m.samples], args.host, args.port, args.dac,
+                coalesce_window=args.window, ttl=args.ttl)
+        return
+    from pypcie import Device
+    from pypcie.config import PCI_COMMAND_MEMORY
+    d = Device.get("0000:01:00.0")
+    d.config.set_command_bits(PCI_COMMAND_MEMORY)
+    run([d.bar[1], d.bar[0]], args.host, args.port, args.dac,
+        coalesce_window=args.window, ttl=args.ttl)
+
+
+if __name__ == "__main__":
+    main()
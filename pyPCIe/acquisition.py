@@ -0,0 +1,308 @@
+"""Pipelined acquisition engine.
+
+The FPGA has a single sample BRAM, so a capture can be triggered as soon as
+the previous one has been drained into host memory. AcquisitionEngine runs
+trigger -> wait -> drain in a device thread that fills a pool of
+preallocated capture buffers, while a consumer thread decodes and analyses
+the filled buffers. The sustained capture rate is then bounded by the
+slowest stage instead of the sum of all stages.
+
+    engine = AcquisitionEngine(control_bar, samples_bar, dac_value=20)
+    engine.start(handler)      # handler(capture) runs in the consumer thread
+    ...
+    engine.stop()
+
+An error other than a capture timeout stops the acquisition, it is raised
+by the next :meth:`AcquisitionEngine.next_capture` or by
+:meth:`AcquisitionEngine.stop`.
+"""
+import queue
+import threading
+import time
+
+import decode
+import fpga_regs
+
+# 16K words of 2 x 16 bit samples
+CAPTURE_WORDS = 16 * 1024
+
+
+class Capture(object):
+    """ A preallocated capture buffer with its metadata.
+
+    :param int words: capture size in 32-bit words.
+
+    """
+
+    def __init__(self, words=CAPTURE_WORDS):
+        self.raw = bytearray(4 * words)
+        self.words = decode.as_words(self.raw)
+        self.seq = -1
+        self.timestamp = 0.0
+        self.dac_value = None
+
+    @property
+    def samples(self):
+        """ (N, 2) uint16 view, column 0 low and column 1 high half-word. """
+        return decode.as_samples(self.raw)
+
+    def channels(self, layout=decode.LAYOUT_AB, signed=False):
+        """ Split into named channel views, see decode.split(). """
+        return decode.split(self.raw, layout, signed)
+
+    def copy_from(self, other):
+        """ Copy samples and metadata of another capture into this one. """
+        self.raw[:] = other.raw
+        self.seq = other.seq
+        self.timestamp = other.timestamp
+        self.dac_value = other.dac_value
+
+
+class AcquisitionStats(object):
+    """ Counters and accumulated stage times of an AcquisitionEngine,
+    updated under ``lock`` by the device and the consumer side. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.trigger_time = 0.0
+        self.drain_time = 0.0
+        self.consume_time = 0.0
+        self.started = time.perf_counter()
+
+    def summary(self):
+        """ Get the statistics as a dict, stage times as per-capture means
+        in seconds. """
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            captured = self.captured or 1
+            delivered = self.delivered or 1
+            return {
+                "captured": self.captured,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "captures_per_s": self.captured / elapsed if elapsed
+                else 0.0,
+                "trigger_wait_s": self.trigger_time / captured,
+                "drain_s": self.drain_time / captured,
+                "consume_s": self.consume_time / delivered,
+            }
+
+
+class AcquisitionEngine(object):
+    """ Double (or more) buffered acquisition from the FPGA.
+
+    :param control_bar: Bar holding the control registers (fpga_regs).
+    :param samples_bar: Bar holding the sample BRAM.
+    :param int words: capture size in 32-bit words.
+    :param int buffers: number of capture buffers, at least 2.
+    :param dac_value: DAC value per capture, an int, a callable returning
+                      one, or None to leave DACVALUE untouched.
+    :param float timeout: seconds to wait for one capture.
+    :param int read_width: BAR access width used to drain the BRAM.
+    :param bool drop_oldest: when all buffers are waiting for the consumer,
+                             overwrite the oldest one (counted as dropped)
+                             instead of pausing acquisition.
+
+    """
+
+    def __init__(self, control_bar, samples_bar, words=CAPTURE_WORDS,
+                 buffers=2, dac_value=None,
+                 timeout=fpga_regs.ACQUISITION_TIMEOUT, read_width=4,
+                 drop_oldest=True):
+        if buffers < 2:
+            raise ValueError("at least two capture buffers are required")
+        self.regs = fpga_regs.control_regs(control_bar)
+        self.samples_bar = samples_bar
+        self.words = words
+        self.dac_value = dac_value
+        self.timeout = timeout
+        self.read_width = read_width
+        self.drop_oldest = drop_oldest
+        self.stats = AcquisitionStats()
+        self.error = None
+        self.__seq = 0
+        self.__free = queue.Queue()
+        self.__ready = queue.Queue()
+        for _ in range(buffers):
+            self.__free.put(Capture(words))
+        self.__running = threading.Event()
+        self.__threads = []
+        self.__device_lock = threading.Lock()
+
+    def acquire_into(self, capture, dac_value=None):
+        """ Run one trigger -> wait -> drain cycle into ``capture``.
+
+        :param int dac_value: DAC value of this capture instead of the
+                              engine's ``dac_value``.
+        :raises fpga_regs.WaitTimeout: if the FPGA does not finish in time.
+        :returns: ``capture``
+        """
+        dac = self.dac_value if dac_value is None else dac_value
+        dac = dac() if callable(dac) else dac
+        with self.__device_lock:
+            t0 = time.perf_counter()
+            fpga_regs.trigger(self.regs, dac)
+            fpga_regs.wait_idle(self.regs, self.timeout)
+            t1 = time.perf_counter()
+            self.samples_bar.readinto(capture.raw, 0, self.read_width)
+            t2 = time.perf_counter()
+            capture.seq = self.__seq
+            self.__seq += 1
+        capture.timestamp = time.time()
+        capture.dac_value = dac
+        stats = self.stats
+        with stats.lock:
+            stats.captured += 1
+            stats.trigger_time += t1 - t0
+            stats.drain_time += t2 - t1
+        return capture
+
+    def acquire(self, dac_value=None):
+        """ Acquire a single capture into a new buffer, without the
+        pipeline. """
+        return self.acquire_into(Capture(self.words), dac_value)
+
+    def __free_buffer(self):
+        """ Get a buffer to acquire into, recycling the oldest undelivered
+        capture if the consumer is behind. None if stopped. """
+        while self.__running.is_set():
+            try:
+                return self.__free.get_nowait()
+            except queue.Empty:
+                pass
+            if self.drop_oldest:
+                try:
+                    capture = self.__ready.get_nowait()
+                    with self.stats.lock:
+                        self.stats.dropped += 1
+                    return capture
+                except queue.Empty:
+                    pass
+            try:
+                return self.__free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def __fail(self, error):
+        """ Keep the first error for the caller and stop acquiring. """
+        if self.error is None:
+            self.error = error
+        self.__running.clear()
+
+    def __raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def __device_loop(self):
+        while self.__running.is_set():
+            capture = self.__free_buffer()
+            if capture is None:
+                break
+            try:
+                self.acquire_into(capture)
+            except fpga_regs.WaitTimeout:
+                with self.stats.lock:
+                    self.stats.failed += 1
+                self.__free.put(capture)
+                continue
+            except Exception as e:
+                with self.stats.lock:
+                    self.stats.failed += 1
+                self.__free.put(capture)
+                self.__fail(e)
+                break
+            self.__ready.put(capture)
+
+    def __get(self, timeout):
+        try:
+            capture = self.__ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self.stats.lock:
+            self.stats.delivered += 1
+        return capture
+
+    def __consumer_loop(self, handler):
+        while self.__running.is_set():
+            capture = self.__get(0.1)
+            if capture is None:
+                continue
+            t0 = time.perf_counter()
+            try:
+                handler(capture)
+            except Exception as e:
+                self.__fail(e)
+            finally:
+                with self.stats.lock:
+                    self.stats.consume_time += time.perf_counter() - t0
+                self.release(capture)
+
+    def next_capture(self, timeout=None):
+        """ Get the oldest filled capture, or None after ``timeout``
+        seconds. Hand it back with :meth:`release` when done.
+
+        :raises Exception: the error that stopped the device thread.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.__raise_error()
+            # wake up now and then to notice a failed device thread
+            wait = 0.1 if deadline is None else \
+                min(deadline - time.monotonic(), 0.1)
+            capture = self.__get(max(wait, 0.0))
+            if capture is not None:
+                return capture
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def release(self, capture):
+        """ Return a capture obtained from :meth:`next_capture`. """
+        self.__free.put(capture)
+
+    def start(self, handler=None):
+        """ Start the device thread and, if ``handler`` is given, a consumer
+        thread calling ``handler(capture)`` for every filled capture.
+        Without a handler, pull captures with :meth:`next_capture`. """
+        if self.__running.is_set():
+            raise RuntimeError("acquisition already running")
+        self.stats = AcquisitionStats()
+        self.error = None
+        self.__running.set()
+        self.__threads = [threading.Thread(target=self.__device_loop,
+                                           name="acq-device", daemon=True)]
+        if handler is not None:
+            self.__threads.append(threading.Thread(
+                target=self.__consumer_loop, args=(handler,),
+                name="acq-consumer", daemon=True))
+        for t in self.__threads:
+            t.start()
+
+    def stop(self, timeout=None):
+        """ Stop acquisition and wait for the threads to finish.
+
+        :raises Exception: the error that stopped the device or consumer
+                           thread, if not raised by :meth:`next_capture`.
+        """
+        self.__running.clear()
+        for t in self.__threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+        self.__threads = []
+        # hand undelivered captures back to the pool
+        while True:
+            try:
+                self.__free.put(self.__ready.get_nowait())
+            except queue.Empty:
+                break
+        self.__raise_error()
+
+    @property
+    def running(self):
+        return self.__running.is_set()
@@ -1,8 +1,7 @@
 from pypcie import Device
 import struct
 
-TRIGGER_REG = 0x0
-BUSY_REG = 0x8
+from fpga_regs import TRIGGER_REG, BUSY_REG
 
 # Bind to PCI device at "0000:01:00.0"
 d = Device("0000:01:00.0")
@@ -0,0 +1,315 @@
+"""Load test of the acquisition server against the simulated FPGA.
+
+The server runs in its own process on top of fpga_sim.FpgaModel, with the
+settings of one of the server scripts (--preset). Client connections are
+spread over several client processes so the clients are not what limits
+the measurement. After a warm-up every client counts the captures and
+bytes it receives for --duration seconds and records one latency per
+capture:
+
+    request   framed requests with --depth in flight (acq_client), the
+              request -> capture round trip
+    stream    framed subscriptions at --rate (0: every capture), the age of
+              a capture on arrival
+    legacy    the original protocol, one "s" byte and a bare 64 KiB image,
+              the round trip
+
+The result is one JSON document with captures/s, MB/s, latency
+percentiles, the server's CPU use over the measurement and its counters,
+so runs can be compared across versions:
+
+    python bench_server.py --clients 100 --mode legacy \\
+        --preset server_aquasition -o before.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import sys
+import time
+
+import numpy as np
+
+import acq_server
+import fpga_sim
+import wire
+
+PRESETS = {
+    # acq_server.py defaults
+    "acq_server": dict(request=b"s", dac=0x14,
+                       window=acq_server.COALESCE_WINDOW,
+                       ttl=acq_server.CAPTURE_TTL),
+    "server_aquasition": dict(request=b"s", dac=0x64, window=0.002,
+                              ttl=0.05),
+    # every received chunk is a request
+    "continous_send": dict(request=None, dac=0x14,
+                           window=acq_server.COALESCE_WINDOW,
+                           ttl=acq_server.CAPTURE_TTL),
+}
+MODES = ("request", "stream", "legacy")
+# seconds for all processes to start before the clock starts
+STARTUP = 1.0
+
+
+def _server_main(pipe, preset, capture_time):
+    """ Server process: report the port, serve until told to exit, report
+    the CPU time between the "start" and "stop" messages. """
+    config = PRESETS[preset]
+    # keep the connection log out of the JSON on stdout
+    sys.stdout = open(os.devnull, "w")
+    captures = fpga_sim.synthetic_captures(signal_high=True)
+    with fpga_sim.FpgaModel(captures, capture_time) as model:
+        owner = acq_server.DeviceOwner(
+            model.control, model.samples, dac_value=config["dac"],
+            coalesce_window=config["window"], ttl=config["ttl"])
+        server = acq_server.AcquisitionServer(
+            owner, "127.0.0.1", 0, config["request"], verbose=False)
+        server.listen()
+        pipe.send(server.port)
+        asyncio.run(_serve(server, pipe))
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _serve(server, pipe):
+    loop = asyncio.get_running_loop()
+    task = asyncio.create_task(server.serve_forever())
+    await loop.run_in_executor(None, pipe.recv)
+    cpu, wall = _cpu_time(), time.perf_counter()
+    before = server.stats.summary()
+    await loop.run_in_executor(None, pipe.recv)
+    cpu, wall = _cpu_time() - cpu, time.perf_counter() - wall
+    after = server.stats.summary()
+    # serve the clients' last requests until they all closed
+    await loop.run_in_executor(None, pipe.recv)
+    task.cancel()
+    pipe.send({
+        "cpu_s": cpu,
+        "cpu_percent": 100.0 * cpu / wall,
+        "captures": after["captures"] - before["captures"],
+        "stats": after,
+    })
+
+
+class _Counter(object):
+    """ What one client received inside the measurement window. """
+
+    def __init__(self, begin, end):
+        self.begin = begin
+        self.end = end
+        self.captures = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def add(self, nbytes, latency):
+        if self.begin <= time.time() < self.end:
+            self.captures += 1
+            self.bytes += nbytes
+            self.latencies.append(latency)
+
+
+async def _request_client(port, counter, depth, encoding):
+    import acq_client
+    client = await acq_client.AsyncAcquisitionClient.connect(
+        "127.0.0.1", port, encoding)
+    async with client:
+        for _ in range(depth):
+            await client.request()
+        while time.time() < counter.end:
+            frame = await client.receive()
+            if not isinstance(frame, acq_client.Frame):
+                continue
+            counter.add(wire.HEADER.size + frame.header.length,
+                        frame.latency)
+            await client.request()
+
+
+async def _stream_client(port, counter, rate, encoding):
+    import acq_client
+    client = await acq_client.AsyncAcquisitionClient.connect(
+        "127.0.0.1", port, encoding)
+    async with client:
+        await client.subscribe(rate)
+        while time.time() < counter.end:
+            frame = await client.receive()
+            if isinstance(frame, acq_client.Frame):
+                counter.add(wire.HEADER.size + frame.header.length,
+                            time.time() - frame.timestamp)
+
+
+async def _legacy_client(port, counter, words):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    buf = memoryview(bytearray(4 * words))
+    try:
+        await loop.sock_connect(sock, ("127.0.0.1", port))
+        while time.time() < counter.end:
+            sent = time.perf_counter()
+            await loop.sock_sendall(sock, b"s")
+            view = buf
+            while len(view):
+                n = await loop.sock_recv_into(sock, view)
+                if not n:
+                    raise ConnectionError("connection closed by server")
+                view = view[n:]
+            counter.add(len(buf), time.perf_counter() - sent)
+    finally:
+        sock.close()
+
+
+async def _run_clients(port, count, args, begin, end):
+    counters = [_Counter(begin, end) for _ in range(count)]
+    if args.mode == "request":
+        clients = [_request_client(port, c, args.depth, args.encoding)
+                   for c in counters]
+    elif args.mode == "stream":
+        clients = [_stream_client(port, c, args.rate, args.encoding)
+                   for c in counters]
+    else:
+        clients = [_legacy_client(port, c, args.words) for c in counters]
+    await asyncio.sleep(max(begin - args.warmup - time.time(), 0.0))
+    results = await asyncio.gather(*clients, return_exceptions=True)
+    errors = [repr(r) for r in results if isinstance(r, BaseException)]
+    return {
+        "captures": sum(c.captures for c in counters),
+        "bytes": sum(c.bytes for c in counters),
+        "latencies": [x for c in counters for x in c.latencies],
+        "errors": errors,
+    }
+
+
+def _clients_main(queue, port, count, args, begin, end):
+    """ Client process running ``count`` connections on one event loop.
+    """
+    queue.put(asyncio.run(_run_clients(port, count, args, begin, end)))
+
+
+def run(args):
+    """ Run one load test.
+
+    :param argparse.Namespace args: parsed command line.
+    :rtype: dict
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    server = ctx.Process(target=_server_main,
+                         args=(child, args.preset, args.capture_time))
+    server.start()
+    try:
+        port = parent.recv()
+        procs = min(args.procs, args.clients)
+        start = time.time() + STARTUP
+        begin = start + args.warmup
+        end = begin + args.duration
+        queue = ctx.Queue()
+        workers = []
+        for k in range(procs):
+            count = args.clients // procs + (k < args.clients % procs)
+            workers.append(ctx.Process(
+                target=_clients_main,
+                args=(queue, port, count, args, begin, end)))
+        for worker in workers:
+            worker.start()
+        time.sleep(max(begin - time.time(), 0.0))
+        parent.send("start")
+        time.sleep(max(end - time.time(), 0.0))
+        parent.send("stop")
+        results = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        parent.send("exit")
+        server_result = parent.recv()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+    captures = sum(r["captures"] for r in results)
+    nbytes = sum(r["bytes"] for r in results)
+    latencies = np.array([x for r in results for x in r["latencies"]])
+    if len(latencies):
+        p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+        latency = {"p50": p50, "p99": p99, "p999": p999,
+                   "mean": latencies.mean(), "max": latencies.max()}
+    else:
+        latency = {}
+    return {
+        "config": {
+            "preset": args.preset,
+            "mode": args.mode,
+            "clients": args.clients,
+            "client_procs": procs,
+            "depth": args.depth,
+            "rate": args.rate,
+            "encoding": wire.ENCODING_NAMES[args.encoding],
+            "capture_time_s": args.capture_time,
+            "duration_s": args.duration,
+            "label": args.label,
+        },
+        "captures": captures,
+        "captures_per_s": captures / args.duration,
+        "mb_per_s": nbytes / args.duration / 1e6,
+        "latency_kind": "capture_age" if args.mode == "stream"
+        else "round_trip",
+        "latency_s": latency,
+        "client_errors": [e for r in results for e in r["errors"]],
+        "server": server_result,
+        "host": {"python": platform.python_version(),
+                 "machine": platform.machine(), "cpus": os.cpu_count()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the acquisition server on a simulated FPGA")
+    parser.add_argument("--preset", choices=sorted(PRESETS),
+                        default="acq_server",
+                        help="server settings of this script")
+    parser.add_argument("--mode", choices=MODES, default="request")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--procs", type=int,
+                        default=min(4, os.cpu_count() or 1),
+                        help="client processes")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=1.0,
+                        help="seconds before the measurement")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="requests in flight per client (request)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="captures per second per client (stream)")
+    parser.add_argument("--encoding", default="raw",
+                        choices=sorted(wire.ENCODING_NAMES.values()))
+    parser.add_argument("--capture-time", type=float, default=0.001,
+                        help="simulated trigger to BRAM full seconds")
+    parser.add_argument("--words", type=int, default=fpga_sim.BRAM_WORDS,
+                        help="capture size of legacy replies")
+    parser.add_argument("--label", help="free text stored in the result")
+    parser.add_argument("-o", "--output", help="JSON file, stdout if "
+                        "not given")
+    args = parser.parse_args()
+    names = {name: enc for enc, name in wire.ENCODING_NAMES.items()}
+    args.encoding = names[args.encoding]
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if result["client_errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
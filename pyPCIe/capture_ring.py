@@ -0,0 +1,352 @@
+"""Shared-memory ring of decoded captures for multi-process consumers.
+
+One acquisition process owns the device and writes every capture into a
+ring of slots in multiprocessing.shared_memory. Any number of reader
+processes attach to the ring by name and read the slots without copying and
+without touching the device.
+
+Every slot carries a version counter used as a sequence lock: the writer
+makes it odd before and even after updating the slot, readers check that it
+is even and unchanged around their access. No locks are shared between
+processes, a slow reader only ever loses old captures (counted as dropped).
+
+Run the acquisition side with
+
+    python capture_ring.py --name fbg [--sim]
+
+and attach from another process with CaptureRing.attach("fbg").
+"""
+import argparse
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import decode
+from acquisition import CAPTURE_WORDS
+
+MAGIC = 0x46424752  # "RGBF"
+VERSION = 2
+# dac_value of a slot whose capture has no known DAC value
+NO_DAC = -1
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "<u4"),
+    ("version", "<u4"),
+    ("slots", "<u4"),
+    ("words", "<u4"),
+    ("write_seq", "<u8"),     # sequence number of the next capture
+    ("reserved", "<u8", 5),
+])
+
+SLOT_DTYPE = np.dtype([
+    ("lock", "<u8"),          # odd while the slot is written
+    ("seq", "<u8"),
+    ("timestamp", "<f8"),
+    ("dac_value", "<i4"),     # NO_DAC if unknown
+    ("words", "<u4"),
+    ("reserved", "<u8", 4),
+])
+
+_ALIGN = 64
+# rings created by this process, still tracked by its resource tracker
+_created = set()
+
+
+class RingOverrun(Exception):
+    """ The requested capture was overwritten by the writer. """
+
+
+class CaptureRing(object):
+    """ Ring of decoded captures in shared memory.
+
+    Use :meth:`create` in the acquisition process and :meth:`attach` in
+    readers.
+
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), HEADER_DTYPE, shm.buf, 0)
+        if int(self.header["magic"]) != MAGIC:
+            raise ValueError("%s is not a capture ring" % (shm.name))
+        if int(self.header["version"]) != VERSION:
+            raise ValueError("unsupported capture ring version %d" %
+                             (int(self.header["version"])))
+        self.slots = int(self.header["slots"])
+        self.words = int(self.header["words"])
+        self.stride = self._stride(self.words)
+        self.__meta = []
+        self.__data = []
+        for i in range(self.slots):
+            offset = _ALIGN + i * self.stride
+            self.__meta.append(np.ndarray((), SLOT_DTYPE, shm.buf, offset))
+            self.__data.append(np.ndarray((2, self.words), np.uint16,
+                                          shm.buf, offset + _ALIGN))
+
+    @staticmethod
+    def _stride(words):
+        return _ALIGN + (4 * words + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    @classmethod
+    def create(cls, name=None, slots=8, words=CAPTURE_WORDS):
+        """ Create a new ring.
+
+        :param str name: shared memory name, random if None.
+        :param int slots: number of captures kept.
+        :param int words: capture size in 32-bit words.
+        :rtype: CaptureRing
+        """
+        if slots < 2:
+            raise ValueError("a capture ring needs at least 2 slots")
+        size = _ALIGN + slots * cls._stride(words)
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((), HEADER_DTYPE, shm.buf, 0)
+        header[()] = (MAGIC, VERSION, slots, words, 0, (0,) * 5)
+        del header
+        _created.add(shm.name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """ Attach to an existing ring by name.
+
+        :rtype: CaptureRing
+        """
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:  # Python < 3.13 always tracks the segment
+            shm = shared_memory.SharedMemory(name)
+            if shm.name not in _created:
+                # keep the tracker from unlinking the ring when this
+                # reader exits
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        """ Sequence number the next written capture will get. """
+        return int(self.header["write_seq"])
+
+    def write(self, raw, timestamp=None, dac_value=None):
+        """ Decode a raw capture into the next slot. Captures are numbered
+        by the ring, one after the other.
+
+        :param raw: raw BRAM image, ``words`` 32-bit words long, or an
+                    acquisition.Capture whose metadata is used.
+        :param float timestamp: capture time, now if None.
+        :param int dac_value: DAC value of the capture, None if unknown.
+        :returns: sequence number of the written capture.
+        :rtype: int
+        """
+        if hasattr(raw, "raw"):
+            if timestamp is None:
+                timestamp = raw.timestamp
+            if dac_value is None:
+                dac_value = raw.dac_value
+            raw = raw.raw
+        seq = self.write_seq
+        meta = self.__meta[seq % self.slots]
+        lock = int(meta["lock"])
+        meta["lock"] = lock + 1
+        decode.decode_into(raw, self.__data[seq % self.slots])
+        meta["seq"] = seq
+        meta["timestamp"] = time.time() if timestamp is None else timestamp
+        meta["dac_value"] = NO_DAC if dac_value is None else dac_value
+        meta["words"] = self.words
+        meta["lock"] = lock + 2
+        self.header["write_seq"] = seq + 1
+        return seq
+
+    def __slot(self, seq):
+        if seq >= self.write_seq:
+            raise ValueError("capture %d was not written yet" % (seq))
+        meta = self.__meta[seq % self.slots]
+        lock = int(meta["lock"])
+        if lock & 1 or int(meta["seq"]) != seq:
+            raise RingOverrun("capture %d was overwritten" % (seq))
+        return meta, lock
+
+    def view(self, seq):
+        """ Get a zero-copy (2, N) uint16 view of a capture and its
+        metadata. The view stays valid only until the writer wraps around,
+        check with :meth:`valid` after using it.
+
+        :returns: ``(channels, timestamp, dac_value, token)``, dac_value
+                  None if unknown.
+        :raises RingOverrun: if the capture was already overwritten.
+        """
+        meta, lock = self.__slot(seq)
+        data = self.__data[seq % self.slots]
+        timestamp = float(meta["timestamp"])
+        dac_value = int(meta["dac_value"])
+        if dac_value == NO_DAC:
+            dac_value = None
+        return data, timestamp, dac_value, (seq, lock)
+
+    def valid(self, token):
+        """ Check that a slot returned by :meth:`view` was not modified
+        since. """
+        seq, lock = token
+        return int(self.__meta[seq % self.slots]["lock"]) == lock
+
+    def read(self, seq, out=None):
+        """ Copy a capture out of the ring.
+
+        :param numpy.ndarray out: destination (2, N) uint16 array, a new one
+                                  if None.
+        :returns: ``(channels, timestamp, dac_value)``
+        :raises RingOverrun: if the capture was overwritten before or while
+                             it was copied.
+        """
+        data, timestamp, dac_value, token = self.view(seq)
+        if out is None:
+            out = np.empty_like(data)
+        np.copyto(out, data)
+        if not self.valid(token):
+            raise RingOverrun("capture %d was overwritten while read" % (seq))
+        return out, timestamp, dac_value
+
+    def reader(self, start=None):
+        """ Get a :class:`RingReader` starting at ``start``, the next
+        capture to be written if None. """
+        return RingReader(self, start)
+
+    def close(self):
+        """ Detach from the ring, and remove it if this process created
+        it. """
+        self.header = None
+        self.__meta = []
+        self.__data = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RingReader(object):
+    """ Sequential reader of a :class:`CaptureRing` that skips ahead when
+    it falls behind the writer and counts the skipped captures.
+
+    :param CaptureRing ring: ring to read.
+    :param int start: first sequence number to read.
+
+    """
+
+    def __init__(self, ring, start=None):
+        self.ring = ring
+        self.next_seq = ring.write_seq if start is None else start
+        self.dropped = 0
+        self.read_count = 0
+        self.buffer = np.empty((2, ring.words), np.uint16)
+
+    def next(self, timeout=None, poll=0.0005):
+        """ Copy the next capture into the reader's buffer.
+
+        :param float timeout: seconds to wait for a new capture, None waits
+                              forever.
+        :returns: ``(seq, channels, timestamp, dac_value)`` or None on
+                  timeout. ``channels`` is reused by the next call.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            write_seq = self.ring.write_seq
+            oldest = max(write_seq - self.ring.slots + 1, 0)
+            if self.next_seq < oldest:
+                self.dropped += oldest - self.next_seq
+                self.next_seq = oldest
+            if self.next_seq < write_seq:
+                seq = self.next_seq
+                self.next_seq += 1
+                try:
+                    _, timestamp, dac_value = self.ring.read(seq, self.buffer)
+                except RingOverrun:
+                    self.dropped += 1
+                    continue
+                self.read_count += 1
+                return seq, self.buffer, timestamp, dac_value
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def __iter__(self):
+        while True:
+            yield self.next()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Acquire into or read from a shared-memory capture ring")
+    parser.add_argument("--name", default="fbg_captures",
+                        help="shared memory name of the ring")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--attach", action="store_true",
+                        help="attach as a reader and print capture rates")
+    parser.add_argument("--sim", action="store_true",
+                        help="acquire from the simulated FPGA")
+    parser.add_argument("--dac", type=int, default=0x14)
+    args = parser.parse_args()
+
+    if args.attach:
+        ring = CaptureRing.attach(args.name)
+        reader = ring.reader()
+        last = time.monotonic()
+        try:
+            while True:
+                item = reader.next(timeout=1.0)
+                now = time.monotonic()
+                if now - last >= 1.0:
+                    print("[Ring] seq %s, read %d, dropped %d" %
+                          (item[0] if item else "-", reader.read_count,
+                           reader.dropped))
+                    last = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ring.close()
+        return
+
+    from acquisition import AcquisitionEngine
+    model = None
+    if args.sim:
+        import fpga_sim
+        model = fpga_sim.FpgaModel(fpga_sim.synthetic_captures(), 0.001)
+        control_bar, samples_bar = model.control, model.samples
+    else:
+        from pypcie import Device
+        from pypcie.config import PCI_COMMAND_MEMORY
+        d = Device.get("0000:01:00.0")
+        d.config.set_command_bits(PCI_COMMAND_MEMORY)
+        control_bar, samples_bar = d.bar[1], d.bar[0]
+
+    with CaptureRing.create(args.name, args.slots) as ring:
+        engine = AcquisitionEngine(control_bar, samples_bar,
+                                   words=ring.words, dac_value=args.dac)
+        engine.start(ring.write)
+        print("[Ring] Acquiring into %s, Ctrl+C to stop" % (ring.name))
+        try:
+            while True:
+                time.sleep(1.0)
+                print("[Ring] %s" % (engine.stats.summary()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.stop(timeout=1.0)
+            if model is not None:
+                model.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,36 @@
-import socket
+import sys
+
+import wire
+from acq_client import AcquisitionClient, ServerError
+
+# optional payload encoding: raw, pack12, delta or peaks
+encoding = wire.ENC_RAW
+if len(sys.argv) > 1:
+    names = {name: enc for enc, name in wire.ENCODING_NAMES.items()}
+    encoding = names[sys.argv[1]]
 
 # Main client code
-client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-client.connect(('127.0.0.1', 12345))
+client = AcquisitionClient('127.0.0.1', 12345, encoding=encoding)
+print('[Client] Payload encoding %s' % wire.ENCODING_NAMES[client.encoding])
 
 try:
     while True:
         user_input = input('Enter "s" to request data: ')
         if user_input == 's':
-            client.send(user_input.encode('utf-8'))
-            response = b''
-
-            # Receiving the large data in chunks
-            while True:
-                chunk = client.recv(1024)
-                if not chunk:
-                    break
-                response += chunk
-
-            print(f'[Client] Received {len(response)} bytes of data.')
+            try:
+                frame = client.capture()
+            except ServerError as e:
+                print('[Client] Server error: %s' % e)
+                continue
+            if client.encoding == wire.ENC_PEAKS:
+                print(f'[Client] Received capture {frame.seq} with '
+                      f'peaks {frame.peaks()}')
+            else:
+                samples = frame.planes()
+                print(f'[Client] Received capture {frame.seq} with '
+                      f'{samples.shape[1]} samples in '
+                      f'{len(frame.payload)} bytes, '
+                      f'{frame.latency * 1000:.1f} ms.')
 
         if user_input == 'e':
             print('[Client] App exit')
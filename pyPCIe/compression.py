@@ -0,0 +1,280 @@
+"""Compression of 12-bit ADC sample planes.
+
+Samples are 12-bit values in 16-bit slots and change little from one
+sample to the next. A channel is split into chunks that are coded
+independently:
+
+    delta     difference to the previous sample, modulo 4096, zigzag
+              mapped so small steps in either direction give small values
+    pack      12-bit values stored as a plane of low bytes followed by a
+              plane of high nibbles, two per byte (1.5 bytes per sample)
+    codec     zlib level 1, or lz4 / zstd when those modules are installed
+
+Chunks holding values above 12 bits fall back to 16-bit deltas. A chunk
+table in front of the data allows decoding single chunks, so part of a
+capture can be read without decompressing the rest.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 3
+
+CODEC_NAMES = {CODEC_NONE: "none", CODEC_ZLIB: "zlib", CODEC_LZ4: "lz4",
+               CODEC_ZSTD: "zstd"}
+
+# chunk coding modes
+MODE_PACK12 = 1
+MODE_DELTA16 = 2
+
+CHUNK_SAMPLES = 4096
+
+# codec, reserved, rows, samples per row, samples per chunk
+PLANES_HEADER = struct.Struct("<BBHII")
+# mode, reserved, reserved, compressed size
+CHUNK_ENTRY = struct.Struct("<BBHI")
+
+
+def available_codecs():
+    """ Get the usable codec IDs. """
+    codecs = [CODEC_NONE, CODEC_ZLIB]
+    if lz4 is not None:
+        codecs.append(CODEC_LZ4)
+    if zstd is not None:
+        codecs.append(CODEC_ZSTD)
+    return codecs
+
+
+def default_codec():
+    """ Best available codec for sample data, zstd, lz4 or zlib. """
+    if zstd is not None:
+        return CODEC_ZSTD
+    if lz4 is not None:
+        return CODEC_LZ4
+    return CODEC_ZLIB
+
+
+def codec_id(name):
+    """ Look up a codec ID by name, e.g. "zlib". """
+    for cid, cname in CODEC_NAMES.items():
+        if cname == name:
+            if cid not in available_codecs():
+                raise ValueError("codec %s is not installed" % (name))
+            return cid
+    raise ValueError("unknown codec %r" % (name))
+
+
+def compress(data, codec):
+    """ Compress bytes with a codec at its fastest level. """
+    if codec == CODEC_NONE:
+        return bytes(data)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 1)
+    if codec == CODEC_LZ4 and lz4 is not None:
+        return lz4.compress(data)
+    if codec == CODEC_ZSTD and zstd is not None:
+        return zstd.ZstdCompressor(level=1).compress(data)
+    raise ValueError("codec %d is not available" % (codec))
+
+
+def decompress(data, codec):
+    """ Undo :func:`compress`. """
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_LZ4 and lz4 is not None:
+        return lz4.decompress(data)
+    if codec == CODEC_ZSTD and zstd is not None:
+        return zstd.ZstdDecompressor().decompress(data)
+    raise ValueError("codec %d is not available" % (codec))
+
+
+def pack12(values):
+    """ Pack 12-bit values into 3 bytes per pair, the first value in the
+    low 12 bits. An odd count is padded with a zero value.
+
+    :rtype: bytes
+    """
+    v = np.asarray(values, np.uint16)
+    if len(v) % 2:
+        v = np.append(v, np.uint16(0))
+    a = v[0::2]
+    b = v[1::2]
+    out = np.empty((len(a), 3), np.uint8)
+    out[:, 0] = a & 0xFF
+    out[:, 1] = (a >> 8) | ((b & 0xF) << 4)
+    out[:, 2] = b >> 4
+    return out.tobytes()
+
+
+def unpack12(data, count, out=None):
+    """ Undo :func:`pack12`.
+
+    :param int count: number of values.
+    :rtype: numpy.ndarray of uint16
+    """
+    p = np.frombuffer(data, np.uint8, 3 * ((count + 1) // 2)) \
+        .reshape(-1, 3).astype(np.uint16)
+    if out is None:
+        out = np.empty(count, np.uint16)
+    pairs = np.empty((len(p), 2), np.uint16)
+    pairs[:, 0] = p[:, 0] | ((p[:, 1] & 0xF) << 8)
+    pairs[:, 1] = (p[:, 1] >> 4) | (p[:, 2] << 4)
+    out[:] = pairs.reshape(-1)[:count]
+    return out
+
+
+def _delta(x, bits):
+    mask = (1 << bits) - 1
+    half = 1 << (bits - 1)
+    d = np.diff(x.astype(np.int32), prepend=0)
+    d = ((d + half) & mask) - half
+    return ((d << 1) ^ (d >> 31)) & mask
+
+
+def _undelta(z, bits, out):
+    # uint16 arithmetic wraps modulo 2**16, a multiple of 2**bits
+    z = z.astype(np.uint16, copy=False)
+    d = (z >> 1) ^ (np.uint16(0) - (z & 1))
+    np.cumsum(d, dtype=np.uint16, out=out)
+    if bits < 16:
+        out &= (1 << bits) - 1
+    return out
+
+
+def encode_chunk(samples, codec=CODEC_ZLIB):
+    """ Delta code, pack and compress one chunk of samples.
+
+    :returns: ``(mode, data)``
+    """
+    samples = np.asarray(samples, np.uint16)
+    if len(samples) and samples.max() > 0x0FFF:
+        z = _delta(samples, 16).astype(np.uint16)
+        planes = (z & 0xFF).astype(np.uint8).tobytes() + \
+            (z >> 8).astype(np.uint8).tobytes()
+        return MODE_DELTA16, compress(planes, codec)
+    z = _delta(samples, 12).astype(np.uint16)
+    high = (z >> 8).astype(np.uint8)
+    if len(high) % 2:
+        high = np.append(high, np.uint8(0))
+    planes = (z & 0xFF).astype(np.uint8).tobytes() + \
+        (high[0::2] | (high[1::2] << 4)).tobytes()
+    return MODE_PACK12, compress(planes, codec)
+
+
+def decode_chunk(data, mode, codec, count, out=None):
+    """ Undo :func:`encode_chunk`.
+
+    :param int count: number of samples in the chunk.
+    :rtype: numpy.ndarray of uint16
+    """
+    if out is None:
+        out = np.empty(count, np.uint16)
+    raw = np.frombuffer(decompress(data, codec), np.uint8)
+    if mode == MODE_DELTA16:
+        z = raw[:count].astype(np.uint16) | \
+            (raw[count:2 * count].astype(np.uint16) << 8)
+        return _undelta(z, 16, out)
+    if mode == MODE_PACK12:
+        nibbles = raw[count:]
+        high = np.empty(2 * len(nibbles), np.uint16)
+        high[0::2] = nibbles & 0xF
+        high[1::2] = nibbles >> 4
+        z = raw[:count].astype(np.uint16) | (high[:count] << 8)
+        return _undelta(z, 12, out)
+    raise ValueError("unknown chunk mode %d" % (mode))
+
+
+def encode_planes(planes, codec=CODEC_ZLIB, chunk_samples=CHUNK_SAMPLES):
+    """ Compress a (rows, N) uint16 array into a self-describing blob with a
+    chunk table.
+
+    :rtype: bytes
+    """
+    planes = np.asarray(planes, np.uint16)
+    rows, samples = planes.shape
+    entries = []
+    chunks = []
+    for row in planes:
+        for start in range(0, samples, chunk_samples):
+            mode, data = encode_chunk(row[start:start + chunk_samples], codec)
+            entries.append(CHUNK_ENTRY.pack(mode, 0, 0, len(data)))
+            chunks.append(data)
+    return b"".join([PLANES_HEADER.pack(codec, 0, rows, samples,
+                                        chunk_samples)] + entries + chunks)
+
+
+class PlanesInfo(object):
+    """ Parsed header and chunk table of an :func:`encode_planes` blob. """
+
+    def __init__(self, blob):
+        codec, _, rows, samples, chunk_samples = \
+            PLANES_HEADER.unpack_from(blob)
+        self.codec = codec
+        self.rows = rows
+        self.samples = samples
+        self.chunk_samples = chunk_samples
+        self.per_row = (samples + chunk_samples - 1) // chunk_samples
+        count = rows * self.per_row
+        table = np.frombuffer(blob, np.dtype([("mode", "u1"), ("r0", "u1"),
+                                              ("r1", "<u2"),
+                                              ("size", "<u4")]),
+                              count, PLANES_HEADER.size)
+        self.modes = table["mode"]
+        self.sizes = table["size"].astype(np.int64)
+        base = PLANES_HEADER.size + count * CHUNK_ENTRY.size
+        self.offsets = base + np.concatenate(([0], np.cumsum(self.sizes)))
+
+    def chunk(self, blob, row, k, out=None):
+        """ Decode chunk ``k`` of ``row``. """
+        n = row * self.per_row + k
+        start = k * self.chunk_samples
+        count = min(self.chunk_samples, self.samples - start)
+        data = blob[self.offsets[n]:self.offsets[n] + self.sizes[n]]
+        return decode_chunk(bytes(data), int(self.modes[n]), self.codec,
+                            count, out)
+
+
+def decode_planes(blob, out=None):
+    """ Decompress an :func:`encode_planes` blob into a (rows, N) array. """
+    info = PlanesInfo(blob)
+    if out is None:
+        out = np.empty((info.rows, info.samples), np.uint16)
+    for row in range(info.rows):
+        for k in range(info.per_row):
+            start = k * info.chunk_samples
+            info.chunk(blob, row, k,
+                       out[row, start:start + info.chunk_samples])
+    return out
+
+
+def decode_range(blob, row, start=0, stop=None):
+    """ Decompress samples ``start:stop`` of one row, touching only the
+    chunks that overlap the range.
+
+    :rtype: numpy.ndarray of uint16
+    """
+    info = PlanesInfo(blob)
+    stop = info.samples if stop is None else min(stop, info.samples)
+    if start >= stop:
+        return np.empty(0, np.uint16)
+    first = start // info.chunk_samples
+    last = (stop - 1) // info.chunk_samples
+    parts = [info.chunk(blob, row, k) for k in range(first, last + 1)]
+    offset = first * info.chunk_samples
+    return np.concatenate(parts)[start - offset:stop - offset]
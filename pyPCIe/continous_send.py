@@ -1,105 +1,26 @@
-import socket
-import threading
-import random
 from pypcie import Device
-import struct
+from pypcie.config import PCI_COMMAND_MEMORY
 import sys
-import os
 
-TRIGGER_REG = 0x0
-BUSY_REG = 0x8
-DACVALUE_REG = 0x10
+import acq_server
 
 def pcie_init():
-    os.system("setpci -s 01:00.0 COMMAND=0x2")
-    
-    d = Device("0000:01:00.0")
+    d = Device.get("0000:01:00.0")
     if not d:
         print("ERROR PCIE : unable to open pcie device")
         sys.exit()
+    # enable memory space decoding, keeping the other COMMAND bits
+    d.config.set_command_bits(PCI_COMMAND_MEMORY)
     print("PCIE : Initialized")
 
     bar0 = d.bar[0]
     bar1 = d.bar[1]
     return [bar1, bar0]
 
-change=0
-def trigger(bar):
-    global change
-    print("Triggering FPGA...")
-    #print(change)
-    #if change<10:
-    bar.write(DACVALUE_REG, 0x14)
-    #else:
-        #bar.write(DACVALUE_REG, 0x64)
-    #change = change+1
-    bar.write(TRIGGER_REG, 0x1)
-    bar.write(TRIGGER_REG, 0x0)
-    print(f"Trigger Completed. Status: {bar.read(TRIGGER_REG)}")
-
-def busy_state(bar):
-    return bar.read(BUSY_REG) & 0xFFFFFFFF
-
-def generate_large_data():
-    # Generate a large dataset (64K bytes)
-    data = bytearray(random.getrandbits(8) for _ in range(64 * 1024))
-    return data
-
-def generate_fresh_samples(bars, num_words):
-    control_bar = bars[0]
-    samples_bar = bars[1]
-    
-    # Trigger FPGA to collect new samples
-    trigger(control_bar)
-    while busy_state(control_bar):
-        print("Acquisition busy...")
-    
-    # Flush old data by reinitializing the sample array
-    sample_array = bytearray()
-    
-    for word in range(num_words):
-        word_offset = word * 4
-        sample = samples_bar.read(word_offset) & 0xFFFFFFFF
-        packed_sample = struct.pack('<i', (sample & 0xFFFFFFFF))  # Convert 32-bit sample
-        sample_array.extend(packed_sample)
-    
-    return sample_array
-
-def handle_client(client_socket, bars):
-    while True:
-        data = client_socket.recv(1024).decode('utf-8')
-        if not data:
-            break
-        
-        print("Request received from client.")
-        
-        # Generate fresh data every time before sending
-        fresh_samples = generate_fresh_samples(bars, 16 * 1024)
-        print("New Samples Acquired: ", len(fresh_samples) // 2)
-        
-        client_socket.sendall(fresh_samples)
-        
-        # Debugging: Print first few samples
-        num_samples = len(fresh_samples) // 2  
-        int_samples_list = list(struct.unpack(f'{num_samples}H', fresh_samples))
-        print("First 20 Samples:", int_samples_list[:20])
-    
-    client_socket.close()
-
 # Server setup
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind(('192.168.0.240', 22222))
-server.listen(5)
-print('[Server] Listening for connections...')
-
-try:
-    while True:
-        client, addr = server.accept()
-        print(f'[Server] Accepted connection from {addr[0]}:{addr[1]}')
-        bars = pcie_init()
-        client_handler = threading.Thread(target=handle_client, args=(client, bars,))
-        client_handler.start()
-except KeyboardInterrupt:
-    print("\n[Server] Shutting down gracefully.")
-    server.close()
-    sys.exit(0)
+# One asyncio loop serves all clients, a single device task owns the FPGA;
+# every received chunk requests a fresh capture
+HOST = sys.argv[1] if len(sys.argv) > 1 else '192.168.0.240'
+PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 22222
+acq_server.run(pcie_init(), HOST, PORT, dac_value=0x14, request=None)
+sys.exit(0)
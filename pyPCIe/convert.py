@@ -0,0 +1,261 @@
+"""Streaming conversion of legacy text recordings into binary recordings.
+
+Supported inputs:
+
+    ab      "Channel A,Channel B" CSV, one decimal sample pair per row
+            (pcie_samples.csv, pcie_samples1.csv)
+    words   "Sample Value" CSV, one decimal 32-bit word per row
+            (pcie_data.csv)
+    dump    register dumps, "Word at Offset:  0000   082a_0829" with the
+            high and low half-word in hex (samples.txt)
+
+Files are read in blocks of whole lines and every block is parsed with
+NumPy array operations, so memory use is bounded by the block size and one
+capture no matter how large the input is. The output is a recording with
+its index, see recording.py.
+
+    python convert.py pcie_samples.csv pcie_data.csv samples.txt
+"""
+import argparse
+import os
+
+import numpy as np
+
+import compression
+import recording
+from acquisition import CAPTURE_WORDS
+
+FORMAT_AB = "ab"
+FORMAT_WORDS = "words"
+FORMAT_DUMP = "dump"
+FORMATS = (FORMAT_AB, FORMAT_WORDS, FORMAT_DUMP)
+
+CHUNK_BYTES = 4 << 20
+
+# byte value to digit value, -1 for everything else
+_DECIMAL = np.full(256, -1, np.int8)
+_DECIMAL[ord("0"):ord("9") + 1] = np.arange(10)
+_HEX = _DECIMAL.copy()
+_HEX[ord("a"):ord("f") + 1] = np.arange(10, 16)
+_HEX[ord("A"):ord("F") + 1] = np.arange(10, 16)
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+_POW16 = 16 ** np.arange(8, dtype=np.int64)
+
+# "hhhh_hhhh" at the end of a dump line
+_DUMP_FIELD = 9
+# trailing bytes of a line that are not part of it
+_BLANK = np.frombuffer(b" \t\r\n", np.uint8)
+# bytes allowed in decimal CSV text besides digits
+_DECIMAL_TEXT = np.zeros(256, bool)
+_DECIMAL_TEXT[np.frombuffer(b"0123456789, \t\r\n", np.uint8)] = True
+
+
+def detect_format(first_line):
+    """ Guess the format of a file from its first line.
+
+    :param bytes first_line: first line of the file.
+    :rtype: str
+    """
+    line = first_line.strip().lower()
+    if line.startswith(b"word at offset"):
+        return FORMAT_DUMP
+    if line.startswith(b"channel a"):
+        return FORMAT_AB
+    if line.startswith(b"sample value"):
+        return FORMAT_WORDS
+    fields = line.count(b",") + 1
+    if fields == 2:
+        return FORMAT_AB
+    if fields == 1:
+        return FORMAT_WORDS
+    raise ValueError("unknown recording format, first line %r" %
+                     (first_line[:80]))
+
+
+def iter_blocks(f, chunk_bytes=CHUNK_BYTES):
+    """ Read a file in blocks of about ``chunk_bytes`` that end with a
+    newline. A missing newline at the end of the file is added. """
+    rest = b""
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        if not end:
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end]
+    if rest.strip():
+        yield rest + b"\n"
+
+
+def parse_decimal(block, columns=1):
+    """ Parse the unsigned decimal numbers of a block of CSV rows.
+
+    Every row that is not blank holds ``columns`` numbers separated by
+    commas, with optional spaces and tabs around them.
+
+    :param int columns: numbers per row, the result has this many columns.
+    :rtype: numpy.ndarray of int64, shape (rows, columns)
+    :raises ValueError: on a negative number, a character other than
+                        digits, commas and whitespace or a row with a
+                        different number of fields.
+    """
+    data = np.frombuffer(block, np.uint8)
+    digits = _DECIMAL[data]
+    is_digit = digits >= 0
+    if ((data[:-1] == ord("-")) & is_digit[1:]).any():
+        raise ValueError("negative number in unsigned samples")
+    invalid = np.flatnonzero(~_DECIMAL_TEXT[data])
+    if len(invalid):
+        raise ValueError("unexpected character %r in decimal samples" %
+                         (bytes(data[invalid[:1]])))
+    edges = np.diff(np.concatenate(([0], is_digit.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # numbers and commas per row, blank rows have neither
+    newlines = np.flatnonzero(data == ord("\n"))
+    rows = len(newlines) + 1
+    numbers = np.bincount(np.searchsorted(newlines, starts), minlength=rows)
+    commas = np.bincount(
+        np.searchsorted(newlines, np.flatnonzero(data == ord(","))),
+        minlength=rows)
+    bad = np.flatnonzero(((numbers != columns) | (commas != columns - 1)) &
+                         ((numbers > 0) | (commas > 0)))
+    if len(bad):
+        raise ValueError("row %d has %d numbers and %d commas, expected %d "
+                         "numbers" % (bad[0] + 1, numbers[bad[0]],
+                                      commas[bad[0]], columns))
+    if not len(starts):
+        return np.empty((0, columns), np.int64)
+    lengths = ends - starts
+    if lengths.max() >= len(_POW10):
+        raise ValueError("number with %d digits" % (lengths.max()))
+    # weight of every digit, 10 ** digits to the end of its number
+    pos = np.flatnonzero(is_digit)
+    weights = _POW10[np.repeat(ends, lengths) - pos - 1]
+    values = np.add.reduceat(digits[pos] * weights,
+                             np.concatenate(([0], np.cumsum(lengths)[:-1])))
+    return values.reshape(-1, columns)
+
+
+def parse_dump(block):
+    """ Parse the "hhhh_hhhh" words at the end of register dump lines.
+
+    Trailing whitespace and "\r" are ignored, blank lines skipped.
+
+    :rtype: numpy.ndarray of uint32
+    :raises ValueError: on a line not ending in a word.
+    """
+    data = np.frombuffer(block, np.uint8)
+    newlines = np.flatnonzero(data == ord("\n"))
+    if not len(newlines):
+        return np.empty(0, np.uint32)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    # last byte of every line that is not whitespace, before its start if
+    # the line is blank
+    text = np.where(np.isin(data, _BLANK), -1, np.arange(len(data)))
+    ends = np.maximum.accumulate(text)[newlines] + 1
+    blank = ends <= starts
+    starts, ends = starts[~blank], ends[~blank]
+    if (ends - starts < _DUMP_FIELD).any():
+        raise ValueError("malformed register dump line")
+    fields = data[ends[:, None] + np.arange(-_DUMP_FIELD, 0)]
+    digits = _HEX[np.delete(fields, 4, axis=1)].astype(np.int64)
+    if (fields[:, 4] != ord("_")).any() or (digits < 0).any():
+        raise ValueError("malformed register dump line")
+    high = digits[:, :4] @ _POW16[3::-1]
+    low = digits[:, 4:] @ _POW16[3::-1]
+    return ((high << 16) | low).astype(np.uint32)
+
+
+def iter_words(filename, fmt=None, chunk_bytes=CHUNK_BYTES):
+    """ Stream the 32-bit BRAM words of a legacy recording.
+
+    :param str fmt: one of FORMATS, detected from the first line if None.
+    :returns: generator of uint32 arrays, one per block.
+    """
+    with open(filename, "rb") as f:
+        first = f.readline()
+        if fmt is None:
+            fmt = detect_format(first)
+        if fmt not in FORMATS:
+            raise ValueError("unknown format %r" % (fmt))
+        # CSV files start with a column header, dumps with data
+        if fmt == FORMAT_DUMP or first.strip()[:1].isdigit():
+            f.seek(0)
+        for block in iter_blocks(f, chunk_bytes):
+            if fmt == FORMAT_DUMP:
+                yield parse_dump(block)
+            elif fmt == FORMAT_WORDS:
+                yield parse_decimal(block)[:, 0].astype(np.uint32)
+            else:
+                pairs = parse_decimal(block, 2)
+                yield ((pairs[:, 0] & 0xFFFF) |
+                       ((pairs[:, 1] & 0xFFFF) << 16)).astype(np.uint32)
+
+
+def convert_file(source, filename, fmt=None, words=CAPTURE_WORDS,
+                 encoding=recording.ENC_RAW, codec=None,
+                 chunk_bytes=CHUNK_BYTES):
+    """ Convert a legacy recording into a binary recording, one record per
+    ``words`` words. A trailing partial capture is dropped. All captures
+    get the modification time of the source as timestamp.
+
+    :returns: ``(captures, dropped words)``
+    """
+    if fmt is None:
+        with open(source, "rb") as f:
+            fmt = detect_format(f.readline())
+    mtime = os.path.getmtime(source)
+    capture = np.empty(words, np.uint32)
+    fill = 0
+    with recording.RecordingWriter(filename, words,
+                                   encoding=encoding, codec=codec) as out:
+        for block in iter_words(source, fmt, chunk_bytes):
+            while len(block):
+                n = min(words - fill, len(block))
+                capture[fill:fill + n] = block[:n]
+                block = block[n:]
+                fill += n
+                if fill == words:
+                    out.write(capture, timestamp=mtime)
+                    fill = 0
+        return out.records, fill
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert CSV and text recordings to binary recordings")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", help="output file, only with a "
+                        "single input; default: input with .cap suffix")
+    parser.add_argument("--format", choices=FORMATS,
+                        help="input format, detected if not given")
+    parser.add_argument("--words", type=int, default=CAPTURE_WORDS,
+                        help="words per capture")
+    parser.add_argument("--compress", action="store_true",
+                        help="write a compressed recording")
+    parser.add_argument("--codec", help="zlib, lz4 or zstd")
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES)
+    args = parser.parse_args()
+    if args.output and len(args.files) > 1:
+        parser.error("--output needs a single input file")
+
+    codec = compression.codec_id(args.codec) if args.codec else None
+    encoding = recording.ENC_COMPRESSED if args.compress \
+        else recording.ENC_RAW
+    for source in args.files:
+        output = args.output or os.path.splitext(source)[0] + ".cap"
+        captures, dropped = convert_file(source, output, args.format,
+                                         args.words, encoding, codec,
+                                         args.chunk_bytes)
+        print("%s -> %s: %d captures%s" % (
+            source, output, captures,
+            ", %d trailing words dropped" % (dropped) if dropped else ""))
+
+
+if __name__ == "__main__":
+    main()
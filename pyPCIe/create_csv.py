@@ -1,21 +1,23 @@
 import struct
 import os
-import csv
 import time
 
-TRIGGER_REG = 0x0
-BUSY_REG = 0x8
-DACVALUE_REG = 0x10
+import fpga_regs
+import recording
+
+RECORDING_FILE = "pcie_samples1.cap"
+DAC_VALUE = 0x14
 
 def pcie_init():
     """ Initialize PCIe communication with the FPGA. """
-    os.system("setpci -s 01:00.0 COMMAND=0x2")
-
     from pypcie import Device
-    d = Device("0000:01:00.0")
+    from pypcie.config import PCI_COMMAND_MEMORY
+    d = Device.get("0000:01:00.0")
     if not d:
         print("ERROR PCIE: Unable to open PCIe device")
         os.exit()
+    # enable memory space decoding, keeping the other COMMAND bits
+    d.config.set_command_bits(PCI_COMMAND_MEMORY)
     print("PCIE: Initialized")
 
     return [d.bar[1], d.bar[0]]  # bar1 for samples, bar0 for control
@@ -23,69 +25,63 @@ def pcie_init():
 def trigger(bar):
     """ Trigger FPGA to start data acquisition. """
     print("Trigger Initializing...")
-    bar.write(DACVALUE_REG, 0x14)
-    bar.write(TRIGGER_REG, 0x1)
-    bar.write(TRIGGER_REG, 0x0)
-    print(f"Trigger Done: {bar.read(TRIGGER_REG)}")
+    regs = fpga_regs.control_regs(bar)
+    fpga_regs.trigger(regs, DAC_VALUE)
+    print(f"Trigger Done: {regs.read('TRIGGER')}")
 
 def busy_state(bar):
     """ Check if FPGA is still busy acquiring data. """
-    return bar.read(BUSY_REG) & 0xFFFFFFFF
+    return fpga_regs.busy(fpga_regs.control_regs(bar))
 
-def generate_samples(bars, num_words):
-    """ Acquire raw data samples from PCIe and split into Channel A & B. """
+def generate_samples(bars, buf):
+    """ Acquire raw data samples from PCIe into buf. Lower 16 bits of every
+    word are Channel A, upper 16 bits Channel B. """
     samples_bar = bars[1]
     control_bar = bars[0]
 
     trigger(control_bar)
-    while busy_state(control_bar):
-        print("Acquisition busy...")
-
-    raw_samples = []
-    for word in range(num_words):
-        word_offset = word * 4
-        sample = samples_bar.read(word_offset) & 0xFFFFFFFF
-        raw_samples.append(sample)
-
-    # Convert 32-bit words into 16-bit Channel A & B
-    channel_a = []
-    channel_b = []
-
-    for sample in raw_samples:
-        word1 = sample & 0xFFFF        # Lower 16 bits (Channel A)
-        word2 = (sample >> 16) & 0xFFFF  # Upper 16 bits (Channel B)
-        channel_a.append(word1)
-        channel_b.append(word2)
-
-    return channel_a, channel_b
+    fpga_regs.wait_idle(fpga_regs.control_regs(control_bar))
 
-def save_to_csv(channel_a, channel_b, filename="pcie_samples1.csv"):
-    """ Save Channel A and Channel B data into a CSV file. """
-    with open(filename, mode="a", newline="") as file:  # Append mode
-        writer = csv.writer(file)
-        for a, b in zip(channel_a, channel_b):
-            writer.writerow([a, b])
+    samples_bar.readinto(buf, 0)
+    return buf
 
-    print(f"Data saved to {filename}")
+def save_capture(recorder, buf):
+    """ Queue one capture for the binary recording. """
+    if recorder.submit(buf, dac_value=DAC_VALUE):
+        print(f"Data queued for {recorder.writer.filename}")
+    else:
+        print("[WARN] Recorder queue full, capture dropped")
 
 # Main execution
 if __name__ == "__main__":
     bars = pcie_init()
     num_samples = 16 * 1024  
+    buf = bytearray(4 * num_samples)
 
-    # Open CSV file and write headers only once
-    with open("pcie_samples1.csv", mode="w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Channel A", "Channel B"])
+    # Binary recording, "python recording.py info" lists its captures.
+    # A writer thread keeps disk I/O out of the acquisition loop.
+    recorder = recording.AsyncRecorder(
+        recording.RecordingWriter(RECORDING_FILE, num_samples,
+                                  preallocate=64 << 20),
+        policy=recording.DROP_OLDEST, sync_interval=5.0)
 
     try:
         while True:
             # Collect and save new samples
-            channel_a, channel_b = generate_samples(bars, num_samples)
-            save_to_csv(channel_a, channel_b)
+            try:
+                generate_samples(bars, buf)
+            except fpga_regs.WaitTimeout as e:
+                print(f"[ERROR] {e}")
+                continue
+            save_capture(recorder, buf)
 
             # Delay between sample collection (optional)
             time.sleep(1)  # Adjust as necessary
 
     except KeyboardInterrupt:
         print("\n[INFO] Sampling stopped. Exiting...")
+    finally:
+        # write the queued captures and the index whatever stopped us
+        recorder.close()
+        print(f"[INFO] Recorder statistics: {recorder.stats.summary()}")
+        print(f"[INFO] Busy wait statistics: {fpga_regs.busy_stats.summary()}")
@@ -0,0 +1,108 @@
+"""Vectorized decoding of captured sample buffers.
+
+Every 32-bit word of the sample BRAM holds two 16-bit ADC samples. The
+functions here turn a raw capture (bytes, bytearray, memoryview, array or a
+uint32 ndarray, e.g. from Bar.readinto() or Bar.ndarray()) into per-channel
+NumPy arrays using dtype views only, without per-sample Python code.
+"""
+import numpy as np
+
+# little-endian dtypes of the BRAM contents
+WORD_DTYPE = np.dtype("<u4")
+SAMPLE_DTYPE = np.dtype("<u2")
+SIGNED_SAMPLE_DTYPE = np.dtype("<i2")
+
+
+class ChannelLayout(object):
+    """ Names of the channels in the low and high 16 bits of a word.
+
+    :param str low: name of the channel in bits 15..0.
+    :param str high: name of the channel in bits 31..16.
+
+    """
+
+    def __init__(self, low, high):
+        if low == high:
+            raise ValueError("channel names must differ")
+        self.low = low
+        self.high = high
+        self.names = (low, high)
+
+    def index(self, name):
+        """ Column of a channel in the (N, 2) sample view. """
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise ValueError("unknown channel %r, layout has %s" %
+                             (name, self.names)) from None
+
+    def __repr__(self):
+        return "ChannelLayout(low=%r, high=%r)" % (self.low, self.high)
+
+
+# Channel A in the low, channel B in the high half (final_gui, create_csv)
+LAYOUT_AB = ChannelLayout("A", "B")
+# Trigger square wave in the low, FBG signal in the high half
+# (onboard-peak-detection-mapping)
+LAYOUT_SIGNAL_TRIGGER = ChannelLayout("trigger", "signal")
+
+
+def as_words(raw):
+    """ View a raw capture as little-endian uint32 words without copying. """
+    if isinstance(raw, np.ndarray):
+        return raw.view(WORD_DTYPE).reshape(-1)
+    return np.frombuffer(raw, dtype=WORD_DTYPE)
+
+
+def as_samples(raw, signed=False):
+    """ View a raw capture as an (N, 2) array of 16-bit samples without
+    copying. Column 0 is the low, column 1 the high half of every word.
+
+    :param raw: raw capture buffer, a multiple of 4 bytes long.
+    :param bool signed: int16 instead of uint16 samples.
+    :rtype: numpy.ndarray
+    """
+    dtype = SIGNED_SAMPLE_DTYPE if signed else SAMPLE_DTYPE
+    return as_words(raw).view(dtype).reshape(-1, 2)
+
+
+def split(raw, layout=LAYOUT_AB, signed=False):
+    """ Split a raw capture into its two channels.
+
+    The returned arrays are strided views into ``raw``; copy them if the
+    buffer is reused for the next capture.
+
+    :param raw: raw capture buffer, a multiple of 4 bytes long.
+    :param ChannelLayout layout: channel names of the low and high halves.
+    :param bool signed: int16 instead of uint16 samples.
+    :returns: dict of channel name to 1-D sample array.
+    :rtype: dict
+    """
+    samples = as_samples(raw, signed)
+    return {layout.low: samples[:, 0], layout.high: samples[:, 1]}
+
+
+def channel(raw, name, layout=LAYOUT_AB, signed=False):
+    """ Get a single channel of a raw capture as a strided view.
+
+    :param raw: raw capture buffer, a multiple of 4 bytes long.
+    :param str name: channel name within ``layout``.
+    :param ChannelLayout layout: channel names of the low and high halves.
+    :param bool signed: int16 instead of uint16 samples.
+    :rtype: numpy.ndarray
+    """
+    return as_samples(raw, signed)[:, layout.index(name)]
+
+
+def decode_into(raw, out):
+    """ De-interleave a raw capture into a preallocated (2, N) array, row 0
+    holding the low and row 1 the high half of every word. The dtype of
+    ``out`` decides between signed and unsigned samples.
+
+    :param raw: raw capture buffer, a multiple of 4 bytes long.
+    :param numpy.ndarray out: destination array of shape (2, N).
+    :returns: ``out``
+    """
+    signed = np.dtype(out.dtype).kind == "i"
+    np.copyto(out, as_samples(raw, signed).T, casting="same_kind")
+    return out
@@ -1,18 +1,17 @@
-import struct
 import threading
 import tkinter as tk
 import os
-import time
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from pypcie import Device
+from pypcie.config import PCI_COMMAND_MEMORY
+import fpga_regs
+import decode
+from acquisition import AcquisitionEngine
 
 # Constants
-TRIGGER_REG = 0x0
-BUSY_REG = 0x8
-DACVALUE_REG = 0x10
 BLOCK_SIZE = 4 * 1024
 
 # Buffer size (16384 per channel, total 32768)
@@ -24,6 +23,7 @@ CHANNEL_SAMPLES = NUM_SAMPLES // 2  # 16384 per channel
 running = False
 continuous_mode = False
 bars = None
+engine = None
 latest_A_samples = np.zeros(CHANNEL_SAMPLES, dtype=np.int16)
 latest_B_samples = np.zeros(CHANNEL_SAMPLES, dtype=np.int16)
 
@@ -37,11 +37,12 @@ selected_ylim = [1800, 5000]  # Initial Y range
 
 # Initialize PCIe
 def pcie_init():
-    os.system("setpci -s 01:00.0 COMMAND=0x2")
-    d = Device("0000:01:00.0")
+    d = Device.get("0000:01:00.0")
     if not d:
         print("ERROR PCIE: Unable to open PCIe device")
         os.exit()
+    # enable memory space decoding, keeping the other COMMAND bits
+    d.config.set_command_bits(PCI_COMMAND_MEMORY)
     print("PCIE: Initialized")
     return [d.bar[1], d.bar[0]]
 
@@ -92,14 +93,13 @@ def update_dac_value():
 def trigger(bar):
     print("Triggering FPGA...")
     hex_val = update_dac_value()
-    bar.write(DACVALUE_REG, hex_val)
-    bar.write(TRIGGER_REG, 0x1)
-    bar.write(TRIGGER_REG, 0x0)
-    print(f"Trigger Completed. Status: {bar.read(TRIGGER_REG)}")
+    regs = fpga_regs.control_regs(bar)
+    fpga_regs.trigger(regs, hex_val)
+    print(f"Trigger Completed. Status: {regs.read('TRIGGER')}")
 
 # Check Busy State
 def busy_state(bar):
-    return bar.read(BUSY_REG) & 0xFFFFFFFF
+    return fpga_regs.busy(fpga_regs.control_regs(bar))
 
 # Fetch Data from PCIe
 def generate_samples():
@@ -110,41 +110,38 @@ def generate_samples():
     control_bar, samples_bar = bars[0], bars[1]
     trigger(control_bar)
 
-    while busy_state(control_bar):
-        print("Acquisition busy...")
-
-    sample_array = bytearray()
-    for word in range(SAMPLES):
-        word_offset = word * 4
-        sample = samples_bar.read(word_offset) & 0xFFFFFFFF
-        packed_sample = struct.pack('<i', (sample & 0xFFFFFFFF))
-        sample_array.extend(packed_sample)
+    try:
+        fpga_regs.wait_idle(fpga_regs.control_regs(control_bar))
+    except fpga_regs.WaitTimeout as e:
+        print(f"Acquisition failed: {e}")
+        return
 
-    # Ensure data is multiple of 2 (16-bit samples)
-    process_size = len(sample_array) // 2 * 2
-    sample_array = sample_array[:process_size]
-    
-    # Convert to 16-bit integers
-    int_samples_list = struct.unpack('<' + 'h' * (len(sample_array) // 2), sample_array)
+    sample_array = bytearray(4 * SAMPLES)
+    samples_bar.readinto(sample_array, 0)
 
-    # Separate channels
-    A_samples = int_samples_list[::2]
-    B_samples = int_samples_list[1::2]
+    # Separate channels (int16 views, no per-sample conversion)
+    channels = decode.split(sample_array, decode.LAYOUT_AB, signed=True)
+    A_samples = channels["A"]
+    B_samples = channels["B"]
 
     with data_lock:
         latest_A_samples[:] = A_samples[-CHANNEL_SAMPLES:]
         latest_B_samples[:] = B_samples[-CHANNEL_SAMPLES:]
 
-# Continuous Data Acquisition Thread
-def data_acquisition():
-    while running:
-        generate_samples()
-        update(1)
-        time.sleep(0.1)
+# Continuous Data Acquisition: runs in the engine's consumer thread while the
+# next capture is already being triggered and drained
+def on_capture(capture):
+    if not running:
+        return
+    channels = capture.channels(decode.LAYOUT_AB, signed=True)
+    with data_lock:
+        latest_A_samples[:] = channels["A"][-CHANNEL_SAMPLES:]
+        latest_B_samples[:] = channels["B"][-CHANNEL_SAMPLES:]
+    update(1)
 
 # Start Continuous Data Acquisition
 def start_server():
-    global running, bars, continuous_mode
+    global running, bars, continuous_mode, engine
     if running:
         print("[Server] Already running.")
         return
@@ -156,7 +153,9 @@ def start_server():
 
     running = True
     continuous_mode = True
-    threading.Thread(target=data_acquisition, daemon=True).start()
+    engine = AcquisitionEngine(bars[0], bars[1], words=SAMPLES,
+                               dac_value=update_dac_value)
+    engine.start(on_capture)
     print("[Server] Data acquisition started.")
 
 # Stop Data Acquisition
@@ -167,6 +166,12 @@ def stop_server():
     
     running = False
     continuous_mode = False
+    if engine is not None:
+        try:
+            engine.stop(timeout=1.0)
+        except Exception as e:
+            print(f"[Server] Acquisition failed: {e}")
+        print(f"[Server] Acquisition statistics: {engine.stats.summary()}")
     print("[Server] Stopped data acquisition.")
 
 # One-Time Triggered Data Acquisition
@@ -0,0 +1,64 @@
+"""Register map of the FPGA control BAR (bar1, the sample BRAM is bar0).
+
+Single source of truth for the control registers used by all acquisition
+tools. Use control_regs(bar) to get the shared, shadow-cached map of a BAR.
+"""
+import weakref
+
+from pypcie.poll import WaitStats, WaitTimeout, poll_until
+from pypcie.regmap import Field, Register, RegisterMap, RO, RW, W1P
+
+# Raw offsets, kept for tools that access the BAR directly
+TRIGGER_REG = 0x0
+BUSY_REG = 0x8
+DACVALUE_REG = 0x10
+
+CONTROL_REGISTERS = (
+    # writing 1 starts an acquisition into the sample BRAM, then back to 0
+    Register("TRIGGER", TRIGGER_REG, W1P, fields=[Field("START", 0)]),
+    # non-zero while the acquisition is running
+    Register("BUSY", BUSY_REG, RO),
+    # laser DAC setting used for the next acquisition
+    Register("DACVALUE", DACVALUE_REG, RW, fields=[Field("VALUE", 0, 16)]),
+)
+
+# default timeout of one acquisition in seconds
+ACQUISITION_TIMEOUT = 1.0
+
+_maps = weakref.WeakKeyDictionary()
+
+# poll count / wait time histograms of all wait_idle() calls
+busy_stats = WaitStats()
+
+
+def control_regs(bar):
+    """ Get the register map for a control BAR, one shared map per BAR so
+    the shadow cache is kept across calls. """
+    regs = _maps.get(bar)
+    if regs is None:
+        regs = RegisterMap(bar, CONTROL_REGISTERS)
+        _maps[bar] = regs
+    return regs
+
+
+def trigger(regs, dac_value=None):
+    """ Set the DAC value and pulse TRIGGER in one BAR batch. The DAC write
+    is skipped by the shadow cache if the value did not change, and left
+    out entirely if dac_value is None. """
+    writes = [] if dac_value is None else [("DACVALUE", dac_value)]
+    writes.append(("TRIGGER", 0x1))
+    regs.write_many(writes)
+
+
+def busy(regs):
+    """ Check if the FPGA is still acquiring. """
+    return regs.read("BUSY") & 0xFFFFFFFF
+
+
+def wait_idle(regs, timeout=ACQUISITION_TIMEOUT, backoff=None,
+              stats=busy_stats):
+    """ Wait until the FPGA finished the acquisition, spinning first and
+    backing off to sleeps for long captures. Returns the number of BUSY
+    polls and raises WaitTimeout if the FPGA does not finish in time. """
+    return poll_until(lambda: not busy(regs), timeout=timeout,
+                      backoff=backoff, stats=stats, what="FPGA acquisition")
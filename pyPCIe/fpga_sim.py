@@ -0,0 +1,185 @@
+"""Simulated FPGA acquisition board on a fake sysfs tree.
+
+FpgaModel creates resource1 (control registers) and resource0 (sample BRAM)
+as regular files under a temporary sysfs root and emulates the
+trigger -> busy -> BRAM filled sequence: a TRIGGER pulse sets BUSY, loads the
+next capture into the BRAM and clears BUSY after capture_time seconds.
+Captures come from a recorded CSV such as pcie_samples.csv or from synthetic
+FBG spectra.
+
+The model observes TRIGGER through a Bar write hook, so it must run in the
+same process as the code under test. To run an existing script against it:
+
+    python fpga_sim.py [--csv pcie_samples.csv] create_csv.py
+"""
+import argparse
+import itertools
+import os
+import runpy
+import sys
+import threading
+
+import numpy as np
+
+from pypcie import Device
+from pypcie.sim import FakeDevice
+from fpga_regs import TRIGGER_REG, BUSY_REG, DACVALUE_REG
+
+PCI_ID = "0000:01:00.0"
+CONTROL_BAR = 1
+SAMPLE_BAR = 0
+# 16K words of 2 x 16 bit samples
+BRAM_WORDS = 16 * 1024
+CONTROL_BAR_SIZE = 4096
+
+
+def csv_captures(filename, words=BRAM_WORDS):
+    """ Load a recording with "Channel A,Channel B" columns as a list of
+    uint32 BRAM images, channel A in the low half. A trailing partial
+    capture is dropped. """
+    data = np.loadtxt(filename, delimiter=",", skiprows=1, dtype=np.uint32,
+                      ndmin=2)
+    count = len(data) // words
+    if not count:
+        raise ValueError("%s holds less than one capture of %d words" %
+                         (filename, words))
+    data = data[:count * words]
+    images = (data[:, 0] & 0xFFFF) | ((data[:, 1] & 0xFFFF) << 16)
+    return list(images.reshape(count, words))
+
+
+def synthetic_captures(count=8, words=BRAM_WORDS, period=1600,
+                       peaks=((800, 1800), (1000, 1500)), width=6.0,
+                       baseline=2050, noise=4.0, trigger_high=3000,
+                       signal_high=False, seed=0):
+    """ Generate BRAM images of a synthetic FBG spectrum.
+
+    Every laser sweep of ``period`` samples holds Gaussian reflection peaks
+    at ``(position, height)`` relative to the rising edge of the trigger
+    square wave. Peak positions drift by a few samples between captures.
+    Values are clipped to the 12-bit ADC range.
+
+    :param bool signal_high: put the spectrum into the high half of every
+                             word and the trigger into the low half, as
+                             expected by onboard-peak-detection-mapping.
+    :rtype: list of numpy.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    x = np.arange(words)
+    phase = x % period
+    trigger = np.where(phase < period // 2, trigger_high, baseline)
+    images = []
+    for _ in range(count):
+        signal = baseline + rng.normal(0.0, noise, words)
+        drift = rng.normal(0.0, 2.0)
+        for pos, height in peaks:
+            signal += height * np.exp(-0.5 * ((phase - pos - drift) /
+                                              width) ** 2)
+        signal = np.clip(np.rint(signal), 0, 0x0FFF).astype(np.uint32)
+        trig = trigger.astype(np.uint32) & 0x0FFF
+        if signal_high:
+            images.append(trig | (signal << 16))
+        else:
+            images.append(signal | (trig << 16))
+    return images
+
+
+class FpgaModel(object):
+    """ FPGA acquisition model behind a fake sysfs device.
+
+    :param captures: sequence of uint32 BRAM images, cycled through.
+    :param float capture_time: seconds BUSY stays set after a trigger,
+                               0 completes the capture within the trigger.
+    :param str pciid: PCI bus ID of the simulated device.
+    :param str root: sysfs root to create the device in, temporary if None.
+
+    """
+
+    def __init__(self, captures, capture_time=0.0, pciid=PCI_ID, root=None):
+        captures = [np.asarray(c, dtype=np.uint32) for c in captures]
+        if not captures:
+            raise ValueError("no captures to replay")
+        words = len(captures[0])
+        self.fake = FakeDevice(root, pciid, bars={
+            CONTROL_BAR: CONTROL_BAR_SIZE, SAMPLE_BAR: 4 * words})
+        self.root = self.fake.root
+        self.device = Device.get(pciid, sysfs_root=self.root)
+        self.control = self.device.bar[CONTROL_BAR]
+        self.samples = self.device.bar[SAMPLE_BAR]
+        self.capture_time = capture_time
+        self.triggers = 0
+        self.missed_triggers = 0
+        self.dac_value = 0
+        self.__captures = itertools.cycle(captures)
+        self.__regs = self.control.ndarray()
+        self.__bram = self.samples.ndarray()
+        self.__lock = threading.Lock()
+        self.__busy = False
+        self.__complete()
+        self.control.add_write_hook(self.__on_write)
+
+    def __on_write(self, offset, data, width):
+        if offset != TRIGGER_REG or not data & 0x1:
+            return
+        with self.__lock:
+            if self.__busy:
+                self.missed_triggers += 1
+                return
+            self.__busy = True
+            self.triggers += 1
+            self.dac_value = int(self.__regs[DACVALUE_REG >> 2])
+            self.__regs[BUSY_REG >> 2] = 1
+        if self.capture_time > 0:
+            timer = threading.Timer(self.capture_time, self.__complete)
+            timer.daemon = True
+            timer.start()
+        else:
+            self.__complete()
+
+    def __complete(self):
+        self.__bram[:] = next(self.__captures)
+        with self.__lock:
+            self.__regs[BUSY_REG >> 2] = 0
+            self.__busy = False
+
+    def close(self):
+        """ Detach from the control BAR and delete the fake sysfs tree. """
+        self.control.remove_write_hook(self.__on_write)
+        self.fake.remove()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run an acquisition script against a simulated FPGA")
+    parser.add_argument("--csv", help="replay captures from a recording "
+                        "with Channel A/B columns instead of synthetic data")
+    parser.add_argument("--capture-time", type=float, default=0.001,
+                        help="seconds BUSY stays set per capture")
+    parser.add_argument("--signal-high", action="store_true",
+                        help="synthetic spectrum in the high half-word")
+    parser.add_argument("script", help="script to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    if args.csv:
+        captures = csv_captures(args.csv)
+    else:
+        captures = synthetic_captures(signal_high=args.signal_high)
+    with FpgaModel(captures, args.capture_time) as model:
+        os.environ["PYPCIE_SYSFS_ROOT"] = model.root
+        sys.argv = [args.script] + args.args
+        try:
+            runpy.run_path(args.script, run_name="__main__")
+        finally:
+            print("[SIM] %d triggers, %d missed" %
+                  (model.triggers, model.missed_triggers))
+
+
+if __name__ == "__main__":
+    main()
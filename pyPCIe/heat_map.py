@@ -1,30 +1,26 @@
-import pandas as pd
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import time
 
-# Load the CSV data
-filename = "pcie_samples.csv"
-df = pd.read_csv(filename)
+import recording
 
-# Extract Channel A and Channel B data
-channel_a = df["Channel A"].values
-channel_b = df["Channel B"].values
+# Memory-map the binary recording, converting the CSV recording once
+filename = "pcie_samples.cap"
+if not os.path.exists(filename):
+    recording.import_csv("pcie_samples.csv", filename)
+rec = recording.Recording(filename)
 
 # Number of samples per second (16KB of data per second)
-samples_per_second = 16 * 1024  # 16KB = 16 * 1024 samples
+samples_per_second = rec.words  # 16KB = 16 * 1024 samples
 
-# Ensure the data length matches the expected number of samples (4 seconds of data, 16KB per second)
-expected_length = 4 * samples_per_second  # 4 seconds of data, 16KB per second
+# One capture per second, only the first 4 seconds are read from disk
+seconds = range(min(4, len(rec)))
 
-# Trim data to match the expected length (if there's extra data)
-channel_a = channel_a[:expected_length]
-channel_b = channel_b[:expected_length]
-
-# Reshape the data into 4 seconds, each containing 16KB of data (16KB samples)
-channel_a = channel_a.reshape(4, samples_per_second)
-channel_b = channel_b.reshape(4, samples_per_second)
+# 4 seconds, each containing 16KB of data (16KB samples)
+channel_a = rec.stack("A", seconds)
+channel_b = rec.stack("B", seconds)
 
 # Function to normalize data and clip values outside the range [2000, 4100]
 def normalize_and_clip_data(data, min_val=2000, max_val=4100):
@@ -38,11 +34,11 @@ channel_a_normalized = normalize_and_clip_data(channel_a)
 channel_b_normalized = normalize_and_clip_data(channel_b)
 
 # Create time values for 4 seconds (0, 1, 2, 3)
-time_values = np.arange(4)
+time_values = np.arange(len(seconds))
 
 # Plotting Channel A and Channel B gradually
 
-for i in range(4):  # Loop over each second (4 time slices)
+for i in range(len(seconds)):  # Loop over each second (4 time slices)
     # Plotting Heatmap for Channel A
     plt.figure(figsize=(12, 8))  # Increase figure size for clarity
     sns.heatmap(channel_a_normalized[:i+1], cmap="coolwarm", cbar=True,
@@ -8,25 +8,24 @@ import numpy as np
 from scipy.signal import find_peaks
 
 from pypcie import Device
+from pypcie.config import PCI_COMMAND_MEMORY
+import fpga_regs
+import decode
 import struct
 import sys
 import signal
 import struct
 import os,time
 
-TRIGGER_REG = 0x0
-BUSY_REG    = 0x8
-
 def pcie_init():
     # Bind to PCI device at "0000:01:00.0"
-    # this commnad will initialize fpga pci channel
-    os.system("setpci -s 01:00.0 COMMAND=0x2")
-    
     
-    d = Device("0000:01:00.0")
+    d = Device.get("0000:01:00.0")
     if not d:
         print("ERROR PCIE : unable to open pcie device")
         os.exit()
+    # enable memory space decoding, keeping the other COMMAND bits
+    d.config.set_command_bits(PCI_COMMAND_MEMORY)
     print("PCIE : Initialized")
 
     # Access BAR 0
@@ -37,14 +36,12 @@ def pcie_init():
     return [bar1,bar0]
 
 def trigger(bar):
-    #bar.write(TRIGGER_REG, 0x0)
-    bar.write(TRIGGER_REG, 0x1)
-    bar.write(TRIGGER_REG, 0x0)
+    fpga_regs.trigger(fpga_regs.control_regs(bar))
     print("Trigger Done..... ")
 
 
 def busy_state(bar):
-    return bar.read(BUSY_REG) & 0xFFFFFFFF
+    return fpga_regs.busy(fpga_regs.control_regs(bar))
 
 
 def est(tt1, tt2, cc):
@@ -124,11 +121,6 @@ def est(tt1, tt2, cc):
 # Function to generate a list of hex samples received though PCI interface
 def acqire_adc_samples(bars, num_words):
 
-    # Convert 32-bit samples to 16-bit samples
-    sample_32bit  = []
-    samples_signal = []
-    samples_triger = []
-
     control_bar = bars[0]
     samples_bar = bars[1]
 
@@ -136,31 +128,25 @@ def acqire_adc_samples(bars, num_words):
     trigger(control_bar)
 
     #wait if fpga busy
-    while(busy_state(control_bar)):
-        print("FPGA Acquazition busy !!!")
+    fpga_regs.wait_idle(fpga_regs.control_regs(control_bar))
 
-    for word in range(num_words):
-        word_offsetA = word*4
-        
-        # read BAR 0, offset 0x1004
-        sample_32bit = samples_bar.read(word_offsetA) & 0xFFFFFFFF
-
-        
-        # Extract two 16-bit values from the 32-bit sample
-        sample_signal = (sample_32bit >> 16) & 0xFFFF
-        sample_triger = sample_32bit & 0xFFFF
-        
-        # Append to respective lists
-        samples_signal.append(sample_signal)
-        samples_triger.append(sample_triger)
+    # upper 16 bits carry the signal, lower 16 bits the trigger square wave.
+    # signed so np.diff() in est() does not wrap around on falling edges
+    channels = decode.split(samples_bar.read_block(0, num_words),
+                            decode.LAYOUT_SIGNAL_TRIGGER, signed=True)
             
-    return (samples_signal,samples_triger)
+    return (channels["signal"], channels["trigger"])
 
 # Function to handle the client connection
 def handle_client(bars):
     while True:
         #hex_samples = acqire_adc_samples(bar,256)
-        [samples_signal,samples_triger] = acqire_adc_samples(bars, 1 * 1024)
+        try:
+            [samples_signal,samples_triger] = acqire_adc_samples(bars, 1 * 1024)
+        except fpga_regs.WaitTimeout as e:
+            print("FPGA Acquazition failed: ", e)
+            time.sleep(1)
+            continue
         #print("----------------------------------------------")
         #print('Signal   :',samples_signal[:1000])
 
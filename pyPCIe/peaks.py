@@ -0,0 +1,135 @@
+"""FBG peak detection and wavelength mapping on whole captures.
+
+The spectrum of one laser sweep follows every rising edge of the trigger
+square wave. Like est() in onboard-peak-detection-mapping.py, the first
+rising edge in the start of a capture anchors the sweep, reflection peaks
+above a height threshold inside a window behind the edge are detected and
+their offset from the edge is looked up in the wavelength table
+(wavelength_table.cc). Detection uses NumPy only, local maxima follow
+scipy.signal.find_peaks(): the middle sample of a flat top is reported.
+
+    detector = PeakDetector()
+    peaks = detector.detect_capture(capture.raw)
+    peaks["wavelength"]
+"""
+import numpy as np
+
+import decode
+
+# one detected peak, also the wire format of wire.ENC_PEAKS payloads
+PEAK_DTYPE = np.dtype([("index", "<u4"), ("height", "<i4"),
+                       ("wavelength", "<f8")])
+
+# rise of the trigger channel between two samples that counts as an edge
+EDGE_THRESHOLD = 400
+# samples searched for the trigger edge
+EDGE_SEARCH = 4000
+# peaks are searched from EDGE + WINDOW[0] to EDGE + WINDOW[1], exclusive
+WINDOW = (650, 1250)
+# smallest peak height in ADC counts
+MIN_HEIGHT = 2200
+
+
+def wavelength_lut(table=None):
+    """ Turn a ``{sample offset: wavelength}`` dict into a lookup array,
+    0.0 where the table has no entry.
+
+    :param dict table: wavelength_table.cc if None.
+    :rtype: numpy.ndarray of float64
+    """
+    if table is None:
+        import wavelength_table
+        table = wavelength_table.cc
+    lut = np.zeros(max(table) + 1, np.float64)
+    lut[np.fromiter(table.keys(), np.int64)] = \
+        np.fromiter(table.values(), np.float64)
+    return lut
+
+
+def find_peaks(x, height=MIN_HEIGHT):
+    """ Find local maxima of at least ``height``.
+
+    :param numpy.ndarray x: 1-D signal.
+    :returns: indices of the peaks, ascending.
+    :rtype: numpy.ndarray of int64
+    """
+    x = np.asarray(x)
+    if len(x) < 3:
+        return np.empty(0, np.int64)
+    # first and last sample of every run of equal samples
+    starts = np.flatnonzero(np.concatenate(([True], x[1:] != x[:-1])))
+    ends = np.append(starts[1:], len(x)) - 1
+    values = x[starts]
+    # a run is a peak if both neighbouring runs are lower
+    inner = np.zeros(len(starts), bool)
+    inner[1:-1] = (values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])
+    inner &= values >= height
+    return (starts[inner] + ends[inner]) // 2
+
+
+class PeakDetector(object):
+    """ Peak detection and wavelength mapping with fixed parameters.
+
+    :param numpy.ndarray lut: wavelength per sample offset from the edge,
+                              see :func:`wavelength_lut`; the wavelength
+                              table if None.
+    :param int height: smallest peak height in ADC counts.
+    :param tuple window: first and last sample offset from the trigger
+                         edge searched for peaks, both exclusive.
+    :param int edge_threshold: trigger rise that counts as an edge.
+    :param int edge_search: samples searched for the trigger edge.
+    :param decode.ChannelLayout layout: names of the signal and trigger
+                                        channels in a capture.
+
+    """
+
+    def __init__(self, lut=None, height=MIN_HEIGHT, window=WINDOW,
+                 edge_threshold=EDGE_THRESHOLD, edge_search=EDGE_SEARCH,
+                 layout=decode.LAYOUT_SIGNAL_TRIGGER):
+        self.lut = wavelength_lut() if lut is None else lut
+        self.height = height
+        self.window = window
+        self.edge_threshold = edge_threshold
+        self.edge_search = edge_search
+        self.layout = layout
+
+    def edge(self, trigger):
+        """ Index of the first rising trigger edge, None if there is none.
+        """
+        rises = np.flatnonzero(np.diff(trigger[:self.edge_search]) >
+                               self.edge_threshold)
+        return int(rises[0]) if len(rises) else None
+
+    def detect(self, signal, trigger):
+        """ Detect the peaks behind the first trigger edge.
+
+        :param signal: signed FBG signal samples.
+        :param trigger: signed trigger square wave samples.
+        :returns: one PEAK_DTYPE record per peak, empty without edge.
+        :rtype: numpy.ndarray
+        """
+        edge = self.edge(trigger)
+        if edge is None:
+            return np.empty(0, PEAK_DTYPE)
+        # the window bounds themselves are the outer neighbours, peaks
+        # lie strictly between them as in est()
+        first = edge + self.window[0]
+        last = min(edge + self.window[1], len(signal) - 1)
+        locs = find_peaks(signal[first:last + 1], self.height) + first
+        peaks = np.empty(len(locs), PEAK_DTYPE)
+        peaks["index"] = locs
+        peaks["height"] = signal[locs]
+        # the wavelength table counts samples from the one before the edge
+        offsets = locs - edge + 1
+        inside = offsets < len(self.lut)
+        peaks["wavelength"] = 0.0
+        peaks["wavelength"][inside] = self.lut[offsets[inside]]
+        return peaks
+
+    def detect_capture(self, raw):
+        """ Detect the peaks of a raw capture buffer.
+
+        :rtype: numpy.ndarray of PEAK_DTYPE
+        """
+        channels = decode.split(raw, self.layout, signed=True)
+        return self.detect(channels["signal"], channels["trigger"])
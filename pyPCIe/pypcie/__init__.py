@@ -1,2 +1,3 @@
 from .device import Device
-from .bar import Bar
+from .bar import Bar, FLUSH_ALWAYS, FLUSH_BATCH, FLUSH_NEVER
+from .config import ConfigSpace
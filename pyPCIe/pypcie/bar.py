@@ -1,18 +1,49 @@
 #!/usr/bin/python3
 import os
+import sys
+from array import array
+from contextlib import contextmanager
 from mmap import mmap, PROT_READ, PROT_WRITE, PAGESIZE
-from struct import pack, unpack
+from struct import pack_into, unpack_from
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only needed for Bar.ndarray()
+    np = None
+
+# Flush policies, see Bar.flush_policy
+FLUSH_ALWAYS = "always"
+FLUSH_BATCH = "batch"
+FLUSH_NEVER = "never"
+FLUSH_POLICIES = (FLUSH_ALWAYS, FLUSH_BATCH, FLUSH_NEVER)
+
+# access width in bytes -> (struct format, array typecode, numpy dtype)
+_WIDTHS = {
+    1: ("<B", "B", "<u1"),
+    2: ("<H", "H", "<u2"),
+    # "<I", not "<L": struct only uses single native loads and stores when
+    # the standard size matches the native one, and C long is 8 bytes on
+    # LP64, which would split the access into 4 byte accesses
+    4: ("<I", "I", "<u4"),
+    8: ("<Q", "Q", "<u8"),
+}
 
 
 class Bar(object):
     """ Create a Bar instance that ``mmap()`` s a PCIe device BAR.
 
     :param str filename: sysfs filename for the corresponding resourceX file.
+    :param str flush: flush policy for writes, one of ``FLUSH_ALWAYS``,
+                      ``FLUSH_BATCH`` (default) or ``FLUSH_NEVER``.
 
     """
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, flush: str = FLUSH_BATCH):
         self.__map = None
+        self.flush_policy = flush
+        self.__batch_depth = 0
+        self.__dirty = None  # (first, last) dirty page offset within a batch
+        self.__write_hooks = []
         self.__stat = os.stat(filename)
         fd = os.open(filename, os.O_RDWR)
         self.__map = mmap(fd, 0, prot=PROT_READ | PROT_WRITE)
@@ -20,19 +51,67 @@ class Bar(object):
 
     def __del__(self):
         if self.__map is not None:
-            self.__map.close()
+            try:
+                self.__map.close()
+            except BufferError:
+                # a view() / ndarray() export is still alive, the map is
+                # released together with the last reference to it.
+                pass
 
-    def __check_offset(self, offset: int):
-        """ Check if the given offset is properly DW-aligned and the access
-            falls within the BAR size.
+    def __check_offset(self, offset: int, width: int = 4):
+        """ Check if the given offset is naturally aligned for an access of
+            ``width`` bytes and the access falls within the BAR size.
 
         """
-        if offset & 0x3:
-            raise ValueError("unaligned access to offset 0x%x" % (offset))
-        if offset + 3 > self.size:
+        if width not in _WIDTHS:
+            raise ValueError("invalid access width %d" % (width))
+        if offset & (width - 1):
+            raise ValueError("unaligned %d bit access to offset 0x%x" %
+                             (8 * width, offset))
+        if offset < 0 or offset + width > self.size:
             raise ValueError("offset (0x%x) exceeds BAR size (0x%x)" %
                              (offset, self.size))
 
+    def __check_range(self, offset: int, count: int, width: int = 4):
+        """ Check if a block of ``count`` values of ``width`` bytes starting
+            at offset is naturally aligned and falls within the BAR size.
+
+        """
+        if width not in _WIDTHS:
+            raise ValueError("invalid access width %d" % (width))
+        if count < 0:
+            raise ValueError("invalid word count %d" % (count))
+        if offset & (width - 1):
+            raise ValueError("unaligned %d bit access to offset 0x%x" %
+                             (8 * width, offset))
+        if offset < 0 or offset + width * count > self.size:
+            raise ValueError("block 0x%x+0x%x exceeds BAR size (0x%x)" %
+                             (offset, width * count, self.size))
+
+    def __read(self, offset: int, width: int) -> int:
+        self.__check_offset(offset, width)
+        return unpack_from(_WIDTHS[width][0], self.__map, offset)[0]
+
+    def __write(self, offset: int, data: int, width: int):
+        self.__check_offset(offset, width)
+        # write to map. no ret. check: struct.error is raised on error
+        pack_into(_WIDTHS[width][0], self.__map, offset, data)
+        for hook in self.__write_hooks:
+            hook(offset, data, width)
+        page_offset = offset & (~(PAGESIZE - 1) & 0xffffffff)
+        if self.__flush_policy == FLUSH_NEVER:
+            return
+        if self.__batch_depth and self.__flush_policy == FLUSH_BATCH:
+            # defer the flush to the end of the batch
+            if self.__dirty is None:
+                self.__dirty = (page_offset, page_offset)
+            else:
+                self.__dirty = (min(self.__dirty[0], page_offset),
+                                max(self.__dirty[1], page_offset))
+            return
+        # Flush current page for immediate update.
+        self.__flush_pages(page_offset, page_offset)
+
     def read(self, offset: int):
         """ Read a 32 bit / double word value from offset.
 
@@ -41,9 +120,7 @@ class Bar(object):
         :rtype: double word / 32 bit unsigned long / int
 
         """
-        self.__check_offset(offset)
-        reg = self.__map[offset:offset+4]
-        return unpack("<L", reg)[0]
+        return self.__read(offset, 4)
 
     def write(self, offset: int, data: int):
         """ Write a 32 bit / double word value to offset.
@@ -51,16 +128,261 @@ class Bar(object):
         :param int offset: BAR byte offset to write to.
         :param int data: double word to write to the given BAR offset.
         """
-        self.__check_offset(offset)
-        self.__map.seek(offset)
-        reg = pack("<L", data)
-        # write to map. no ret. check: ValueError/TypeError is raised on error
-        self.__map.write(reg)
-        # Flush current page for immediate update.
-        page_offset = offset & (~(PAGESIZE - 1) & 0xffffffff)
-        self.__map.flush(page_offset, PAGESIZE)
+        self.__write(offset, data, 4)
+
+    def read8(self, offset: int) -> int:
+        """ Read an 8 bit / byte value from offset.
+
+        :param int offset: BAR byte offset to read from.
+        :rtype: int
+        """
+        return self.__read(offset, 1)
+
+    def read16(self, offset: int) -> int:
+        """ Read a 16 bit / word value from a 2 byte aligned offset.
+
+        :param int offset: BAR byte offset to read from.
+        :rtype: int
+        """
+        return self.__read(offset, 2)
+
+    def read32(self, offset: int) -> int:
+        """ Read a 32 bit / double word value from a 4 byte aligned offset.
+        Same as :meth:`read`.
+
+        :param int offset: BAR byte offset to read from.
+        :rtype: int
+        """
+        return self.__read(offset, 4)
+
+    def read64(self, offset: int) -> int:
+        """ Read a 64 bit / quad word value from an 8 byte aligned offset.
+
+        :param int offset: BAR byte offset to read from.
+        :rtype: int
+        """
+        return self.__read(offset, 8)
+
+    def write8(self, offset: int, data: int):
+        """ Write an 8 bit / byte value to offset.
+
+        :param int offset: BAR byte offset to write to.
+        :param int data: byte to write to the given BAR offset.
+        """
+        self.__write(offset, data, 1)
+
+    def write16(self, offset: int, data: int):
+        """ Write a 16 bit / word value to a 2 byte aligned offset.
+
+        :param int offset: BAR byte offset to write to.
+        :param int data: word to write to the given BAR offset.
+        """
+        self.__write(offset, data, 2)
+
+    def write32(self, offset: int, data: int):
+        """ Write a 32 bit / double word value to a 4 byte aligned offset.
+        Same as :meth:`write`.
+
+        :param int offset: BAR byte offset to write to.
+        :param int data: double word to write to the given BAR offset.
+        """
+        self.__write(offset, data, 4)
+
+    def write64(self, offset: int, data: int):
+        """ Write a 64 bit / quad word value to an 8 byte aligned offset.
+
+        :param int offset: BAR byte offset to write to.
+        :param int data: quad word to write to the given BAR offset.
+        """
+        self.__write(offset, data, 8)
+
+    def add_write_hook(self, hook):
+        """ Register a callable that is invoked as ``hook(offset, data,
+        width)`` after every write to the BAR, e.g. by a device simulator or
+        a tracer.
+
+        :param hook: callable taking offset, data and width in bytes.
+        """
+        self.__write_hooks.append(hook)
+
+    def remove_write_hook(self, hook):
+        """ Unregister a callable added with :meth:`add_write_hook`. """
+        self.__write_hooks.remove(hook)
+
+    def write_many(self, writes):
+        """ Write a sequence of 32 bit / double word values in order.
+
+        With the ``FLUSH_BATCH`` policy the touched pages are flushed once
+        after the last write instead of after every write.
+
+        :param writes: iterable of ``(offset, data)`` tuples.
+        """
+        with self.batch():
+            for offset, data in writes:
+                self.__write(offset, data, 4)
+
+    @contextmanager
+    def batch(self):
+        """ Context manager that defers page flushes of all writes issued
+        inside the block to its exit. Batches may be nested, the flush happens
+        when the outermost batch ends.
+
+        Example::
+
+            with bar.batch():
+                bar.write(0x10, 0x14)
+                bar.write(0x0, 0x1)
+                bar.write(0x0, 0x0)
+
+        """
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            if not self.__batch_depth:
+                self.flush()
+
+    def flush(self):
+        """ Flush all pages written since the start of the current batch. """
+        if self.__dirty is None:
+            return
+        first, last = self.__dirty
+        self.__dirty = None
+        self.__flush_pages(first, last)
+
+    def __flush_pages(self, first: int, last: int):
+        """ Flush the pages from offset first to last (inclusive), clipped
+            to the BAR size for BARs smaller than a page.
+
+        """
+        length = min(last + PAGESIZE, self.size) - first
+        self.__map.flush(first, length)
         # TODO: check return value, only for >=Python3.8
 
+    @property
+    def flush_policy(self) -> str:
+        """
+        Get or set the flush policy for writes.
+
+        ``FLUSH_ALWAYS`` flushes the page after every write, ``FLUSH_BATCH``
+        flushes after every write outside of a batch and once at the end of a
+        batch, ``FLUSH_NEVER`` never flushes, e.g. for posted MMIO writes to a
+        BAR that is not file-backed.
+
+        :rtype: str
+        """
+        return self.__flush_policy
+
+    @flush_policy.setter
+    def flush_policy(self, policy: str):
+        if policy not in FLUSH_POLICIES:
+            raise ValueError("invalid flush policy %r" % (policy))
+        self.__flush_policy = policy
+
+    def read_block(self, offset: int, count: int, width: int = 4) -> array:
+        """ Read ``count`` values of ``width`` bytes starting at offset.
+
+        The range is validated once and copied out of the BAR in one go
+        instead of one access per value. The copy is a plain memory copy,
+        ``width`` sets the alignment checks and the element type of the
+        result, not the width of the bus accesses: no single 64 bit load
+        per value is guaranteed, see :meth:`readinto`.
+
+        :param int offset: BAR byte offset to start reading from.
+        :param int count: number of values to read.
+        :param int width: element width in bytes, 1, 2, 4 (default) or 8.
+        :returns: Values read from the given BAR range.
+        :rtype: array.array of type "B", "H", "I" or "Q"
+        """
+        self.__check_range(offset, count, width)
+        block = array(_WIDTHS[width][1])
+        if block.itemsize != width:
+            raise RuntimeError("no %d bit array type on this platform" %
+                               (8 * width))
+        block.frombytes(self.__map[offset:offset + width * count])
+        if sys.byteorder != "little":
+            block.byteswap()
+        return block
+
+    def readinto(self, buf, offset: int = 0, width: int = 4) -> int:
+        """ Copy a block starting at offset into a preallocated, writable
+        buffer.
+
+        The number of bytes copied is derived from the size of ``buf``,
+        which must be a multiple of ``width``. The block is copied with
+        ``numpy.copyto()`` or a slice of the mapping, a plain memory copy
+        whose load widths are up to the C library. ``width`` only sets the
+        alignment and size checks: ``width=8`` does not issue 64 bit MMIO
+        loads, which 32 bit targets such as the i.MX6 cannot do as one bus
+        access anyway. Read values one by one with :meth:`read64` where a
+        single access per value matters on a 64 bit host.
+
+        :param buf: writable bytes-like object, e.g. bytearray or ndarray.
+        :param int offset: BAR byte offset to start reading from.
+        :param int width: alignment and size unit in bytes, 1, 2, 4
+                          (default) or 8.
+        :returns: number of bytes copied.
+        :rtype: int
+        """
+        dst = memoryview(buf).cast("B")
+        nbytes = dst.nbytes
+        if width not in _WIDTHS:
+            raise ValueError("invalid access width %d" % (width))
+        if nbytes & (width - 1):
+            raise ValueError("buffer size (%d) is not a multiple of %d" %
+                             (nbytes, width))
+        self.__check_range(offset, nbytes // width, width)
+        if np is not None and width > 1:
+            dtype = _WIDTHS[width][2]
+            np.copyto(np.frombuffer(dst, dtype=dtype),
+                      np.frombuffer(self.__map, dtype=dtype,
+                                    count=nbytes // width, offset=offset))
+        else:
+            dst[:] = self.__map[offset:offset + nbytes]
+        return nbytes
+
+    def view(self, offset: int = 0, count: int = None) -> memoryview:
+        """ Get a zero-copy view of a BAR window.
+
+        Every access through the returned view goes to the BAR directly.
+        The BAR stays mapped as long as the view is referenced.
+
+        :param int offset: BAR byte offset the window starts at.
+        :param int count: window size in double words, defaults to the
+                          remainder of the BAR.
+        :returns: byte view of the BAR window.
+        :rtype: memoryview
+        """
+        if count is None:
+            count = (self.size - offset) >> 2
+        self.__check_range(offset, count)
+        return memoryview(self.__map)[offset:offset + 4 * count]
+
+    def ndarray(self, offset: int = 0, count: int = None, width: int = 4):
+        """ Get a zero-copy NumPy view of a BAR window.
+
+        Requires numpy. Use ``.copy()`` on the result to take a snapshot that
+        is not affected by subsequent device updates. With ``width=2`` the
+        two 16 bit halves of every double word appear as separate elements.
+
+        :param int offset: BAR byte offset the window starts at.
+        :param int count: window size in values of ``width`` bytes, defaults
+                          to the remainder of the BAR.
+        :param int width: element size in bytes, 1, 2, 4 (default) or 8.
+        :returns: little-endian unsigned view of the BAR window.
+        :rtype: numpy.ndarray
+        """
+        if np is None:
+            raise RuntimeError("Bar.ndarray() requires numpy")
+        if width not in _WIDTHS:
+            raise ValueError("invalid access width %d" % (width))
+        if count is None:
+            count = (self.size - offset) // width
+        self.__check_range(offset, count, width)
+        return np.frombuffer(self.__map, dtype=_WIDTHS[width][2], count=count,
+                             offset=offset)
+
     @property
     def size(self):
         """
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+import os
+import threading
+from struct import pack, unpack
+
+# Standard configuration header registers
+PCI_VENDOR_ID = 0x00
+PCI_DEVICE_ID = 0x02
+PCI_COMMAND = 0x04
+PCI_STATUS = 0x06
+PCI_REVISION_ID = 0x08
+PCI_HEADER_TYPE = 0x0e
+PCI_CAPABILITY_LIST = 0x34
+
+# PCI_COMMAND bits
+PCI_COMMAND_IO = 0x0001
+PCI_COMMAND_MEMORY = 0x0002
+PCI_COMMAND_MASTER = 0x0004
+PCI_COMMAND_PARITY = 0x0040
+PCI_COMMAND_SERR = 0x0100
+PCI_COMMAND_INTX_DISABLE = 0x0400
+
+# PCI_STATUS bits
+PCI_STATUS_INTERRUPT = 0x0008
+PCI_STATUS_CAP_LIST = 0x0010
+
+# Capability IDs
+PCI_CAP_ID_PM = 0x01
+PCI_CAP_ID_MSI = 0x05
+PCI_CAP_ID_VNDR = 0x09
+PCI_CAP_ID_EXP = 0x10
+PCI_CAP_ID_MSIX = 0x11
+
+# Extended capabilities start behind the 256 byte legacy header
+PCI_CFG_SPACE_SIZE = 0x100
+PCI_CFG_SPACE_EXP_SIZE = 0x1000
+
+_FORMATS = {1: "<B", 2: "<H", 4: "<L"}
+
+
+class ConfigSpace(object):
+    """ Read and write the PCI configuration space of a device through its
+    sysfs ``config`` file with ``pread()`` / ``pwrite()``.
+
+    The file is opened read/write if permitted and read-only otherwise, in
+    which case writes raise PermissionError. Unprivileged reads only cover
+    the first 64 bytes of the header, see the kernel's sysfs documentation.
+
+    :param str filename: sysfs filename of the device's config file.
+
+    """
+
+    def __init__(self, filename: str):
+        self.__fd = None
+        self.__writable = True
+        try:
+            self.__fd = os.open(filename, os.O_RDWR)
+        except PermissionError:
+            self.__fd = os.open(filename, os.O_RDONLY)
+            self.__writable = False
+        self.__size = os.fstat(self.__fd).st_size or PCI_CFG_SPACE_EXP_SIZE
+        self.__lock = threading.Lock()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ Close the config file. """
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __check_offset(self, offset: int, width: int):
+        if offset & (width - 1):
+            raise ValueError("unaligned %d bit access to config offset 0x%x"
+                             % (8 * width, offset))
+        if offset < 0 or offset + width > self.__size:
+            raise ValueError("config offset (0x%x) exceeds config size (0x%x)"
+                             % (offset, self.__size))
+
+    def __read(self, offset: int, width: int) -> int:
+        self.__check_offset(offset, width)
+        data = os.pread(self.__fd, width, offset)
+        if len(data) != width:
+            raise IOError("short config read at 0x%x: %d of %d bytes" %
+                          (offset, len(data), width))
+        return unpack(_FORMATS[width], data)[0]
+
+    def __write(self, offset: int, data: int, width: int):
+        self.__check_offset(offset, width)
+        if not self.__writable:
+            raise PermissionError("config space is opened read-only")
+        ret = os.pwrite(self.__fd, pack(_FORMATS[width], data), offset)
+        if ret != width:
+            raise IOError("short config write at 0x%x: %d of %d bytes" %
+                          (offset, ret, width))
+
+    def read8(self, offset: int) -> int:
+        """ Read a byte from the config space. """
+        return self.__read(offset, 1)
+
+    def read16(self, offset: int) -> int:
+        """ Read a 16 bit word from a 2 byte aligned config offset. """
+        return self.__read(offset, 2)
+
+    def read32(self, offset: int) -> int:
+        """ Read a 32 bit double word from a 4 byte aligned config offset. """
+        return self.__read(offset, 4)
+
+    def write8(self, offset: int, data: int):
+        """ Write a byte to the config space. """
+        self.__write(offset, data, 1)
+
+    def write16(self, offset: int, data: int):
+        """ Write a 16 bit word to a 2 byte aligned config offset. """
+        self.__write(offset, data, 2)
+
+    def write32(self, offset: int, data: int):
+        """ Write a 32 bit double word to a 4 byte aligned config offset. """
+        self.__write(offset, data, 4)
+
+    @property
+    def size(self) -> int:
+        """
+        Get the size of the accessible config space.
+
+        :returns: config space size in bytes.
+        :rtype: int
+        """
+        return self.__size
+
+    @property
+    def command(self) -> int:
+        """
+        Get or set the COMMAND register, e.g. ``PCI_COMMAND_MEMORY``.
+
+        :rtype: int
+        """
+        return self.read16(PCI_COMMAND)
+
+    @command.setter
+    def command(self, value: int):
+        self.write16(PCI_COMMAND, value)
+
+    @property
+    def status(self) -> int:
+        """
+        Get the STATUS register.
+
+        :rtype: int
+        """
+        return self.read16(PCI_STATUS)
+
+    def set_command_bits(self, bits: int) -> int:
+        """ Set bits in the COMMAND register with a read-modify-write,
+        skipping the write if they are already set.
+
+        :param int bits: PCI_COMMAND_* bits to set.
+        :returns: the new COMMAND register value.
+        :rtype: int
+        """
+        with self.__lock:
+            cmd = self.command
+            if cmd & bits != bits:
+                cmd |= bits
+                self.command = cmd
+        return cmd
+
+    def clear_command_bits(self, bits: int) -> int:
+        """ Clear bits in the COMMAND register with a read-modify-write,
+        skipping the write if they are already clear.
+
+        :param int bits: PCI_COMMAND_* bits to clear.
+        :returns: the new COMMAND register value.
+        :rtype: int
+        """
+        with self.__lock:
+            cmd = self.command
+            if cmd & bits:
+                cmd &= ~bits & 0xffff
+                self.command = cmd
+        return cmd
+
+    def capabilities(self) -> list:
+        """ Walk the standard capability list.
+
+        :returns: ``(cap_id, offset)`` tuples in list order.
+        :rtype: list
+        """
+        caps = []
+        if not self.status & PCI_STATUS_CAP_LIST:
+            return caps
+        pos = self.read8(PCI_CAPABILITY_LIST) & ~0x3
+        # at most 48 capabilities fit into the legacy config space
+        while pos >= 0x40 and len(caps) < 48:
+            header = self.read16(pos)
+            caps.append((header & 0xff, pos))
+            pos = (header >> 8) & ~0x3
+        return caps
+
+    def extended_capabilities(self) -> list:
+        """ Walk the PCIe extended capability list. Empty if only the legacy
+        256 bytes of config space are accessible.
+
+        :returns: ``(cap_id, version, offset)`` tuples in list order.
+        :rtype: list
+        """
+        caps = []
+        if self.__size <= PCI_CFG_SPACE_SIZE:
+            return caps
+        pos = PCI_CFG_SPACE_SIZE
+        # at most (4096 - 256) / 8 extended capabilities fit
+        while pos and len(caps) < 480:
+            header = self.read32(pos)
+            if header == 0 or header == 0xffffffff:
+                break
+            caps.append((header & 0xffff, (header >> 16) & 0xf, pos))
+            pos = (header >> 20) & ~0x3
+            if pos < PCI_CFG_SPACE_SIZE:
+                break
+        return caps
+
+    def find_capability(self, cap_id: int) -> int:
+        """ Find a standard capability.
+
+        :param int cap_id: PCI_CAP_ID_* capability ID.
+        :returns: config offset of the capability or None if not present.
+        :rtype: int
+        """
+        for cid, pos in self.capabilities():
+            if cid == cap_id:
+                return pos
+        return None
+
+    def find_extended_capability(self, cap_id: int) -> int:
+        """ Find a PCIe extended capability.
+
+        :param int cap_id: extended capability ID.
+        :returns: config offset of the capability or None if not present.
+        :rtype: int
+        """
+        for cid, _, pos in self.extended_capabilities():
+            if cid == cap_id:
+                return pos
+        return None
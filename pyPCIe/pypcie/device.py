@@ -1,30 +1,138 @@
 #!/usr/bin/python3
 import os
+import threading
 from .bar import Bar
+from .config import ConfigSpace
+
+
+class _BarList(object):
+    """ Sequence of the six BARs of a device, ``mmap()`` ing each BAR on
+    first access. Entries of BARs without a resourceX file are None.
+
+    """
+
+    def __init__(self, base: str):
+        self.__base = base
+        self.__bars = [None] * 6
+        self.__probed = [False] * 6
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, barnum):
+        if isinstance(barnum, slice):
+            return [self[i] for i in range(*barnum.indices(6))]
+        if self.__probed[barnum]:
+            return self.__bars[barnum]
+        with self.__lock:
+            if not self.__probed[barnum]:
+                resfile = os.path.join(self.__base,
+                                       "resource%d" % (barnum % 6))
+                if os.access(resfile, os.F_OK):
+                    self.__bars[barnum] = Bar(resfile)
+                self.__probed[barnum] = True
+        return self.__bars[barnum]
+
+    def __iter__(self):
+        for barnum in range(6):
+            yield self[barnum]
+
+    def mapped(self) -> list:
+        """ Get the BAR numbers that are currently mapped. """
+        return [i for i in range(6) if self.__bars[i] is not None]
 
 
 class Device(object):
     """ Create a Device object for a PCIe device.
 
+    BARs are ``mmap()`` ed on first access through ``bar[n]`` and sysfs
+    attributes are read once and cached until :meth:`refresh` is called.
+    Use :meth:`get` to share one Device per PCI ID within the process.
+
     :param str pciid: PCI bus ID as string, e.g. "0000:03:00.0"
+    :param str sysfs_root: directory holding the PCI device directories.
+                           Defaults to ``$PYPCIE_SYSFS_ROOT`` if set, else
+                           "/sys/bus/pci/devices/". Used to run against a
+                           simulated device tree.
 
     """
 
     __base = "/sys/bus/pci/devices/"
+    __registry = {}
+    __registry_lock = threading.Lock()
 
-    def __init__(self, pciid: str):
-        self.__base = os.path.join(self.__base, str(pciid))
+    def __init__(self, pciid: str, sysfs_root: str = None):
+        self.__base = os.path.join(self.sysfs_root(sysfs_root), str(pciid))
         if not os.access(self.__base, os.F_OK):
             raise ValueError("Device not found: %s" % (self.__base))
-        self.bar = [None] * 6
-        for barnum in range(0, 6):
-            resfile = os.path.join(self.__base, "resource%d" % (barnum))
-            if os.access(resfile, os.F_OK):
-                self.bar[barnum] = Bar(resfile)
+        self.__attrs = {}
+        self.__config = None
+        self.bar = _BarList(self.__base)
+
+    @classmethod
+    def sysfs_root(cls, sysfs_root: str = None) -> str:
+        """ Resolve the sysfs root directory used for a device.
+
+        :param str sysfs_root: explicit root, takes precedence.
+        :returns: sysfs root directory
+        :rtype: str
+        """
+        if sysfs_root:
+            return sysfs_root
+        return os.environ.get("PYPCIE_SYSFS_ROOT") or cls.__base
+
+    @classmethod
+    def get(cls, pciid: str, sysfs_root: str = None) -> "Device":
+        """ Get the process-wide Device instance for a PCI ID, creating it on
+        first use. Repeated calls return the same object, so BAR mappings
+        and cached attributes are shared.
+
+        :param str pciid: PCI bus ID as string, e.g. "0000:03:00.0"
+        :param str sysfs_root: see :class:`Device`.
+        :returns: shared Device instance
+        :rtype: Device
+        """
+        key = (cls.sysfs_root(sysfs_root), str(pciid))
+        dev = cls.__registry.get(key)
+        if dev is not None:
+            return dev
+        with cls.__registry_lock:
+            dev = cls.__registry.get(key)
+            if dev is None:
+                dev = cls(pciid, key[0])
+                cls.__registry[key] = dev
+        return dev
+
+    @property
+    def config(self) -> ConfigSpace:
+        """
+        Get the PCI configuration space of the device, opened on first use.
+
+        :returns: config space accessor
+        :rtype: ConfigSpace
+        """
+        if self.__config is None:
+            path = os.path.join(self.__base, "config")
+            if not os.access(path, os.F_OK):
+                raise ValueError("Cannot open config space of %s" %
+                                 (self.__base))
+            self.__config = ConfigSpace(path)
+        return self.__config
+
+    def refresh(self, attr: str = None):
+        """ Drop cached sysfs attributes so they are re-read on next access.
+
+        :param str attr: attribute name to drop, all attributes if None.
+        """
+        if attr is None:
+            self.__attrs.clear()
+        else:
+            self.__attrs.pop(attr, None)
 
     def __get_attr__(self, attr: str, attr_type: type):
         """ Read a sysfs attribute and convert the received string to the
-        given attribute type.
+        given attribute type. The value is cached until :meth:`refresh`.
 
         :param str attr: attribute name
         :param type attr_type: data type the attribute is casted to.
@@ -32,15 +140,21 @@ class Device(object):
         :rtype: attr_type
 
         """
+        try:
+            return self.__attrs[attr]
+        except KeyError:
+            pass
         path = os.path.join(self.__base, attr)
         if not os.access(path, os.F_OK):
             raise ValueError("Cannot read attribute %s" % (attr))
         with open(path) as f:
             val = f.read()[:-1]  # strip newline
             if attr_type is int:
-                return attr_type(val, 0)
+                val = attr_type(val, 0)
             else:
-                return attr_type(val)
+                val = attr_type(val)
+        self.__attrs[attr] = val
+        return val
 
     def vendor(self) -> int:
         """ Get the PCI vendor ID.
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+import os
+import threading
+import time
+
+
+class WaitTimeout(TimeoutError):
+    """ Raised when a polled condition is not met within the timeout.
+
+    :param str msg: error message.
+    :param int polls: number of polls done before giving up.
+    :param float elapsed: seconds waited.
+
+    """
+
+    def __init__(self, msg: str, polls: int, elapsed: float):
+        super().__init__(msg)
+        self.polls = polls
+        self.elapsed = elapsed
+
+
+class Backoff(object):
+    """ Spin-then-yield-then-sleep delay strategy between polls.
+
+    The first ``spins`` polls are issued back to back for the lowest
+    latency, the next ``yields`` polls give up the CPU with
+    ``sched_yield()``, after that the delay doubles from ``min_sleep`` up to
+    ``max_sleep`` seconds.
+
+    :param int spins: polls without any delay.
+    :param int yields: polls with a scheduler yield.
+    :param float min_sleep: first sleep in seconds.
+    :param float max_sleep: upper bound for the sleep in seconds.
+
+    """
+
+    def __init__(self, spins: int = 64, yields: int = 256,
+                 min_sleep: float = 50e-6, max_sleep: float = 1e-3):
+        if spins < 0 or yields < 0 or min_sleep <= 0 or max_sleep < min_sleep:
+            raise ValueError("invalid backoff parameters")
+        self.spins = spins
+        self.yields = yields
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+
+    def delay(self, attempt: int) -> float:
+        """ Get the sleep in seconds after poll number ``attempt`` (0-based),
+        0 for spinning and -1 for yielding. """
+        if attempt < self.spins:
+            return 0.0
+        attempt -= self.spins
+        if attempt < self.yields:
+            return -1.0
+        attempt -= self.yields
+        return min(self.min_sleep * (1 << min(attempt, 30)), self.max_sleep)
+
+    def wait(self, attempt: int, remaining: float = None):
+        """ Delay after poll number ``attempt``, never longer than
+        ``remaining`` seconds. """
+        delay = self.delay(attempt)
+        if delay < 0:
+            _yield()
+        elif delay > 0:
+            if remaining is not None:
+                delay = min(delay, max(remaining, 0.0))
+            time.sleep(delay)
+
+
+def _yield():
+    if hasattr(os, "sched_yield"):
+        os.sched_yield()
+    else:
+        time.sleep(0)
+
+
+class WaitStats(object):
+    """ Histograms of poll counts and wait times of completed waits.
+
+    Both histograms use power-of-two buckets: bucket ``k`` counts waits with
+    ``2**(k-1) < x <= 2**k`` polls or microseconds respectively.
+
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clear all recorded waits. """
+        with self.__lock:
+            self.count = 0
+            self.timeouts = 0
+            self.total_polls = 0
+            self.total_time = 0.0
+            self.max_time = 0.0
+            self.poll_hist = [0] * self.BUCKETS
+            self.time_hist = [0] * self.BUCKETS
+
+    @classmethod
+    def _bucket(cls, value: int) -> int:
+        return min(max(value - 1, 0).bit_length(), cls.BUCKETS - 1)
+
+    def record(self, polls: int, elapsed: float, timeout: bool = False):
+        """ Record one wait.
+
+        :param int polls: number of polls of the wait.
+        :param float elapsed: duration of the wait in seconds.
+        :param bool timeout: the wait ended with a timeout.
+        """
+        with self.__lock:
+            self.count += 1
+            self.timeouts += bool(timeout)
+            self.total_polls += polls
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.poll_hist[self._bucket(polls)] += 1
+            self.time_hist[self._bucket(int(elapsed * 1e6))] += 1
+
+    def percentile(self, pct: float) -> float:
+        """ Get an upper bound of the wait time percentile in seconds from
+        the time histogram. """
+        with self.__lock:
+            if not self.count:
+                return 0.0
+            rank = pct / 100.0 * self.count
+            seen = 0
+            for k, n in enumerate(self.time_hist):
+                seen += n
+                if n and seen >= rank:
+                    return min((1 << k) * 1e-6, self.max_time)
+            return self.max_time
+
+    def summary(self) -> dict:
+        """ Get the statistics as a dict, histograms keyed by bucket upper
+        bound with empty buckets left out. """
+        with self.__lock:
+            count = self.count or 1
+            return {
+                "waits": self.count,
+                "timeouts": self.timeouts,
+                "mean_polls": self.total_polls / count,
+                "mean_time": self.total_time / count,
+                "max_time": self.max_time,
+                "poll_hist": {1 << k: n for k, n in
+                              enumerate(self.poll_hist) if n},
+                "time_hist_us": {1 << k: n for k, n in
+                                 enumerate(self.time_hist) if n},
+            }
+
+
+def poll_until(condition, timeout: float = 1.0, backoff: Backoff = None,
+               stats: WaitStats = None, what: str = "condition") -> int:
+    """ Poll ``condition()`` until it returns a true value.
+
+    :param condition: callable without arguments, polled until true.
+    :param float timeout: seconds to wait at most, None waits forever.
+    :param Backoff backoff: delay strategy between polls, default Backoff().
+    :param WaitStats stats: record the wait into these statistics.
+    :param str what: description used in the timeout message.
+    :returns: number of polls.
+    :rtype: int
+    :raises WaitTimeout: if the timeout expires.
+    """
+    if backoff is None:
+        backoff = _default_backoff
+    start = time.perf_counter()
+    deadline = None if timeout is None else start + timeout
+    polls = 0
+    while True:
+        polls += 1
+        if condition():
+            break
+        now = time.perf_counter()
+        if deadline is not None and now >= deadline:
+            elapsed = now - start
+            if stats is not None:
+                stats.record(polls, elapsed, timeout=True)
+            raise WaitTimeout("timeout waiting for %s after %d polls (%.3f s)"
+                              % (what, polls, elapsed), polls, elapsed)
+        backoff.wait(polls - 1,
+                     None if deadline is None else deadline - now)
+    if stats is not None:
+        stats.record(polls, time.perf_counter() - start)
+    return polls
+
+
+_default_backoff = Backoff()
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+import threading
+from .bar import Bar
+
+# Register access modes
+RO = "ro"      # read-only, writes are rejected
+WO = "wo"      # write-only, reads return the shadow value
+RW = "rw"      # read/write
+W1P = "w1p"    # write-1-pulse, every write is followed by a write of 0
+ACCESS_MODES = (RO, WO, RW, W1P)
+
+
+class Field(object):
+    """ A bitfield within a register.
+
+    :param str name: field name, unique within its register.
+    :param int lsb: bit position of the least significant bit.
+    :param int width: field width in bits.
+
+    """
+
+    def __init__(self, name: str, lsb: int, width: int = 1):
+        if lsb < 0 or width < 1 or lsb + width > 32:
+            raise ValueError("field %s [%d+:%d] exceeds 32 bits" %
+                             (name, lsb, width))
+        self.name = name
+        self.lsb = lsb
+        self.width = width
+        self.mask = ((1 << width) - 1) << lsb
+
+    def extract(self, value: int) -> int:
+        """ Get the field value out of a register value. """
+        return (value & self.mask) >> self.lsb
+
+    def insert(self, value: int, field_value: int) -> int:
+        """ Replace the field in a register value. """
+        if field_value >> self.width:
+            raise ValueError("value 0x%x does not fit into field %s" %
+                             (field_value, self.name))
+        return (value & ~self.mask & 0xffffffff) | (field_value << self.lsb)
+
+
+class Register(object):
+    """ Declaration of a 32 bit register within a BAR.
+
+    :param str name: register name, unique within its map.
+    :param int offset: BAR byte offset of the register.
+    :param str access: access mode, one of RO, WO, RW or W1P.
+    :param int reset: value after reset, used to seed the shadow cache.
+                      None if unknown.
+    :param bool volatile: the device may change the value, reads always go
+                          to the bus. Implied for RO registers.
+    :param fields: iterable of :class:`Field` of this register.
+
+    """
+
+    def __init__(self, name: str, offset: int, access: str = RW,
+                 reset: int = None, volatile: bool = False, fields=()):
+        if access not in ACCESS_MODES:
+            raise ValueError("invalid access mode %r for register %s" %
+                             (access, name))
+        if offset & 0x3:
+            raise ValueError("unaligned register %s at 0x%x" % (name, offset))
+        self.name = name
+        self.offset = offset
+        self.access = access
+        self.reset = reset
+        self.volatile = volatile or access == RO
+        self.fields = {f.name: f for f in fields}
+
+    @property
+    def cacheable(self) -> bool:
+        """ Whether reads of the register can be served from the shadow. """
+        return not self.volatile
+
+    def field(self, name: str) -> Field:
+        """ Get a field of the register by name. """
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise ValueError("register %s has no field %s" %
+                             (self.name, name)) from None
+
+
+class RegisterMap(object):
+    """ Named register access to a :class:`Bar` with a shadow cache.
+
+    With the cache enabled, reads of non-volatile and write-only registers
+    are served from the shadow once the value is known, and writes of an
+    unchanged value to RW/WO registers are skipped. W1P registers are never
+    skipped and read back as 0.
+
+    :param Bar bar: BAR the registers live in.
+    :param registers: iterable of :class:`Register`.
+    :param bool cache: enable the shadow cache.
+
+    """
+
+    def __init__(self, bar: Bar, registers, cache: bool = True):
+        self.bar = bar
+        self.cache = cache
+        self.registers = {}
+        for reg in registers:
+            if reg.name in self.registers:
+                raise ValueError("duplicate register %s" % (reg.name))
+            self.registers[reg.name] = reg
+        self.__shadow = {}
+        self.__lock = threading.RLock()
+        self.bus_reads = 0
+        self.bus_writes = 0
+        self.cache_hits = 0
+        self.invalidate()
+
+    def register(self, name: str) -> Register:
+        """ Get a register declaration by name. """
+        try:
+            return self.registers[name]
+        except KeyError:
+            raise ValueError("unknown register %s" % (name)) from None
+
+    def invalidate(self, name: str = None):
+        """ Reset the shadow of one or all registers to their reset value,
+        e.g. after the device was reset or reprogrammed.
+
+        :param str name: register name, all registers if None.
+        """
+        with self.__lock:
+            regs = self.registers.values() if name is None else \
+                [self.register(name)]
+            for reg in regs:
+                if reg.access == W1P:
+                    self.__shadow[reg.name] = 0
+                elif reg.reset is not None and reg.cacheable:
+                    self.__shadow[reg.name] = reg.reset
+                else:
+                    self.__shadow.pop(reg.name, None)
+
+    def read(self, name: str) -> int:
+        """ Read a register, from the shadow if possible.
+
+        :param str name: register name.
+        :rtype: int
+        """
+        reg = self.register(name)
+        if reg.access in (WO, W1P):
+            value = self.__shadow.get(name)
+            if value is None:
+                raise ValueError("write-only register %s was never written" %
+                                 (name))
+            self.cache_hits += 1
+            return value
+        if self.cache and reg.cacheable:
+            value = self.__shadow.get(name)
+            if value is not None:
+                self.cache_hits += 1
+                return value
+        value = self.bar.read(reg.offset)
+        self.bus_reads += 1
+        if reg.cacheable:
+            self.__shadow[name] = value
+        return value
+
+    def write(self, name: str, value: int):
+        """ Write a register. Unchanged values of RW/WO registers are not
+        written again while the cache is enabled. W1P registers get the value
+        followed by 0 in the same batch.
+
+        :param str name: register name.
+        :param int value: value to write.
+        """
+        reg = self.register(name)
+        if reg.access == RO:
+            raise ValueError("register %s is read-only" % (name))
+        with self.__lock:
+            if reg.access == W1P:
+                with self.bar.batch():
+                    self.bar.write(reg.offset, value)
+                    self.bar.write(reg.offset, 0)
+                self.bus_writes += 2
+                return
+            if self.cache and not reg.volatile and \
+                    self.__shadow.get(name) == value:
+                self.cache_hits += 1
+                return
+            self.bar.write(reg.offset, value)
+            self.bus_writes += 1
+            self.__shadow[name] = value
+
+    def pulse(self, name: str, value: int = 1):
+        """ Pulse a W1P register. Same as :meth:`write` for W1P registers. """
+        if self.register(name).access != W1P:
+            raise ValueError("register %s is not a pulse register" % (name))
+        self.write(name, value)
+
+    def write_many(self, values):
+        """ Write several registers in order within one BAR batch.
+
+        :param values: iterable of ``(name, value)`` tuples.
+        """
+        with self.__lock, self.bar.batch():
+            for name, value in values:
+                self.write(name, value)
+
+    def read_field(self, name: str, field: str) -> int:
+        """ Read a bitfield of a register.
+
+        :param str name: register name.
+        :param str field: field name.
+        :rtype: int
+        """
+        return self.register(name).field(field).extract(self.read(name))
+
+    def write_field(self, name: str, field: str, value: int):
+        """ Update a bitfield of a register with a read-modify-write. The
+        read is served from the shadow where possible.
+
+        :param str name: register name.
+        :param str field: field name.
+        :param int value: new field value.
+        """
+        reg = self.register(name)
+        fld = reg.field(field)
+        with self.__lock:
+            if reg.access in (WO, W1P):
+                current = self.__shadow.get(name) or 0
+            else:
+                current = self.read(name)
+            self.write(name, fld.insert(current, value))
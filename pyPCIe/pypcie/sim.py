@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+import os
+import shutil
+import tempfile
+from struct import pack_into
+
+from .config import PCI_CFG_SPACE_SIZE, PCI_REVISION_ID, PCI_VENDOR_ID
+
+
+class FakeDevice(object):
+    """ Build a fake sysfs device directory that :class:`pypcie.Device` can
+    bind to, with regular files standing in for the ``resourceX`` BARs and
+    the ``vendor``, ``device``, ``revision`` and ``config`` attributes.
+
+    Pass the ``root`` to ``Device(pciid, sysfs_root=root)`` or set
+    ``$PYPCIE_SYSFS_ROOT`` to it.
+
+    :param str root: directory to create the device directory in, a new
+                     temporary directory if None.
+    :param str pciid: PCI bus ID as string, e.g. "0000:01:00.0"
+    :param dict bars: BAR number to BAR size in bytes.
+    :param int vendor: PCI vendor ID.
+    :param int device: PCI device ID.
+    :param int revision: PCI revision number.
+
+    """
+
+    def __init__(self, root: str = None, pciid: str = "0000:01:00.0",
+                 bars: dict = None, vendor: int = 0x10ee,
+                 device: int = 0x7024, revision: int = 0):
+        self.__tmp = root is None
+        self.root = tempfile.mkdtemp(prefix="pypcie-sim-") if root is None \
+            else root
+        self.pciid = pciid
+        self.path = os.path.join(self.root, pciid)
+        os.makedirs(self.path, exist_ok=True)
+        if bars is None:
+            bars = {0: 4096}
+        for barnum, size in bars.items():
+            with open(self.resource(barnum), "wb") as f:
+                f.truncate(size)
+        for attr, value in (("vendor", vendor), ("device", device),
+                            ("subsystem_vendor", vendor),
+                            ("subsystem_device", device),
+                            ("revision", revision)):
+            with open(os.path.join(self.path, attr), "w") as f:
+                f.write("0x%04x\n" % (value))
+        config = bytearray(PCI_CFG_SPACE_SIZE)
+        # vendor and device ID are adjacent, COMMAND starts out disabled
+        pack_into("<HH", config, PCI_VENDOR_ID, vendor, device)
+        pack_into("<B", config, PCI_REVISION_ID, revision)
+        with open(os.path.join(self.path, "config"), "wb") as f:
+            f.write(config)
+
+    def resource(self, barnum: int) -> str:
+        """ Get the path of the file backing a BAR. """
+        return os.path.join(self.path, "resource%d" % (barnum))
+
+    def remove(self):
+        """ Delete the device directory, and the root if it was created by
+        this instance. """
+        shutil.rmtree(self.root if self.__tmp else self.path,
+                      ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.remove()
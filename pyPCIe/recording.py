@@ -0,0 +1,844 @@
+"""Binary append-only capture recordings.
+
+A recording is a 64 byte file header followed by one record per capture:
+
+    file header   magic "FBGCAP\\0\\0", version, header size, words per
+                  capture, creation time, low/high channel names
+    record        32 byte record header (magic "CAPR", payload size,
+                  sequence number, timestamp, DAC value, encoding) followed
+                  by the payload
+
+The payload is the capture as read from the BRAM (ENC_RAW, interleaved
+32-bit words), de-interleaved uint16 channel planes (ENC_PLANAR) or the
+planes delta coded, 12-bit packed and compressed in chunks with a chunk
+table (ENC_COMPRESSED, see compression.py). Every record goes to disk with
+a single writev() of header and payload, and a capture takes 4 bytes per
+word instead of about 10 as decimal CSV text, about 1 byte compressed.
+
+A sidecar index "<recording>.idx" holds one INDEX_DTYPE entry per record
+(offset, sequence number, timestamp, DAC value). Recording memory-maps the
+file and uses the index for random access, so opening a large recording
+reads the index only and a capture touches just its own pages. Records
+missing from the index, e.g. after a crash, are found by scanning the
+record headers behind the last indexed one. Only RecordingWriter appends
+to the index; it marks the recording with "<recording>.lock" while open,
+and readers write a scanned index back only on request and when no
+writer holds the lock.
+
+    with RecordingWriter("run.cap") as rec:
+        rec.write(capture)
+
+    rec = Recording("run.cap")
+    rec[-1].channels()["A"]
+    for capture in rec.between(t0, t1):
+        ...
+
+    python recording.py import pcie_samples.csv pcie_samples.cap
+    python recording.py compress run.cap run-archive.cap
+"""
+import argparse
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+import compression
+import decode
+from acquisition import CAPTURE_WORDS, Capture
+from pypcie.poll import WaitStats
+
+MAGIC = b"FBGCAP\0\0"
+VERSION = 1
+RECORD_MAGIC = b"CAPR"
+
+# magic, version, header size, words, created, low name, high name
+FILE_HEADER = struct.Struct("<8sHHId8s8s")
+FILE_HEADER_SIZE = 64
+# magic, payload size, seq, timestamp, DAC value (-1 unset), encoding, flags
+RECORD_HEADER = struct.Struct("<4sIQdiHH")
+
+# payload encodings
+ENC_RAW = 0
+ENC_PLANAR = 1
+ENC_COMPRESSED = 2
+
+NO_DAC = -1
+
+INDEX_MAGIC = b"CAPIDX\0\0"
+# magic, creation time of the indexed recording
+INDEX_HEADER = struct.Struct("<8sd")
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),        # file offset of the record header
+    ("seq", "<u8"),
+    ("timestamp", "<f8"),
+    ("size", "<u4"),          # payload size
+    ("dac_value", "<i4"),
+    ("encoding", "<u2"),
+    ("flags", "<u2"),
+    ("reserved", "<u4"),
+])
+
+
+class RecordingError(ValueError):
+    """ A file is not a valid recording. """
+
+
+class RecordingHeader(object):
+    """ File header of a recording.
+
+    :param int words: capture size in 32-bit words.
+    :param decode.ChannelLayout layout: channel names of the low and high
+                                        half-words.
+    :param float created: creation time, now if None.
+
+    """
+
+    def __init__(self, words=CAPTURE_WORDS, layout=decode.LAYOUT_AB,
+                 created=None, version=VERSION):
+        self.words = words
+        self.layout = layout
+        self.created = time.time() if created is None else created
+        self.version = version
+
+    def pack(self):
+        data = FILE_HEADER.pack(MAGIC, self.version, FILE_HEADER_SIZE,
+                                self.words, self.created,
+                                self.layout.low.encode(),
+                                self.layout.high.encode())
+        return data.ljust(FILE_HEADER_SIZE, b"\0")
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < FILE_HEADER_SIZE or data[:8] != MAGIC:
+            raise RecordingError("not a capture recording")
+        magic, version, size, words, created, low, high = \
+            FILE_HEADER.unpack_from(data)
+        if version != VERSION or size != FILE_HEADER_SIZE:
+            raise RecordingError("unsupported recording version %d" %
+                                 (version))
+        layout = decode.ChannelLayout(low.rstrip(b"\0").decode(),
+                                      high.rstrip(b"\0").decode())
+        return cls(words, layout, created, version)
+
+    @classmethod
+    def read(cls, f):
+        return cls.unpack(f.read(FILE_HEADER_SIZE))
+
+
+def decode_payload(payload, words, encoding):
+    """ Turn a record payload into a (2, N) channel array, a view into
+    ``payload`` where possible.
+
+    :rtype: numpy.ndarray
+    """
+    if encoding == ENC_RAW:
+        return decode.as_samples(payload).T
+    if encoding == ENC_PLANAR:
+        return np.frombuffer(payload, decode.SAMPLE_DTYPE).reshape(2, words)
+    if encoding == ENC_COMPRESSED:
+        return compression.decode_planes(payload)
+    raise RecordingError("unknown encoding %d" % (encoding))
+
+
+class RecordingWriter(object):
+    """ Append captures to a recording.
+
+    :param str filename: recording file.
+    :param int words: capture size in 32-bit words.
+    :param decode.ChannelLayout layout: channel names stored in the header.
+    :param int encoding: ENC_RAW, ENC_PLANAR or ENC_COMPRESSED.
+    :param bool append: add to an existing recording instead of truncating
+                        it. Its header has to match.
+    :param bool index: maintain the sidecar index.
+    :param int preallocate: reserve disk space in steps of this many bytes
+                            with posix_fallocate() ahead of the records, 0
+                            to grow the file with every write. The file is
+                            truncated to its records on close.
+    :param int codec: compression codec of ENC_COMPRESSED, the best
+                      available one if None.
+    :param int chunk_samples: samples per compressed chunk.
+
+    """
+
+    def __init__(self, filename, words=CAPTURE_WORDS,
+                 layout=decode.LAYOUT_AB, encoding=ENC_RAW, append=False,
+                 index=True, preallocate=0, codec=None,
+                 chunk_samples=compression.CHUNK_SAMPLES):
+        if encoding not in (ENC_RAW, ENC_PLANAR, ENC_COMPRESSED):
+            raise ValueError("unknown encoding %d" % (encoding))
+        self.filename = filename
+        self.words = words
+        self.encoding = encoding
+        self.codec = compression.default_codec() if codec is None else codec
+        self.chunk_samples = chunk_samples
+        self.size = 4 * words
+        self.records = 0
+        self.bytes_written = 0
+        self.__planes = np.empty((2, words), decode.SAMPLE_DTYPE) \
+            if encoding != ENC_RAW else None
+        self.__seq = 0
+        self.__index = None
+        self.__entry = np.zeros(1, INDEX_DTYPE)
+        self.__preallocate = preallocate \
+            if hasattr(os, "posix_fallocate") else 0
+        self.__allocated = 0
+        exists = append and os.path.exists(filename) and \
+            os.path.getsize(filename) > 0
+        self.__fd = os.open(filename, os.O_WRONLY | os.O_CREAT |
+                            (0 if append else os.O_TRUNC), 0o644)
+        self.__lock = None
+        try:
+            # tells readers not to touch the index while this writer runs
+            self.__lock = lock_filename(filename)
+            with open(self.__lock, "w") as f:
+                f.write("%d\n" % (os.getpid()))
+            if exists:
+                with open(filename, "rb") as f:
+                    self.header = RecordingHeader.read(f)
+                if self.header.words != words:
+                    raise RecordingError(
+                        "%s holds captures of %d words, not %d" %
+                        (filename, self.header.words, words))
+                with Recording(filename) as rec:
+                    # drop a truncated last record
+                    self.__offset = rec.end
+                    self.__seq = int(rec.index["seq"][-1]) + 1 \
+                        if len(rec) else 0
+                    entries = rec.index
+                os.ftruncate(self.__fd, self.__offset)
+                os.lseek(self.__fd, self.__offset, os.SEEK_SET)
+            else:
+                self.header = RecordingHeader(words, layout)
+                os.write(self.__fd, self.header.pack())
+                self.__offset = FILE_HEADER_SIZE
+            if index:
+                # rewrite the index of the records kept, then append to it
+                self.__index = open(index_filename(filename), "wb")
+                self.__index.write(INDEX_HEADER.pack(INDEX_MAGIC,
+                                                     self.header.created))
+                if exists:
+                    entries.tofile(self.__index)
+        except Exception:
+            os.close(self.__fd)
+            self.__fd = None
+            self.__unlock()
+            raise
+
+    @property
+    def offset(self):
+        """ File offset the next record is written to. """
+        return self.__offset
+
+    def write(self, raw, seq=None, timestamp=None, dac_value=None):
+        """ Append a capture.
+
+        :param raw: raw BRAM image of ``words`` 32-bit words, or an
+                    acquisition.Capture whose metadata is used.
+        :param int seq: sequence number, counting up from the last record
+                        if None.
+        :param float timestamp: capture time, now if None.
+        :param int dac_value: DAC value of the capture.
+        :returns: file offset of the record.
+        :rtype: int
+        """
+        if hasattr(raw, "raw"):
+            seq = raw.seq if seq is None and raw.seq >= 0 else seq
+            timestamp = raw.timestamp if timestamp is None else timestamp
+            dac_value = raw.dac_value if dac_value is None else dac_value
+            raw = raw.raw
+        payload = memoryview(raw).cast("B")
+        if len(payload) != self.size:
+            raise ValueError("capture is %d bytes, expected %d" %
+                             (len(payload), self.size))
+        if self.encoding == ENC_PLANAR:
+            payload = memoryview(decode.decode_into(raw, self.__planes)) \
+                .cast("B")
+        elif self.encoding == ENC_COMPRESSED:
+            payload = compression.encode_planes(
+                decode.decode_into(raw, self.__planes), self.codec,
+                self.chunk_samples)
+        if seq is None:
+            seq = self.__seq
+        self.__seq = seq + 1
+        timestamp = time.time() if timestamp is None else timestamp
+        dac_value = NO_DAC if dac_value is None else dac_value
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(payload), seq,
+                                    timestamp, dac_value, self.encoding, 0)
+        return self._write_record((header, payload), seq, timestamp,
+                                  dac_value, self.encoding)
+
+    def _write_record(self, buffers, seq, timestamp, dac_value, encoding):
+        """ Write the parts of one record with a single writev() and add it
+        to the index. """
+        offset = self.__offset
+        total = sum(len(b) for b in buffers)
+        if self.__preallocate and offset + total > self.__allocated:
+            length = max(self.__preallocate, total)
+            os.posix_fallocate(self.__fd, offset, length)
+            self.__allocated = offset + length
+        written = os.writev(self.__fd, buffers)
+        if written != total:
+            # short write, e.g. on a full disk; finish or fail loudly
+            data = b"".join(bytes(b) for b in buffers)[written:]
+            while data:
+                data = data[os.write(self.__fd, data):]
+        self.__offset += total
+        self.records += 1
+        self.bytes_written += total
+        if self.__index is not None:
+            entry = self.__entry[0]
+            entry["offset"] = offset
+            entry["seq"] = seq
+            entry["timestamp"] = timestamp
+            entry["size"] = total - RECORD_HEADER.size
+            entry["dac_value"] = dac_value
+            entry["encoding"] = encoding
+            self.__index.write(self.__entry.tobytes())
+        return offset
+
+    def flush(self, sync=False):
+        """ Push the buffered index to the OS, records are unbuffered.
+        ``sync`` also waits for the disk. """
+        if self.__index is not None:
+            self.__index.flush()
+        if sync:
+            os.fsync(self.__fd)
+
+    def close(self):
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
+        if self.__fd is not None:
+            if self.__allocated > self.__offset:
+                # give back the preallocated space behind the last record
+                os.ftruncate(self.__fd, self.__offset)
+            os.close(self.__fd)
+            self.__fd = None
+        self.__unlock()
+
+    def __unlock(self):
+        if self.__lock is not None:
+            try:
+                os.unlink(self.__lock)
+            except FileNotFoundError:
+                pass
+            self.__lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            pass
+
+
+# AsyncRecorder policies when all capture buffers are queued
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class RecorderStats(object):
+    """ Counters of an AsyncRecorder. ``write_latency`` records the time
+    of every record write, its ``polls`` are always 1. """
+
+    def __init__(self):
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.blocked_time = 0.0
+        self.write_latency = WaitStats()
+
+    def summary(self):
+        latency = self.write_latency
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+            "blocked_s": self.blocked_time,
+            "write_mean_s": latency.total_time / (latency.count or 1),
+            "write_p99_s": latency.percentile(99),
+            "write_max_s": latency.max_time,
+        }
+
+
+class AsyncRecorder(object):
+    """ Write captures to a RecordingWriter from a dedicated thread.
+
+    :meth:`submit` copies a capture into one of ``buffers`` preallocated
+    buffers and queues it, so the caller never waits for the disk unless
+    the policy is BLOCK and the queue is full. A write that fails in the
+    thread is counted and its exception raised by the next :meth:`submit`
+    or by :meth:`close`.
+
+    :param RecordingWriter writer: recording to write to, closed by
+                                   :meth:`close`.
+    :param int buffers: number of capture buffers, the queue length.
+    :param str policy: BLOCK waits for a free buffer, DROP_OLDEST replaces
+                       the oldest queued capture, DROP_NEWEST discards the
+                       submitted one.
+    :param float sync_interval: fsync() the recording from the writer
+                                thread every this many seconds, never if
+                                None.
+
+    """
+
+    def __init__(self, writer, buffers=8, policy=DROP_OLDEST,
+                 sync_interval=None):
+        if policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST):
+            raise ValueError("unknown queue policy %r" % (policy))
+        if buffers < 1:
+            raise ValueError("at least one capture buffer is required")
+        self.writer = writer
+        self.policy = policy
+        self.sync_interval = sync_interval
+        self.stats = RecorderStats()
+        self.error = None
+        self.__free = queue.Queue()
+        self.__ready = queue.Queue()
+        for _ in range(buffers):
+            self.__free.put(Capture(writer.words))
+        self.__closing = threading.Event()
+        self.__thread = threading.Thread(target=self.__loop,
+                                         name="recorder", daemon=True)
+        self.__thread.start()
+
+    @property
+    def depth(self):
+        """ Number of captures waiting to be written. """
+        return self.__ready.qsize()
+
+    def __buffer(self):
+        try:
+            return self.__free.get_nowait()
+        except queue.Empty:
+            pass
+        if self.policy == DROP_NEWEST:
+            return None
+        if self.policy == DROP_OLDEST:
+            try:
+                capture = self.__ready.get_nowait()
+                self.stats.dropped += 1
+                return capture
+            except queue.Empty:
+                pass  # the writer thread holds the only queued capture
+        t0 = time.perf_counter()
+        capture = self.__free.get()
+        self.stats.blocked_time += time.perf_counter() - t0
+        return capture
+
+    def __raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def submit(self, raw, seq=None, timestamp=None, dac_value=None):
+        """ Queue a capture for writing, see RecordingWriter.write().
+
+        :returns: False if the capture was dropped.
+        :rtype: bool
+        :raises Exception: the error of a failed write since the last call.
+        """
+        if self.__closing.is_set():
+            raise ValueError("recorder is closed")
+        self.__raise_error()
+        self.stats.submitted += 1
+        capture = self.__buffer()
+        if capture is None:
+            self.stats.dropped += 1
+            return False
+        if hasattr(raw, "raw"):
+            capture.copy_from(raw)
+        else:
+            capture.raw[:] = memoryview(raw).cast("B")
+            capture.seq = -1
+            capture.timestamp = time.time()
+            capture.dac_value = None
+        if seq is not None:
+            capture.seq = seq
+        if timestamp is not None:
+            capture.timestamp = timestamp
+        if dac_value is not None:
+            capture.dac_value = dac_value
+        self.__ready.put(capture)
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        return True
+
+    def __loop(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                capture = self.__ready.get(timeout=0.1)
+            except queue.Empty:
+                if self.__closing.is_set():
+                    break
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.writer.write(capture)
+                self.stats.written += 1
+            except Exception as e:
+                self.stats.failed += 1
+                self.error = e
+            finally:
+                self.stats.write_latency.record(1, time.perf_counter() - t0)
+                self.__free.put(capture)
+            if self.sync_interval is not None and \
+                    time.monotonic() - last_sync >= self.sync_interval:
+                try:
+                    self.writer.flush(sync=True)
+                except Exception as e:
+                    self.error = e
+                last_sync = time.monotonic()
+
+    def close(self, timeout=None):
+        """ Write the queued captures, stop the thread and close the
+        writer.
+
+        :raises TimeoutError: if the thread is still writing after
+                              ``timeout`` seconds, the writer is left open
+                              and close() can be called again.
+        :raises Exception: the error of a failed write not raised yet.
+        """
+        self.__closing.set()
+        self.__thread.join(timeout)
+        if self.__thread.is_alive():
+            raise TimeoutError("recorder thread still writing after %s s" %
+                               (timeout))
+        self.writer.close()
+        self.__raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def index_filename(filename):
+    """ Name of the sidecar index of a recording. """
+    return filename + ".idx"
+
+
+def lock_filename(filename):
+    """ Name of the file that marks a recording as open by a
+    RecordingWriter. """
+    return filename + ".lock"
+
+
+def scan_records(buf, offset=FILE_HEADER_SIZE, end=None):
+    """ Build index entries by walking the record headers of a recording
+    buffer from ``offset``. Stops at the first truncated or invalid record.
+
+    :rtype: numpy.ndarray of INDEX_DTYPE
+    """
+    end = len(buf) if end is None else end
+    entries = []
+    while offset + RECORD_HEADER.size <= end:
+        magic, size, seq, timestamp, dac, encoding, flags = \
+            RECORD_HEADER.unpack_from(buf, offset)
+        if magic != RECORD_MAGIC or not size or \
+                offset + RECORD_HEADER.size + size > end:
+            break
+        entries.append((offset, seq, timestamp, size, dac, encoding, flags,
+                        0))
+        offset += RECORD_HEADER.size + size
+    return np.array(entries, INDEX_DTYPE)
+
+
+class RecordedCapture(object):
+    """ A capture of a :class:`Recording`.
+
+    ``data`` is a (2, N) uint16 array, row 0 the low and row 1 the high
+    half-word channel, and a view into the memory-mapped file where the
+    encoding allows it.
+
+    """
+
+    def __init__(self, data, seq, timestamp, dac_value, layout):
+        self.data = data
+        self.seq = seq
+        self.timestamp = timestamp
+        self.dac_value = dac_value
+        self.layout = layout
+
+    def channels(self):
+        """ Get a dict of channel name to sample array. """
+        return {self.layout.low: self.data[0], self.layout.high: self.data[1]}
+
+    def channel(self, name):
+        return self.data[self.layout.index(name)]
+
+    def __repr__(self):
+        return "RecordedCapture(seq=%d, timestamp=%f, dac_value=%r)" % (
+            self.seq, self.timestamp, self.dac_value)
+
+
+class Recording(object):
+    """ Random access to a recording through np.memmap and its index.
+
+    Supports ``len()``, ``rec[i]`` (negative indices and slices too),
+    iteration and time ranges with :meth:`between`. The index is loaded
+    from the sidecar file when it exists and extended in memory by
+    scanning records written after it, so recordings without or with a
+    stale index open too, also while a RecordingWriter appends to them.
+
+    :param str filename: recording file.
+    :param bool update_index: write scanned index entries back to the
+                              sidecar file, see :meth:`save_index`.
+
+    """
+
+    def __init__(self, filename, update_index=False):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.header = RecordingHeader.read(f)
+        self.words = self.header.words
+        self.layout = self.header.layout
+        self.__map = np.memmap(filename, np.uint8, "r")
+        self.index, self.__dirty = self.__load_index()
+        if len(self.index):
+            last = self.index[-1]
+            self.end = int(last["offset"]) + RECORD_HEADER.size + \
+                int(last["size"])
+        else:
+            self.end = FILE_HEADER_SIZE
+        if update_index:
+            self.save_index()
+
+    def __load_index(self):
+        name = index_filename(self.filename)
+        index = np.zeros(0, INDEX_DTYPE)
+        try:
+            with open(name, "rb") as f:
+                magic, created = INDEX_HEADER.unpack(
+                    f.read(INDEX_HEADER.size))
+                if magic == INDEX_MAGIC and created == self.header.created:
+                    index = np.fromfile(f, INDEX_DTYPE)
+        except (OSError, struct.error):
+            pass
+        # keep whole records that are still in the file
+        ends = index["offset"] + RECORD_HEADER.size + index["size"]
+        complete = ends <= len(self.__map)
+        stale = not complete.all()
+        index = index[complete]
+        offset = FILE_HEADER_SIZE
+        if len(index):
+            offset = int(index["offset"][-1]) + RECORD_HEADER.size + \
+                int(index["size"][-1])
+        tail = scan_records(self.__map, offset)
+        dirty = bool(len(tail)) or stale or not os.path.exists(name)
+        return np.concatenate((index, tail)), dirty
+
+    def save_index(self):
+        """ Write the index back to the sidecar file if records were found
+        by scanning. Skipped while a RecordingWriter has the recording
+        open, which appends to the index itself, or if the file does not
+        end with a complete record.
+
+        :returns: whether the index file was written.
+        :rtype: bool
+        """
+        if not self.__dirty or self.end != len(self.__map) or \
+                os.path.exists(lock_filename(self.filename)):
+            return False
+        try:
+            with open(index_filename(self.filename), "wb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.header.created))
+                self.index.tofile(f)
+        except OSError:
+            return False  # read-only location, keep the index in memory
+        self.__dirty = False
+        return True
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    def capture(self, i):
+        """ Get capture ``i`` without copying its samples.
+
+        :rtype: RecordedCapture
+        """
+        entry = self.index[i]
+        start = int(entry["offset"]) + RECORD_HEADER.size
+        payload = self.__map[start:start + int(entry["size"])]
+        dac = int(entry["dac_value"])
+        return RecordedCapture(
+            decode_payload(payload, self.words, int(entry["encoding"])),
+            int(entry["seq"]), float(entry["timestamp"]),
+            None if dac == NO_DAC else dac, self.layout)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.capture(k) for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("capture %d out of range" % (i))
+        return self.capture(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.capture(i)
+
+    def range_between(self, start=None, stop=None):
+        """ Indices of the captures with ``start <= timestamp < stop``,
+        assuming timestamps increase through the recording.
+
+        :rtype: range
+        """
+        times = self.timestamps
+        first = 0 if start is None else int(np.searchsorted(times, start))
+        last = len(self) if stop is None else \
+            int(np.searchsorted(times, stop))
+        return range(first, last)
+
+    def between(self, start=None, stop=None):
+        """ Iterate over the captures with ``start <= timestamp < stop``. """
+        for i in self.range_between(start, stop):
+            yield self.capture(i)
+
+    def find_seq(self, seq):
+        """ Index of the capture with sequence number ``seq``.
+
+        :raises KeyError: if it is not in the recording.
+        """
+        hits = np.flatnonzero(self.index["seq"] == seq)
+        if not len(hits):
+            raise KeyError(seq)
+        return int(hits[0])
+
+    def samples(self, i, name, start=0, stop=None):
+        """ Get samples ``start:stop`` of one channel of capture ``i``.
+        Compressed captures only decompress the chunks in the range.
+
+        :rtype: numpy.ndarray
+        """
+        entry = self.index[i]
+        row = self.layout.index(name)
+        if int(entry["encoding"]) != ENC_COMPRESSED:
+            return self.capture(i).data[row, start:stop]
+        offset = int(entry["offset"]) + RECORD_HEADER.size
+        payload = self.__map[offset:offset + int(entry["size"])]
+        return compression.decode_range(payload, row, start, stop)
+
+    def stack(self, name, indices=None):
+        """ Copy one channel of several captures into a (len(indices), N)
+        array, e.g. for a heat map. All captures if ``indices`` is None. """
+        indices = range(len(self)) if indices is None else indices
+        row = self.layout.index(name)
+        out = np.empty((len(indices), self.words), decode.SAMPLE_DTYPE)
+        for k, i in enumerate(indices):
+            out[k] = self.capture(i).data[row]
+        return out
+
+    def close(self):
+        """ Drop the memory map. Captures taken from it must not be used
+        afterwards. """
+        self.__map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def import_csv(csv_file, filename, words=CAPTURE_WORDS,
+               encoding=ENC_RAW, codec=None):
+    """ Convert a "Channel A,Channel B" CSV recording as written by the old
+    create_csv.py into a binary recording. A trailing partial capture is
+    dropped. See convert.py for the other legacy formats.
+
+    :returns: number of captures written.
+    :rtype: int
+    """
+    import convert
+    return convert.convert_file(csv_file, filename, convert.FORMAT_AB, words,
+                                encoding, codec)[0]
+
+
+def archive(source, filename, codec=None,
+            chunk_samples=compression.CHUNK_SAMPLES):
+    """ Copy a recording into a compressed one, keeping the capture
+    metadata.
+
+    :returns: ``(captures, source bytes, archive bytes)``
+    """
+    rec = Recording(source)
+    with RecordingWriter(filename, rec.words, rec.layout, ENC_COMPRESSED,
+                         codec=codec, chunk_samples=chunk_samples) as out:
+        words = np.empty((rec.words, 2), decode.SAMPLE_DTYPE)
+        for capture in rec:
+            # back to the interleaved BRAM layout the writer expects
+            words[:] = capture.data.T
+            out.write(words, capture.seq, capture.timestamp,
+                      capture.dac_value)
+    rec.close()
+    return len(rec), os.path.getsize(source), os.path.getsize(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture recordings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("import", help="convert a Channel A/B CSV recording")
+    p.add_argument("csv")
+    p.add_argument("output")
+    p.add_argument("--words", type=int, default=CAPTURE_WORDS)
+    p.add_argument("--planar", action="store_true",
+                   help="store de-interleaved channel planes")
+    p.add_argument("--compress", action="store_true",
+                   help="store compressed channel planes")
+    p.add_argument("--codec", help="zlib, lz4 or zstd")
+    p = sub.add_parser("compress", help="compress a recording")
+    p.add_argument("recording")
+    p.add_argument("output")
+    p.add_argument("--codec", help="zlib, lz4 or zstd")
+    p.add_argument("--chunk", type=int, default=compression.CHUNK_SAMPLES,
+                   help="samples per compressed chunk")
+    p = sub.add_parser("info", help="list the captures of a recording")
+    p.add_argument("recording")
+    args = parser.parse_args()
+
+    codec = None
+    if getattr(args, "codec", None):
+        codec = compression.codec_id(args.codec)
+    if args.command == "import":
+        encoding = ENC_COMPRESSED if args.compress else \
+            ENC_PLANAR if args.planar else ENC_RAW
+        count = import_csv(args.csv, args.output, args.words, encoding,
+                           codec)
+        print("%s: %d captures" % (args.output, count))
+    elif args.command == "compress":
+        count, before, after = archive(args.recording, args.output, codec,
+                                       args.chunk)
+        print("%s: %d captures, %d -> %d bytes (%.1fx)" %
+              (args.output, count, before, after, before / after))
+    elif args.command == "info":
+        rec = Recording(args.recording)
+        print("%s: %d captures of %d words, channels %s/%s" %
+              (args.recording, len(rec), rec.words, rec.layout.low,
+               rec.layout.high))
+        for entry in rec.index:
+            print("%8d  %.6f  dac %d" % (entry["seq"], entry["timestamp"],
+                                         entry["dac_value"]))
+
+
+if __name__ == "__main__":
+    main()
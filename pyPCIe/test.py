@@ -1,12 +1,15 @@
-file_path = '/sys/bus/pci/devices/0000:01:00.0/config'
+from pypcie import Device
+
+pciid = '0000:01:00.0'
 
 try:
-    file = open(file_path, 'r')  # 'r' for reading, 'w' for writing, 'a' for appending
-    # Perform operations on the file (e.g., read or write)
-    file_content = file.read()
-    print(file_content)
-except FileNotFoundError:
-    print(f"Error: File not found at {file_path}")
-finally:
-    if 'file' in locals():
-        file.close()
\ No newline at end of file
+    d = Device.get(pciid)
+    config = d.config
+    print(f"Vendor: {config.read16(0x00):04x}  Device: {config.read16(0x02):04x}")
+    print(f"COMMAND: 0x{config.command:04x}  STATUS: 0x{config.status:04x}")
+    for cap_id, offset in config.capabilities():
+        print(f"Capability 0x{cap_id:02x} at 0x{offset:02x}")
+    for cap_id, version, offset in config.extended_capabilities():
+        print(f"Extended capability 0x{cap_id:04x} v{version} at 0x{offset:03x}")
+except ValueError as e:
+    print(f"Error: {e}")
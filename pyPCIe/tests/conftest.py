@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the application modules live next to this directory, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fpga_sim  # noqa: E402
+
+
+@pytest.fixture
+def model():
+    """ Simulated FPGA with synthetic spectra in the low half-words. """
+    with fpga_sim.FpgaModel(fpga_sim.synthetic_captures(count=4)) as m:
+        yield m
+
+
+@pytest.fixture
+def peaks_model():
+    """ Simulated FPGA laid out for the peak detector. """
+    with fpga_sim.FpgaModel(fpga_sim.synthetic_captures(
+            count=4, signal_high=True)) as m:
+        yield m
+
+
+@pytest.fixture
+def blank_model():
+    """ Simulated FPGA returning all-zero captures, without any peaks. """
+    with fpga_sim.FpgaModel([np.zeros(fpga_sim.BRAM_WORDS,
+                                      np.uint32)]) as m:
+        yield m
+
+
+def bram(model):
+    """ Copy of the words currently in the simulated sample BRAM. """
+    return model.samples.ndarray().copy()
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import bram
+from acquisition import AcquisitionEngine
+
+
+def test_acquire(model):
+    engine = AcquisitionEngine(model.control, model.samples, dac_value=0x14)
+    capture = engine.acquire()
+    np.testing.assert_array_equal(capture.words, bram(model))
+    assert capture.seq == 0
+    assert capture.dac_value == 0x14
+    assert model.dac_value == 0x14
+    assert engine.acquire(dac_value=0x20).seq == 1
+    assert model.dac_value == 0x20
+    assert model.triggers == 2
+
+
+def test_pipeline(model):
+    engine = AcquisitionEngine(model.control, model.samples, buffers=3)
+    engine.start()
+    try:
+        seqs = []
+        for _ in range(5):
+            capture = engine.next_capture(timeout=5.0)
+            assert capture is not None
+            seqs.append(capture.seq)
+            engine.release(capture)
+    finally:
+        engine.stop(timeout=5.0)
+    assert seqs == sorted(seqs)
+    assert engine.stats.summary()["delivered"] == 5
+
+
+def test_device_error_is_raised(model):
+    def dac_value():
+        raise RuntimeError("no DAC value")
+
+    engine = AcquisitionEngine(model.control, model.samples,
+                               dac_value=dac_value)
+    engine.start()
+    with pytest.raises(RuntimeError, match="no DAC value"):
+        engine.next_capture(timeout=5.0)
+    engine.stop(timeout=5.0)
+    assert not engine.running
+    assert engine.stats.failed == 1
+
+
+def test_handler_and_drops(model):
+    engine = AcquisitionEngine(model.control, model.samples, buffers=2)
+    seqs = []
+    done = threading.Event()
+
+    def handler(capture):
+        seqs.append(capture.seq)
+        if len(seqs) == 3:
+            done.set()
+        # a slow consumer, the device thread recycles old captures
+        time.sleep(0.01)
+
+    engine.start(handler)
+    try:
+        assert done.wait(5.0)
+    finally:
+        engine.stop(timeout=5.0)
+    summary = engine.stats.summary()
+    assert seqs == sorted(seqs)
+    assert summary["dropped"] > 0
+    assert summary["captured"] >= summary["delivered"] + summary["dropped"]
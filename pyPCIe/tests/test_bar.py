@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from pypcie import Device
+from pypcie.sim import FakeDevice
+
+
+@pytest.fixture
+def bar():
+    fake = FakeDevice(bars={0: 4096})
+    try:
+        yield Device(fake.pciid, sysfs_root=fake.root).bar[0]
+    finally:
+        fake.remove()
+
+
+@pytest.fixture
+def words(bar):
+    words = np.arange(256, dtype=np.uint32) * 0x01010101
+    bar.ndarray(0, len(words))[:] = words
+    return words
+
+
+def test_read_block(bar, words):
+    assert list(bar.read_block(0x10, 8)) == list(words[4:12])
+    with pytest.raises(ValueError):
+        bar.read_block(bar.size - 4, 2)
+    with pytest.raises(ValueError):
+        bar.read_block(0x2, 1)
+
+
+def test_readinto(bar, words):
+    buf = bytearray(64)
+    assert bar.readinto(buf, 0x100) == 64
+    assert bytes(buf) == words[64:80].tobytes()
+    with pytest.raises(ValueError):
+        bar.readinto(bytearray(6))
+
+
+def test_view_is_zero_copy(bar):
+    view = bar.view(0x20, 2)
+    assert len(view) == 8
+    bar.write(0x20, 0xdeadbeef)
+    assert bytes(view[:4]) == (0xdeadbeef).to_bytes(4, "little")
+    view[4:8] = (0x12345678).to_bytes(4, "little")
+    assert bar.read(0x24) == 0x12345678
+    with pytest.raises(ValueError):
+        bar.view(bar.size - 4, 2)
+
+
+def test_ndarray_is_zero_copy(bar):
+    window = bar.ndarray(0x40, 4)
+    window[1] = 0xcafe
+    assert bar.read(0x44) == 0xcafe
+    bar.write(0x48, 7)
+    assert window[2] == 7
+
+
+@pytest.mark.parametrize("width,value", [
+    (1, 0xa5), (2, 0xbeef), (4, 0xdeadbeef), (8, 0x0123456789abcdef)])
+def test_width_round_trip(bar, width, value):
+    write = getattr(bar, "write%d" % (8 * width))
+    read = getattr(bar, "read%d" % (8 * width))
+    write(0x40, value)
+    assert read(0x40) == value
+    # little endian in the BAR, neighbours untouched
+    assert bar.ndarray(0x40, width, width=1).tobytes() == \
+        value.to_bytes(width, "little")
+    assert bar.read8(0x40 + width) == 0
+
+
+def test_unaligned_access(bar):
+    with pytest.raises(ValueError):
+        bar.write32(0x42, 1)
+    with pytest.raises(ValueError):
+        bar.read64(0x44)
+    with pytest.raises(ValueError):
+        bar.readinto(bytearray(8), 0x4, width=8)
+
+
+@pytest.mark.parametrize("width", [1, 2, 4, 8])
+def test_block_reads_by_width(bar, words, width):
+    expect = words.view("<u%d" % (width))
+    assert list(bar.read_block(0, len(expect), width)) == list(expect)
+    buf = np.empty(len(expect), expect.dtype)
+    assert bar.readinto(buf, 0, width) == buf.nbytes
+    np.testing.assert_array_equal(buf, expect)
+    np.testing.assert_array_equal(bar.ndarray(0, len(expect), width), expect)
@@ -0,0 +1,84 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from acquisition import Capture
+from capture_ring import CaptureRing, RingOverrun
+
+WORDS = 64
+
+
+def raw_capture(k):
+    words = np.arange(WORDS, dtype=np.uint32) + (k << 16) + k
+    return words.tobytes()
+
+
+@pytest.fixture
+def ring():
+    with CaptureRing.create(slots=4, words=WORDS) as ring:
+        yield ring
+
+
+def test_write_and_read(ring):
+    capture = Capture(WORDS)
+    capture.raw[:] = raw_capture(1)
+    capture.timestamp = 12.5
+    capture.dac_value = 0x14
+    assert ring.write(capture) == 0
+    assert ring.write(raw_capture(2), timestamp=13.0) == 1
+    channels, timestamp, dac_value = ring.read(0)
+    np.testing.assert_array_equal(channels[0], np.arange(WORDS) + 1)
+    np.testing.assert_array_equal(channels[1], np.ones(WORDS))
+    assert (timestamp, dac_value) == (12.5, 0x14)
+    # no DAC value stays unknown, DAC 0 stays 0
+    assert ring.read(1)[1:] == (13.0, None)
+    ring.write(raw_capture(3), dac_value=0)
+    assert ring.read(2)[2] == 0
+    with pytest.raises(ValueError):
+        ring.read(3)
+
+
+def test_overrun(ring):
+    for k in range(6):
+        ring.write(raw_capture(k))
+    with pytest.raises(RingOverrun):
+        ring.read(1)
+    channels, _, _ = ring.read(5)
+    assert channels[0][0] == 5
+
+
+def test_reader_skips_ahead(ring):
+    reader = ring.reader(start=0)
+    for k in range(7):
+        ring.write(raw_capture(k))
+    seqs = []
+    while True:
+        item = reader.next(timeout=0.0)
+        if item is None:
+            break
+        seqs.append(item[0])
+    # the oldest slot is the next one the writer overwrites, skipped too
+    assert seqs == [4, 5, 6]
+    assert reader.dropped == 4
+
+
+def _read_remote(name, seq, queue):
+    ring = CaptureRing.attach(name)
+    try:
+        channels, _, dac_value = ring.read(seq)
+        queue.put((channels[0].tolist(), dac_value))
+    finally:
+        ring.close()
+
+
+def test_attach_from_another_process(ring):
+    ring.write(raw_capture(9), dac_value=0x64)
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_read_remote, args=(ring.name, 0, queue))
+    proc.start()
+    low, dac_value = queue.get(timeout=30)
+    proc.join(30)
+    assert low == (np.arange(WORDS) + 9).tolist()
+    assert dac_value == 0x64
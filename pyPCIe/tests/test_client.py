@@ -0,0 +1,119 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from conftest import bram
+import wire
+from acq_client import (AcquisitionClient, AsyncAcquisitionClient,
+                        ClientStats, Frame, ServerError)
+from test_server import planes, serve
+
+
+def serve_sync(model, client, **kwargs):
+    """ Run the blocking function ``client(port)`` in a thread against a
+    server on the simulated FPGA. """
+    async def main(port):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, client, port)
+    return serve(model, main, **kwargs)
+
+
+def test_capture(model):
+    def client(port):
+        with AcquisitionClient(port=port, timeout=10.0) as c:
+            frame = c.capture(16, 32, dac_value=40000)
+            return frame.copy(), frame.channels()["A"].copy(), \
+                bram(model), c.stats
+
+    frame, a, words, stats = serve_sync(model, client)
+    assert isinstance(frame, Frame) and frame.dac_value == 40000
+    np.testing.assert_array_equal(frame.planes(), planes(words[16:48]))
+    np.testing.assert_array_equal(a, words[16:48] & 0xFFFF)
+    assert (stats.captures, stats.latency.count) == (1, 1)
+    with pytest.raises(ValueError):
+        frame.peaks()
+
+
+def test_captures_pipelined(model):
+    def client(port):
+        with AcquisitionClient(port=port, timeout=10.0,
+                               keep_latencies=4) as c:
+            seqs = [f.seq for f in c.captures(6, depth=3, count=8)]
+            return seqs, c.stats
+
+    seqs, stats = serve_sync(model, client, ttl=0)
+    assert seqs == sorted(seqs) and len(seqs) == 6
+    assert stats.captures == 6 and len(stats.kept()) == 4
+
+
+def test_server_error(model):
+    def client(port):
+        with AcquisitionClient(port=port, timeout=10.0) as c:
+            with pytest.raises(ServerError, match="out of range") as e:
+                c.capture(dac_value=0x10000)
+            # the connection survives the bad request
+            return e.value.request_id, c.capture(count=4).request_id, \
+                c.stats.errors
+
+    assert serve_sync(model, client) == (1, 2, 1)
+
+
+@pytest.mark.parametrize("encoding", [wire.ENC_PACK12, wire.ENC_DELTA])
+def test_negotiate(model, encoding):
+    def client(port):
+        with AcquisitionClient(port=port, encoding=encoding,
+                               timeout=10.0) as c:
+            frame = c.capture()
+            out = np.empty((2, frame.header.count), np.uint16)
+            return c.encoding, frame.header.encoding, frame.planes(out), \
+                bram(model)
+
+    agreed, used, received, words = serve_sync(model, client)
+    assert agreed == used == encoding
+    np.testing.assert_array_equal(received, planes(words))
+
+
+def test_stream(model):
+    def client(port):
+        with AcquisitionClient(port=port, timeout=10.0) as c:
+            frames = [(f.seq, f.request_id) for f in c.stream(n=3, count=4)]
+            # requests are served again after the stream ended
+            return frames, c.capture(count=4).seq
+
+    frames, seq = serve_sync(model, client)
+    assert len({rid for _, rid in frames}) == 1
+    assert [s for s, _ in frames] == sorted(s for s, _ in frames)
+    assert seq > frames[-1][0]
+
+
+def test_async_client(model):
+    async def client(port):
+        async with await AsyncAcquisitionClient.connect(
+                port=port, encoding=wire.ENC_DELTA) as c:
+            frame = (await c.capture(dac_value=0x14)).copy()
+            words = bram(model)
+            seqs = [f.seq async for f in c.captures(4, depth=2, count=4)]
+            stream = [f.request_id async for f in c.stream(n=2, count=4)]
+            with pytest.raises(ServerError):
+                await c.capture(dac_value=-2)
+            return frame, words, seqs, stream, c.stats
+
+    frame, words, seqs, stream, stats = serve(model, client, ttl=0)
+    assert frame.header.encoding == wire.ENC_DELTA
+    assert frame.dac_value == 0x14
+    np.testing.assert_array_equal(frame.planes(), planes(words))
+    assert seqs == sorted(seqs) and seqs[0] > frame.seq
+    assert len(set(stream)) == 1
+    # the stream may push more captures before its end marker arrives
+    assert stats.captures >= 7 and stats.errors == 1
+
+
+def test_client_stats():
+    stats = ClientStats(keep=2)
+    for seq, latency in [(0, 1.0), (1, 2.0), (3, 3.0), (2, None)]:
+        stats.record(wire.Header(wire.MSG_CAPTURE, 8, seq=seq), latency)
+    stats.record(wire.Header(wire.MSG_ERROR, 4))
+    assert (stats.frames, stats.captures, stats.gaps) == (5, 4, 1)
+    assert stats.kept().tolist() == [2.0, 3.0]
+    assert stats.bytes == 5 * wire.HEADER.size + 4 * 8 + 4
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import compression
+
+
+def spectrum(samples=10000, seed=5):
+    """ Slowly varying 12-bit samples with noise, like the ADC output. """
+    rng = np.random.default_rng(seed)
+    x = 2048 + 1500 * np.sin(np.linspace(0, 20, samples)) + \
+        rng.normal(0, 3, samples)
+    return np.clip(x, 0, 4095).astype(np.uint16)
+
+
+@pytest.mark.parametrize("count", [0, 1, 7, 8])
+def test_pack12(count):
+    values = np.arange(count, dtype=np.uint16) * 577 % 4096
+    data = compression.pack12(values)
+    assert len(data) == 3 * ((count + 1) // 2)
+    np.testing.assert_array_equal(compression.unpack12(data, count), values)
+
+
+@pytest.mark.parametrize("codec", compression.available_codecs())
+def test_planes_round_trip(codec):
+    planes = np.stack((spectrum(), spectrum(seed=6)))
+    # first and last samples of the range and a wrap-around step
+    planes[0, :3] = (0, 4095, 0)
+    blob = compression.encode_planes(planes, codec, chunk_samples=4096)
+    np.testing.assert_array_equal(compression.decode_planes(blob), planes)
+    if codec != compression.CODEC_NONE:
+        assert len(blob) < planes.nbytes / 2
+
+
+def test_wide_samples_fall_back_to_delta16():
+    planes = np.stack((spectrum(1000), spectrum(1000)))
+    planes[1, 500] = 0xFFFF
+    blob = compression.encode_planes(planes, compression.CODEC_ZLIB, 256)
+    info = compression.PlanesInfo(blob)
+    assert info.per_row == 4
+    assert list(info.modes) == [compression.MODE_PACK12] * 5 + \
+        [compression.MODE_DELTA16] + [compression.MODE_PACK12] * 2
+    np.testing.assert_array_equal(compression.decode_planes(blob), planes)
+
+
+def test_decode_range():
+    planes = np.stack((spectrum(1000), spectrum(1000, seed=7)))
+    blob = compression.encode_planes(planes, compression.CODEC_ZLIB, 128)
+    for start, stop in [(0, None), (100, 300), (127, 129), (990, 2000),
+                        (5, 5)]:
+        np.testing.assert_array_equal(
+            compression.decode_range(blob, 1, start, stop),
+            planes[1, start:stop])
+
+
+def test_codecs():
+    assert compression.codec_id("zlib") == compression.CODEC_ZLIB
+    assert compression.default_codec() in compression.available_codecs()
+    with pytest.raises(ValueError):
+        compression.codec_id("brotli")
+    unavailable = set(compression.CODEC_NAMES) - \
+        set(compression.available_codecs())
+    for codec in unavailable:
+        with pytest.raises(ValueError):
+            compression.compress(b"data", codec)
@@ -0,0 +1,24 @@
+from pypcie import Device
+from pypcie.config import (PCI_COMMAND_INTX_DISABLE, PCI_COMMAND_MASTER,
+                           PCI_COMMAND_MEMORY)
+from pypcie.sim import FakeDevice
+
+
+def test_set_command_bits_keeps_other_bits():
+    fake = FakeDevice()
+    try:
+        config = Device(fake.pciid, sysfs_root=fake.root).config
+        config.command = PCI_COMMAND_MASTER | PCI_COMMAND_INTX_DISABLE
+        writes = []
+        write16 = config.write16
+        config.write16 = lambda *args: (writes.append(args), write16(*args))
+        assert config.set_command_bits(PCI_COMMAND_MEMORY) == \
+            PCI_COMMAND_MASTER | PCI_COMMAND_INTX_DISABLE | PCI_COMMAND_MEMORY
+        # already set, no second write
+        config.set_command_bits(PCI_COMMAND_MEMORY)
+        assert len(writes) == 1
+        assert config.clear_command_bits(PCI_COMMAND_MEMORY) == \
+            PCI_COMMAND_MASTER | PCI_COMMAND_INTX_DISABLE
+        assert config.command == PCI_COMMAND_MASTER | PCI_COMMAND_INTX_DISABLE
+    finally:
+        fake.remove()
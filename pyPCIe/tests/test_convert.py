@@ -0,0 +1,53 @@
+import pytest
+
+import convert
+import recording
+
+
+def test_parse_dump_line_endings():
+    block = (b"Word at Offset:  0000   082a_0829\n"
+             b"Word at Offset:  0004   0827_0828  \r\n"
+             b"\n"
+             b"Word at Offset:  0008   0829_082A\t\n")
+    assert list(convert.parse_dump(block)) == \
+        [0x082a0829, 0x08270828, 0x0829082a]
+
+
+@pytest.mark.parametrize("line", [b"Word at Offset:  0000   082a 0829\n",
+                                  b"0829\n"])
+def test_parse_dump_malformed(line):
+    with pytest.raises(ValueError):
+        convert.parse_dump(line)
+
+
+def test_parse_decimal():
+    assert convert.parse_decimal(b"1,2\r\n30,4\n", 2).tolist() == \
+        [[1, 2], [30, 4]]
+    with pytest.raises(ValueError):
+        convert.parse_decimal(b"1,-3\n", 2)
+
+
+def test_parse_decimal_blank_rows():
+    assert convert.parse_decimal(b"\n 5 ,\t6 \r\n\r\n7,8", 2).tolist() == \
+        [[5, 6], [7, 8]]
+    assert convert.parse_decimal(b"\n\n", 2).shape == (0, 2)
+
+
+@pytest.mark.parametrize("block", [b"2053.5,2\n", b"1,2e3\n", b"1;2\n",
+                                   b"1,2,3\n", b"1\n2,3\n", b"1 2,3\n",
+                                   b"1,,2\n", b",\n"])
+def test_parse_decimal_malformed(block):
+    with pytest.raises(ValueError):
+        convert.parse_decimal(block, 2)
+
+
+def test_convert_file(tmp_path):
+    name = str(tmp_path / "run.cap")
+    with open(tmp_path / "run.csv", "w") as f:
+        f.write("Channel A,Channel B\n")
+        f.writelines("%d,%d\n" % (i, 4095 - i) for i in range(10))
+    assert convert.convert_file(str(tmp_path / "run.csv"), name,
+                                convert.FORMAT_AB, words=4)[0] == 2
+    rec = recording.Recording(name)
+    assert rec[1].channels()["A"].tolist() == [4, 5, 6, 7]
+    assert rec[1].channels()["B"].tolist() == [4091, 4090, 4089, 4088]
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+import fpga_regs
+import fpga_sim
+from pypcie import Device
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_trigger_loads_next_capture():
+    captures = fpga_sim.synthetic_captures(count=2, words=64)
+    with fpga_sim.FpgaModel(captures) as model:
+        regs = fpga_regs.control_regs(model.control)
+        # the first capture is loaded before any trigger
+        np.testing.assert_array_equal(model.samples.ndarray(), captures[0])
+        for expect in captures[1:] + captures:
+            fpga_regs.trigger(regs, 0x14)
+            assert not fpga_regs.busy(regs)
+            np.testing.assert_array_equal(model.samples.ndarray(), expect)
+        assert model.triggers == 3
+        assert model.dac_value == 0x14
+
+
+def test_busy_while_capturing():
+    with fpga_sim.FpgaModel(fpga_sim.synthetic_captures(count=1, words=64),
+                            capture_time=0.05) as model:
+        regs = fpga_regs.control_regs(model.control)
+        fpga_regs.trigger(regs)
+        assert fpga_regs.busy(regs)
+        # a trigger while busy is not a new capture
+        fpga_regs.trigger(regs)
+        assert model.missed_triggers == 1
+        fpga_regs.wait_idle(regs, timeout=5.0)
+        assert model.triggers == 1
+
+
+def test_device_lookup():
+    with fpga_sim.FpgaModel(fpga_sim.synthetic_captures(count=1)) as model:
+        d = Device(fpga_sim.PCI_ID, sysfs_root=model.root)
+        assert d.bar[fpga_sim.SAMPLE_BAR].size == 4 * fpga_sim.BRAM_WORDS
+        assert d.bar[fpga_sim.CONTROL_BAR].size == fpga_sim.CONTROL_BAR_SIZE
+    assert not os.path.exists(model.root)
+
+
+def test_csv_captures():
+    captures = fpga_sim.csv_captures(os.path.join(HERE, "pcie_samples1.csv"))
+    assert len(captures) == 4
+    assert captures[0].dtype == np.uint32
+    assert captures[0][0] == 2197 | 2208 << 16
+
+
+def test_empty_model():
+    with pytest.raises(ValueError):
+        fpga_sim.FpgaModel([])
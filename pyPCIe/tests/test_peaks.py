@@ -0,0 +1,42 @@
+import numpy as np
+
+import fpga_sim
+import peaks
+
+
+def test_find_peaks():
+    x = np.array([0, 5, 0, 3, 7, 7, 7, 2, 9, 9, 1, 4])
+    assert peaks.find_peaks(x, 0).tolist() == [1, 5, 8]
+    # the threshold and the ends of the signal
+    assert peaks.find_peaks(x, 6).tolist() == [5, 8]
+    assert peaks.find_peaks(np.array([9, 1, 9]), 0).tolist() == []
+    assert peaks.find_peaks(np.array([1, 9]), 0).tolist() == []
+
+
+def test_detect():
+    lut = np.arange(2000) * 0.5
+    detector = peaks.PeakDetector(lut, height=100, window=(10, 40))
+    trigger = np.zeros(100, np.int16)
+    trigger[20:] = 1000
+    signal = np.zeros(100, np.int16)
+    # outside, on and inside the window bounds
+    signal[[25, 29, 35, 59, 70]] = 500
+    signal[45] = 50
+    found = detector.detect(signal, trigger)
+    assert detector.edge(trigger) == 19
+    assert found["index"].tolist() == [35]
+    assert found["height"].tolist() == [500]
+    assert found["wavelength"].tolist() == [lut[35 - 19 + 1]]
+    assert not len(detector.detect(signal, np.zeros(100, np.int16)))
+
+
+def test_detect_capture():
+    raw = fpga_sim.synthetic_captures(count=1, signal_high=True)[0]
+    found = peaks.PeakDetector().detect_capture(raw.tobytes())
+    edge = peaks.PeakDetector().edge(
+        (raw & 0xFFFF).astype(np.uint16).view(np.int16))
+    assert found.dtype == peaks.PEAK_DTYPE
+    # the synthetic peaks sit about 800 and 1000 samples behind the edge
+    assert np.abs(found["index"] - edge - [800, 1000]).max() < 20
+    assert (found["height"] >= peaks.MIN_HEIGHT).all()
+    assert (found["wavelength"] > 0).all()
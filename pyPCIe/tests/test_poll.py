@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from pypcie.poll import Backoff, WaitStats, WaitTimeout, poll_until
+
+
+def test_backoff_stages():
+    backoff = Backoff(spins=2, yields=1, min_sleep=1e-4, max_sleep=4e-4)
+    assert [backoff.delay(k) for k in range(7)] == \
+        [0.0, 0.0, -1.0, 1e-4, 2e-4, 4e-4, 4e-4]
+    with pytest.raises(ValueError):
+        Backoff(min_sleep=1e-3, max_sleep=1e-4)
+
+
+def test_poll_until_counts_polls():
+    results = iter([False, False, True])
+    stats = WaitStats()
+    assert poll_until(lambda: next(results), stats=stats) == 3
+    summary = stats.summary()
+    assert summary["waits"] == 1
+    assert summary["mean_polls"] == 3
+    assert summary["poll_hist"] == {4: 1}
+
+
+def test_poll_until_timeout():
+    stats = WaitStats()
+    t0 = time.perf_counter()
+    with pytest.raises(WaitTimeout) as info:
+        poll_until(lambda: False, timeout=0.02, stats=stats, what="nothing")
+    # sleeps are clipped to the deadline
+    assert time.perf_counter() - t0 < 0.5
+    assert "nothing" in str(info.value)
+    assert info.value.polls > 1
+    assert info.value.elapsed >= 0.02
+    assert isinstance(info.value, TimeoutError)
+    assert stats.timeouts == 1
+
+
+def test_wait_stats_percentile():
+    stats = WaitStats()
+    for _ in range(99):
+        stats.record(1, 3e-6)
+    stats.record(1, 900e-6)
+    assert stats.percentile(50) == 4e-6
+    assert stats.percentile(100) == 900e-6
+    assert stats.summary()["time_hist_us"] == {4: 99, 1024: 1}
+    stats.reset()
+    assert stats.percentile(99) == 0.0
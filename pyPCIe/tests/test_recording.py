@@ -0,0 +1,289 @@
+import threading
+
+import numpy as np
+import pytest
+
+import decode
+import recording
+from acquisition import Capture
+
+
+WORDS = 256
+
+
+def captures(count, words=WORDS):
+    rng = np.random.default_rng(3)
+    return [rng.integers(0, 1 << 32, words, dtype=np.uint32)
+            for _ in range(count)]
+
+
+def records(filename):
+    """ Index entries and decoded payloads, found by walking the file. """
+    with open(filename, "rb") as f:
+        data = f.read()
+    header = recording.RecordingHeader.unpack(data)
+    entries = recording.scan_records(data)
+    payloads = []
+    for entry in entries:
+        start = int(entry["offset"]) + recording.RECORD_HEADER.size
+        payloads.append(recording.decode_payload(
+            data[start:start + int(entry["size"])], header.words,
+            int(entry["encoding"])))
+    return header, entries, payloads
+
+
+@pytest.mark.parametrize("encoding", [recording.ENC_RAW,
+                                      recording.ENC_PLANAR])
+def test_round_trip(tmp_path, encoding):
+    name = str(tmp_path / "run.cap")
+    raws = captures(3)
+    with recording.RecordingWriter(name, WORDS, decode.LAYOUT_SIGNAL_TRIGGER,
+                                   encoding) as rec:
+        rec.write(raws[0], seq=10, timestamp=1.5, dac_value=0x1234)
+        rec.write(raws[1], timestamp=2.5)
+        rec.write(raws[2], timestamp=3.5, dac_value=0)
+    header, entries, payloads = records(name)
+    assert header.words == WORDS
+    assert header.layout.low == "trigger" and header.layout.high == "signal"
+    assert list(entries["seq"]) == [10, 11, 12]
+    assert list(entries["timestamp"]) == [1.5, 2.5, 3.5]
+    assert list(entries["dac_value"]) == [0x1234, recording.NO_DAC, 0]
+    assert set(entries["encoding"]) == {encoding}
+    for raw, data in zip(raws, payloads):
+        np.testing.assert_array_equal(data, decode.as_samples(raw).T)
+
+
+def test_write_capture_metadata(tmp_path):
+    name = str(tmp_path / "run.cap")
+    capture = Capture(WORDS)
+    capture.words[:] = captures(1)[0]
+    capture.seq, capture.timestamp, capture.dac_value = 7, 42.0, 99
+    with recording.RecordingWriter(name, WORDS) as rec:
+        assert rec.write(capture) == recording.FILE_HEADER_SIZE
+    header, entries, payloads = records(name)
+    assert (int(entries["seq"][0]), float(entries["timestamp"][0]),
+            int(entries["dac_value"][0])) == (7, 42.0, 99)
+    np.testing.assert_array_equal(payloads[0], capture.samples.T)
+
+
+def test_append(tmp_path):
+    name = str(tmp_path / "run.cap")
+    raws = captures(3)
+    with recording.RecordingWriter(name, WORDS) as rec:
+        rec.write(raws[0])
+        rec.write(raws[1])
+    # a record cut short by a crash is dropped before appending
+    with open(name, "ab") as f:
+        f.write(recording.RECORD_HEADER.pack(
+            recording.RECORD_MAGIC, 4 * WORDS, 2, 0.0, 0, 0, 0) + b"\0" * 8)
+    with recording.RecordingWriter(name, WORDS, append=True) as rec:
+        rec.write(raws[2])
+    header, entries, payloads = records(name)
+    assert list(entries["seq"]) == [0, 1, 2]
+    np.testing.assert_array_equal(payloads[2], decode.as_samples(raws[2]).T)
+    with pytest.raises(recording.RecordingError):
+        recording.RecordingWriter(name, 2 * WORDS, append=True)
+
+
+def test_invalid_input(tmp_path):
+    name = str(tmp_path / "run.cap")
+    with pytest.raises(ValueError):
+        recording.RecordingWriter(name, WORDS, encoding=7)
+    with recording.RecordingWriter(name, WORDS) as rec:
+        with pytest.raises(ValueError):
+            rec.write(captures(1, WORDS - 1)[0])
+    with open(name, "r+b") as f:
+        f.write(b"NOTACAP!")
+    with pytest.raises(recording.RecordingError):
+        recording.Recording(name)
+
+
+def write_recording(name, raws, **kwargs):
+    with recording.RecordingWriter(name, WORDS, **kwargs) as rec:
+        for i, raw in enumerate(raws):
+            rec.write(raw, timestamp=10.0 + i, dac_value=i)
+
+
+def test_random_access(tmp_path):
+    name = str(tmp_path / "run.cap")
+    raws = captures(5)
+    write_recording(name, raws)
+    with recording.Recording(name) as rec:
+        assert len(rec) == 5
+        np.testing.assert_array_equal(rec[-1].data,
+                                      decode.as_samples(raws[4]).T)
+        assert [c.seq for c in rec[1:3]] == [1, 2]
+        assert rec[2].dac_value == 2
+        assert [c.seq for c in rec.between(11.0, 13.0)] == [1, 2]
+        assert rec.find_seq(3) == 3
+        np.testing.assert_array_equal(rec.samples(1, "B", 8, 16),
+                                      decode.as_samples(raws[1])[8:16, 1])
+        with pytest.raises(IndexError):
+            rec[5]
+        with pytest.raises(KeyError):
+            rec.find_seq(9)
+
+
+def test_scan_without_index(tmp_path):
+    name = str(tmp_path / "run.cap")
+    write_recording(name, captures(3), index=False)
+    idx = recording.index_filename(name)
+    rec = recording.Recording(name)
+    assert [c.seq for c in rec] == [0, 1, 2]
+    assert not (tmp_path / "run.cap.idx").exists()
+    assert rec.save_index()
+    assert not rec.save_index()
+    with open(idx, "rb") as f:
+        f.seek(recording.INDEX_HEADER.size)
+        np.testing.assert_array_equal(
+            np.fromfile(f, recording.INDEX_DTYPE), rec.index)
+
+
+def test_stale_index(tmp_path):
+    name = str(tmp_path / "run.cap")
+    raws = captures(4)
+    write_recording(name, raws[:2])
+    idx = recording.index_filename(name)
+    with open(idx, "rb") as f:
+        index = f.read()
+    write_recording(name, raws[2:], append=True)
+    with open(idx, "wb") as f:
+        f.write(index)
+    # records behind the indexed ones are found without touching the index
+    rec = recording.Recording(name)
+    assert [c.dac_value for c in rec] == [0, 1, 0, 1]
+    np.testing.assert_array_equal(rec[3].data, decode.as_samples(raws[3]).T)
+    with open(idx, "rb") as f:
+        assert f.read() == index
+    recording.Recording(name, update_index=True)
+    assert len(recording.Recording(name).index) == 4
+    with open(idx, "rb") as f:
+        assert len(f.read()) > len(index)
+
+
+def test_reader_during_write(tmp_path):
+    name = str(tmp_path / "run.cap")
+    idx = recording.index_filename(name)
+    raws = captures(3)
+    writer = recording.RecordingWriter(name, WORDS, preallocate=1 << 16)
+    writer.write(raws[0])
+    writer.write(raws[1])
+    writer.flush()
+    with open(idx, "rb") as f:
+        index = f.read()
+    rec = recording.Recording(name, update_index=True)
+    assert [c.seq for c in rec] == [0, 1]
+    assert not rec.save_index()
+    with open(idx, "rb") as f:
+        assert f.read() == index
+    writer.write(raws[2])
+    writer.close()
+    assert not (tmp_path / "run.cap.lock").exists()
+    rec = recording.Recording(name)
+    assert len(rec) == 3 and not rec.save_index()
+
+
+class GatedWriter(object):
+    """ RecordingWriter stand-in whose writes wait for ``gate``. """
+
+    words = WORDS
+
+    def __init__(self, fail=False):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.fail = fail
+        self.seqs = []
+        self.closed = False
+
+    def write(self, capture):
+        self.entered.set()
+        self.gate.wait(5)
+        if self.fail:
+            raise OSError("disk full")
+        self.seqs.append(capture.seq)
+
+    def flush(self, sync=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_async_recorder(tmp_path):
+    name = str(tmp_path / "run.cap")
+    raws = captures(6)
+    writer = recording.RecordingWriter(name, WORDS)
+    with recording.AsyncRecorder(writer, policy=recording.BLOCK) as rec:
+        for i, raw in enumerate(raws):
+            assert rec.submit(raw, seq=i, timestamp=float(i), dac_value=i)
+    assert rec.stats.written == 6 and not rec.stats.dropped
+    with recording.Recording(name) as rec:
+        assert [c.dac_value for c in rec] == list(range(6))
+        np.testing.assert_array_equal(rec[5].data,
+                                      decode.as_samples(raws[5]).T)
+
+
+@pytest.mark.parametrize("policy,written,accepted", [
+    (recording.DROP_NEWEST, [0, 1], [True, True, False]),
+    (recording.DROP_OLDEST, [0, 2], [True, True, True])])
+def test_async_recorder_drop(policy, written, accepted):
+    writer = GatedWriter()
+    rec = recording.AsyncRecorder(writer, buffers=2, policy=policy)
+    raw = captures(1)[0]
+    results = [rec.submit(raw, seq=0)]
+    # the writer thread holds capture 0, one buffer is left
+    assert writer.entered.wait(5)
+    results += [rec.submit(raw, seq=1), rec.submit(raw, seq=2)]
+    writer.gate.set()
+    rec.close()
+    assert results == accepted
+    assert writer.seqs == written and writer.closed
+    assert rec.stats.dropped == 1 and rec.stats.submitted == 3
+
+
+def test_async_recorder_errors():
+    writer = GatedWriter(fail=True)
+    writer.gate.set()
+    rec = recording.AsyncRecorder(writer)
+    rec.submit(captures(1)[0])
+    with pytest.raises(OSError):
+        rec.close()
+    assert rec.stats.failed == 1 and writer.closed
+    with pytest.raises(ValueError):
+        rec.submit(captures(1)[0])
+    with pytest.raises(ValueError):
+        recording.AsyncRecorder(writer, policy="fifo")
+
+
+def test_async_recorder_close_timeout():
+    writer = GatedWriter()
+    rec = recording.AsyncRecorder(writer)
+    rec.submit(captures(1)[0], seq=3)
+    assert writer.entered.wait(5)
+    with pytest.raises(TimeoutError):
+        rec.close(timeout=0.05)
+    assert not writer.closed
+    writer.gate.set()
+    rec.close()
+    assert writer.seqs == [3] and writer.closed
+
+
+def test_archive(tmp_path):
+    source = str(tmp_path / "run.cap")
+    name = str(tmp_path / "archive.cap")
+    # 12-bit samples in both half-words, as the ADC delivers them
+    raws = [(np.arange(WORDS, dtype=np.uint32) * (k + 1) % 4096) * 0x10001
+            for k in range(3)]
+    write_recording(source, raws)
+    count, before, after = recording.archive(source, name,
+                                             chunk_samples=64)
+    assert count == 3 and after < before
+    with recording.Recording(name) as rec:
+        assert set(rec.index["encoding"]) == {recording.ENC_COMPRESSED}
+        assert [(c.seq, c.timestamp, c.dac_value) for c in rec] == \
+            [(0, 10.0, 0), (1, 11.0, 1), (2, 12.0, 2)]
+        for raw, capture in zip(raws, rec):
+            np.testing.assert_array_equal(capture.data,
+                                          decode.as_samples(raw).T)
+        np.testing.assert_array_equal(rec.samples(2, "A", 60, 70),
+                                      decode.as_samples(raws[2])[60:70, 0])
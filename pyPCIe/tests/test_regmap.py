@@ -0,0 +1,101 @@
+import pytest
+
+from pypcie import Device
+from pypcie.regmap import (Field, Register, RegisterMap, RO, RW, WO, W1P)
+from pypcie.sim import FakeDevice
+
+REGISTERS = (
+    Register("CTRL", 0x0, RW, fields=[Field("MODE", 4, 3)]),
+    Register("STATUS", 0x4, RO),
+    Register("KICK", 0x8, W1P),
+    Register("CONFIG", 0xc, WO, fields=[Field("GAIN", 0, 8)]),
+)
+
+
+@pytest.fixture
+def bar():
+    fake = FakeDevice(bars={1: 4096})
+    try:
+        yield Device(fake.pciid, sysfs_root=fake.root).bar[1]
+    finally:
+        fake.remove()
+
+
+@pytest.fixture
+def writes(bar):
+    writes = []
+    bar.add_write_hook(lambda offset, data, width: writes.append(
+        (offset, data)))
+    return writes
+
+
+def test_shadow_skips_unchanged_writes(bar, writes):
+    regs = RegisterMap(bar, REGISTERS)
+    regs.write("CTRL", 0x14)
+    regs.write("CTRL", 0x14)
+    assert writes == [(0x0, 0x14)]
+    # served from the shadow, a device-side change is not seen
+    bar.write(0x0, 0x99)
+    assert regs.read("CTRL") == 0x14
+    assert regs.bus_reads == 0
+    regs.invalidate("CTRL")
+    assert regs.read("CTRL") == 0x99
+    assert regs.bus_reads == 1
+
+
+def test_cache_disabled(bar, writes):
+    regs = RegisterMap(bar, REGISTERS, cache=False)
+    regs.write("CTRL", 0x14)
+    regs.write("CTRL", 0x14)
+    assert len(writes) == 2
+
+
+def test_read_only_goes_to_the_bus(bar):
+    regs = RegisterMap(bar, REGISTERS)
+    bar.write(0x4, 1)
+    assert regs.read("STATUS") == 1
+    bar.write(0x4, 0)
+    assert regs.read("STATUS") == 0
+    with pytest.raises(ValueError):
+        regs.write("STATUS", 1)
+
+
+def test_w1p_pulses_every_write(bar, writes):
+    regs = RegisterMap(bar, REGISTERS)
+    regs.pulse("KICK")
+    regs.write("KICK", 1)
+    assert writes == [(0x8, 1), (0x8, 0)] * 2
+    assert regs.read("KICK") == 0
+    assert bar.read(0x8) == 0
+    with pytest.raises(ValueError):
+        regs.pulse("CTRL")
+
+
+def test_write_only_fields(bar, writes):
+    regs = RegisterMap(bar, REGISTERS)
+    with pytest.raises(ValueError):
+        regs.read("CONFIG")
+    regs.write_field("CONFIG", "GAIN", 0x7f)
+    assert regs.read_field("CONFIG", "GAIN") == 0x7f
+    assert writes == [(0xc, 0x7f)]
+    with pytest.raises(ValueError):
+        regs.write_field("CONFIG", "GAIN", 0x100)
+
+
+def test_field_read_modify_write(bar):
+    regs = RegisterMap(bar, REGISTERS)
+    regs.write("CTRL", 0x3)
+    regs.write_field("CTRL", "MODE", 5)
+    assert bar.read(0x0) == 0x53
+    assert regs.read_field("CTRL", "MODE") == 5
+
+
+def test_declaration_errors(bar):
+    with pytest.raises(ValueError):
+        Register("X", 0x2)
+    with pytest.raises(ValueError):
+        Field("X", 30, 4)
+    with pytest.raises(ValueError):
+        RegisterMap(bar, REGISTERS + (Register("CTRL", 0x10),))
+    with pytest.raises(ValueError):
+        RegisterMap(bar, REGISTERS).read("MISSING")
@@ -0,0 +1,264 @@
+import asyncio
+import socket
+
+import numpy as np
+import pytest
+
+from conftest import bram
+import compression
+import fpga_sim
+import peaks
+import wire
+from acq_server import AcquisitionServer, CapturePool, DeviceOwner
+
+
+def serve(model, client, **kwargs):
+    """ Run the coroutine function ``client(port)`` against a server on
+    the simulated FPGA and return its result. """
+    # created outside of the loop, like run() does
+    owner = DeviceOwner(model.control, model.samples, **kwargs)
+
+    async def main():
+        server = AcquisitionServer(owner, "127.0.0.1", 0, verbose=False)
+        server.listen()
+        task = asyncio.create_task(server.serve_forever())
+        try:
+            return await asyncio.wait_for(client(server.port), 10.0)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    return asyncio.run(main())
+
+
+def exchange(port, frames, replies):
+    """ Send frames over a blocking socket and read ``replies`` frames.
+
+    :returns: list of ``(header, payload bytes)``
+    """
+    buf = bytearray(wire.HEADER.size + 4 * 65536)
+    with socket.create_connection(("127.0.0.1", port), 10.0) as sock:
+        sock.sendall(b"".join(frames))
+        return [(header, bytes(payload)) for header, payload in
+                (wire.recv_frame(sock, buf) for _ in range(replies))]
+
+
+def framed(model, frames, replies, **kwargs):
+    """ Exchange frames with a server on the simulated FPGA, see
+    :func:`exchange`. The BRAM words after the last reply are added. """
+    async def client(port):
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, exchange, port, frames, replies)
+        return result, bram(model)
+    return serve(model, client, **kwargs)
+
+
+def planes(words):
+    return np.stack([words & 0xFFFF, words >> 16]).astype(np.uint16)
+
+
+def own(model, body, **kwargs):
+    """ Run the coroutine function ``body(owner)`` while the device task of
+    a DeviceOwner on the simulated FPGA is running. """
+    owner = DeviceOwner(model.control, model.samples, **kwargs)
+
+    async def main():
+        # requested before the device task started
+        first = asyncio.ensure_future(owner.capture())
+        await asyncio.sleep(0)
+        task = asyncio.create_task(owner.run())
+        try:
+            return await asyncio.wait_for(body(owner, await first), 10.0)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            owner.close()
+    return asyncio.run(main())
+
+
+def test_device_owner(model):
+    async def body(owner, first):
+        words = bram(model)
+        second = await owner.capture(dac_value=7)
+        return first, second.seq, words
+
+    first, seq, words = own(model, body, ttl=0)
+    np.testing.assert_array_equal(first.words, words)
+    assert (first.seq, seq) == (0, 1)
+    assert model.dac_value == 7 and model.triggers == 2
+
+
+def test_device_owner_cache(model):
+    async def body(owner, first):
+        return first, await owner.capture(), await owner.capture(3)
+
+    first, cached, other = own(model, body, ttl=10.0)
+    assert cached is first
+    assert other is not first and other.dac_value == 3
+    assert model.triggers == 2
+
+
+
+
+def test_coalesced_requests(model):
+    async def body(owner, first):
+        # pooled buffers are reused, keep the sequence numbers only
+        seqs = [first.seq]
+        batch = await asyncio.gather(*(owner.capture() for _ in range(5)))
+        seqs.append(batch[0].seq)
+        seqs.append((await owner.capture(dac_value=9)).seq)
+        return seqs, batch
+
+    seqs, batch = own(model, body, ttl=0, coalesce_window=0.01)
+    assert len({id(c) for c in batch}) == 1
+    assert seqs == [0, 1, 2]
+    assert model.triggers == 3
+
+
+def test_legacy_request(model):
+    async def client(port):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, ("127.0.0.1", port))
+            await loop.sock_sendall(sock, b"s")
+            data = bytearray()
+            while len(data) < model.samples.size:
+                chunk = await loop.sock_recv(sock, 65536)
+                assert chunk
+                data += chunk
+            return bytes(data), bram(model)
+        finally:
+            sock.close()
+
+    data, words = serve(model, client)
+    assert data == words.tobytes()
+
+
+def test_request(model):
+    frames, words = framed(model, [wire.request_frame(5)], 1, dac_value=0x14)
+    header, payload = frames[0]
+    assert (header.type, header.request_id) == (wire.MSG_CAPTURE, 5)
+    assert header.encoding == wire.ENC_RAW and header.dac_value == 0x14
+    assert header.count == len(words) and payload == words.tobytes()
+
+
+def test_request_range_and_dac(model):
+    frames, words = framed(model, [
+        wire.request_frame(1, wire.Request(16, 32, 40000))], 1)
+    header, payload = frames[0]
+    assert header.dac_value == 40000 and model.dac_value == 40000
+    assert header.count == 32 and payload == words[16:48].tobytes()
+
+
+@pytest.mark.parametrize("dac_value", [-5, 0x10000])
+def test_request_invalid_dac(model, dac_value):
+    frames, _ = framed(model, [
+        wire.request_frame(1, wire.Request(0, 0, dac_value)),
+        wire.request_frame(2, wire.Request(0, 4))], 2)
+    (error, message), (header, _) = frames
+    assert (error.type, error.request_id) == (wire.MSG_ERROR, 1)
+    assert b"out of range" in message
+    # the connection and the device survive the bad request
+    assert (header.type, header.request_id, header.seq) == \
+        (wire.MSG_CAPTURE, 2, 0)
+    assert model.triggers == 1
+
+
+def test_subscription(model):
+    def client(port):
+        buf = bytearray(wire.HEADER.size + 4 * 65536)
+        with socket.create_connection(("127.0.0.1", port), 10.0) as sock:
+            sock.sendall(wire.subscribe_frame(
+                3, wire.Subscription(0, 8, 0x20, 0.0)))
+            frames = [wire.recv_frame(sock, buf)[0] for _ in range(4)]
+            sock.sendall(wire.unsubscribe_frame(3))
+            # captures pushed before the unsubscribe arrived, then its echo
+            while True:
+                header, _ = wire.recv_frame(sock, buf)
+                if header.type != wire.MSG_CAPTURE:
+                    break
+            # requests are served again after the stream ended
+            sock.sendall(wire.request_frame(4, wire.Request(0, 8)))
+            return frames, header, wire.recv_frame(sock, buf)[0]
+
+    async def main(port):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, client, port)
+
+    frames, end, reply = serve(model, main)
+    seqs = [h.seq for h in frames]
+    assert seqs == sorted(set(seqs))
+    assert {(h.type, h.request_id, h.count, h.dac_value)
+            for h in frames} == {(wire.MSG_CAPTURE, 3, 8, 0x20)}
+    assert (end.type, end.request_id) == (wire.MSG_UNSUBSCRIBE, 3)
+    assert (reply.type, reply.request_id) == (wire.MSG_CAPTURE, 4)
+    assert reply.seq > seqs[-1]
+
+
+def test_capture_pool():
+    pool = CapturePool(words=16, size=1)
+    first = pool.get()
+    second = pool.get()
+    assert second is not first and pool.in_use() == 2
+    pool.retain(first)
+    pool.release(first)
+    assert pool.get() is not first
+    pool.release(first)
+    pool.release(second)
+    # only ``size`` buffers are kept for reuse
+    assert pool.get() is first
+    assert pool.in_use() == 2
+
+
+def test_pipelined_requests(model):
+    # frames queued for sending keep their capture while newer captures
+    # are taken
+    frames, _ = framed(model, [wire.request_frame(i) for i in range(8)], 8,
+                       ttl=0, pool_size=1, coalesce_window=0)
+    captures = fpga_sim.synthetic_captures(count=4)
+    assert sorted(h.request_id for h, _ in frames) == list(range(8))
+    for header, payload in frames:
+        assert payload == captures[(header.seq + 1) % 4].tobytes()
+
+
+@pytest.mark.parametrize("encoding", [wire.ENC_RAW, wire.ENC_PACK12,
+                                      wire.ENC_DELTA])
+def test_sample_encodings(model, encoding):
+    frames, words = framed(model, [
+        wire.hello_frame(wire.Hello(encoding, compression.CODEC_ZLIB), 1),
+        wire.request_frame(2, wire.Request(8, 100))], 2)
+    (hello, data), (header, payload) = frames
+    assert hello.type == wire.MSG_HELLO
+    agreed = wire.Hello.unpack(data)
+    assert agreed.encoding == header.encoding == encoding
+    np.testing.assert_array_equal(
+        wire.decode_payload(payload, header.count, header.encoding),
+        planes(words[8:108]))
+
+
+def test_unknown_encoding_falls_back_to_raw(model):
+    frames, words = framed(model, [
+        wire.hello_frame(wire.Hello(99, 99)), wire.request_frame(1)], 2)
+    assert wire.Hello.unpack(frames[0][1]).encoding == wire.ENC_RAW
+    assert frames[1][1] == words.tobytes()
+
+
+def test_peaks_encoding(peaks_model):
+    frames, words = framed(peaks_model, [
+        wire.hello_frame(wire.Hello(wire.ENC_PEAKS)),
+        wire.request_frame(1, wire.Request(0, 16))], 2, dac_value=0x14)
+    header, payload = frames[1]
+    expect = peaks.PeakDetector().detect_capture(words.tobytes())
+    assert len(expect) and header.encoding == wire.ENC_PEAKS
+    np.testing.assert_array_equal(
+        wire.decode_payload(payload, header.count, header.encoding), expect)
+
+
+def test_empty_peaks(blank_model):
+    # frames without payload go out as the header alone
+    frames, _ = framed(blank_model, [
+        wire.hello_frame(wire.Hello(wire.ENC_PEAKS))] +
+        [wire.request_frame(i) for i in range(3)], 4, ttl=0)
+    assert [(h.type, h.length, h.count, len(p)) for h, p in frames[1:]] == \
+        [(wire.MSG_CAPTURE, 0, 0, 0)] * 3
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import compression
+import wire
+
+
+@pytest.mark.parametrize("dac_value", [None, 0, 0x14, 40000, wire.DAC_MAX])
+def test_header_dac_value(dac_value):
+    header = wire.Header(wire.MSG_CAPTURE, 16, seq=7, dac_value=dac_value,
+                         request_id=3, count=4)
+    data = header.pack()
+    assert len(data) == wire.HEADER.size == 40
+    parsed = wire.Header.unpack(data)
+    assert parsed.dac_value == dac_value
+    assert parsed.flags == 0
+    assert (parsed.seq, parsed.request_id, parsed.count) == (7, 3, 4)
+
+
+def test_header_invalid():
+    data = bytearray(wire.Header(wire.MSG_REQUEST).pack())
+    data[4] = wire.VERSION + 1
+    with pytest.raises(wire.ProtocolError, match="version"):
+        wire.Header.unpack(data)
+    with pytest.raises(wire.ProtocolError, match="magic"):
+        wire.Header.unpack(b"HTTP" + bytes(data[4:]))
+
+
+@pytest.mark.parametrize("dac_value", [-5, wire.DAC_MAX + 1, 100000])
+def test_request_dac_out_of_range(dac_value):
+    data = wire.Request(0, 0, dac_value).pack()
+    with pytest.raises(wire.ProtocolError):
+        wire.Request.unpack(data)
+    data = wire.Subscription(0, 0, dac_value, 1.0).pack()
+    with pytest.raises(wire.ProtocolError):
+        wire.Subscription.unpack(data)
+
+
+def test_request_roi():
+    assert wire.Request(16, 32).roi(1024) == (16, 48)
+    assert wire.Request(1000, 0).roi(1024) == (1000, 1024)
+    with pytest.raises(wire.ProtocolError):
+        wire.Request(1024, 1).roi(1024)
+    with pytest.raises(wire.ProtocolError):
+        wire.Request.unpack(b"\0" * 4)
+
+
+def test_subscription():
+    sub = wire.Subscription.unpack(wire.Subscription(4, 8, 9, 2.5).pack())
+    assert (sub.start, sub.count, sub.dac_value, sub.rate) == (4, 8, 9, 2.5)
+    with pytest.raises(wire.ProtocolError):
+        wire.Subscription.unpack(wire.Subscription(rate=-1.0).pack())
+    with pytest.raises(wire.ProtocolError):
+        wire.Subscription.unpack(wire.Request().pack())
+
+
+@pytest.mark.parametrize("encoding", [wire.ENC_RAW, wire.ENC_PACK12,
+                                      wire.ENC_DELTA])
+def test_payload_round_trip(encoding):
+    words = (np.arange(101, dtype=np.uint32) * 37 % 4096) * 0x10001 + 1
+    used, payload = wire.encode_payload(words.tobytes(), encoding)
+    assert used == encoding
+    samples = wire.decode_payload(payload, len(words), used)
+    np.testing.assert_array_equal(samples[0], words & 0xFFFF)
+    np.testing.assert_array_equal(samples[1], words >> 16)
+
+
+def test_pack12_falls_back_to_raw():
+    words = np.array([1, 0x10000000], np.uint32).tobytes()
+    assert wire.encode_payload(words, wire.ENC_PACK12) == \
+        (wire.ENC_RAW, words)
+
+
+def test_hello_supported():
+    assert wire.Hello(99).supported().encoding == wire.ENC_RAW
+    hello = wire.Hello(wire.ENC_DELTA, 99).supported()
+    assert hello.codec == compression.default_codec()
+    hello = wire.Hello.unpack(wire.Hello(wire.ENC_PACK12).pack())
+    assert hello.supported().encoding == wire.ENC_PACK12
@@ -0,0 +1,412 @@
+"""Framed binary protocol of the acquisition server.
+
+Every message in either direction is a fixed 40 byte header followed by
+``length`` payload bytes:
+
+    magic       4s  b"FBGW"
+    version     B   VERSION
+    type        B   MSG_*
+    flags       H   FLAG_DAC, other bits reserved, 0
+    length      I   payload bytes
+    seq         Q   capture sequence number
+    timestamp   d   capture time, seconds since the epoch
+    layout      B   channel layout of the payload words, LAYOUT_*
+    encoding    B   payload encoding, ENC_*
+    dac_value   H   DAC value of the capture, valid if FLAG_DAC is set
+    request_id  I   echoed from the request the frame answers
+    count       I   32-bit words in the payload, peak records for
+                    ENC_PEAKS
+
+A client sends MSG_REQUEST frames whose payload holds the request
+parameters (first word, word count, DAC value, 0 to DAC_MAX); the server
+answers each with one MSG_CAPTURE frame carrying the same request_id, or
+a MSG_ERROR frame with a UTF-8 message. Requests can be pipelined, gaps in ``seq``
+show captures a client did not see.
+
+A MSG_SUBSCRIBE frame, whose payload adds the wanted rate in captures per
+second (0: as fast as the device goes) to the request parameters, makes
+the server push MSG_CAPTURE frames carrying the subscription's request_id
+without further requests. A MSG_UNSUBSCRIBE frame with the same
+request_id ends the stream; the server echoes it after the last capture
+frame of that stream.
+
+Capture payloads are raw 32-bit words unless the client negotiated an
+encoding with a MSG_HELLO frame, which the server answers with the
+encoding and codec it will use on the connection:
+
+    ENC_RAW     the BRAM words, 4 bytes per word
+    ENC_PACK12  both 12-bit samples of a word in 3 bytes, see
+                compression.pack12(); captures with samples above 12 bits
+                are sent as ENC_RAW
+    ENC_DELTA   delta coded and compressed channel planes, a
+                compression.encode_planes() blob naming its codec
+    ENC_PEAKS   no samples, the peaks the server detected in the capture
+                as peaks.PEAK_DTYPE records (index, height, wavelength);
+                the requested word range is ignored
+
+The ``encoding`` of each MSG_CAPTURE header tells how to decode it, see
+:func:`decode_payload`.
+"""
+import struct
+
+import numpy as np
+
+import compression
+import decode
+from peaks import PEAK_DTYPE
+
+MAGIC = b"FBGW"
+VERSION = 2
+
+HEADER = struct.Struct("<4sBBHIQdBBHII")
+
+# header flag: dac_value holds the DAC value of the capture
+FLAG_DAC = 0x1
+
+MSG_REQUEST = 1
+MSG_CAPTURE = 2
+MSG_ERROR = 3
+MSG_SUBSCRIBE = 4
+MSG_UNSUBSCRIBE = 5
+MSG_HELLO = 6
+
+ENC_RAW = 0
+ENC_PACK12 = 1
+ENC_DELTA = 2
+ENC_PEAKS = 3
+ENCODING_NAMES = {ENC_RAW: "raw", ENC_PACK12: "pack12", ENC_DELTA: "delta",
+                  ENC_PEAKS: "peaks"}
+
+LAYOUT_AB = 0
+LAYOUT_SIGNAL_TRIGGER = 1
+LAYOUTS = {LAYOUT_AB: decode.LAYOUT_AB,
+           LAYOUT_SIGNAL_TRIGGER: decode.LAYOUT_SIGNAL_TRIGGER}
+
+NO_DAC = -1
+# largest DAC value, the width of the DACVALUE register field
+DAC_MAX = 0xFFFF
+
+# first word, word count (0: to the end), DAC value (-1: server default),
+# reserved
+REQUEST = struct.Struct("<IIiI")
+# request parameters, captures per second (0: as fast as possible)
+SUBSCRIBE = struct.Struct("<IIiId")
+# encoding, codec of ENC_DELTA, reserved
+HELLO = struct.Struct("<BBH")
+
+# largest payload accepted from a client
+MAX_REQUEST_PAYLOAD = 4096
+
+
+class ProtocolError(ValueError):
+    """ A peer sent something that is not a valid frame. """
+
+
+def _dac(dac):
+    """ DAC value of a request payload, None for the server default.
+
+    :raises ProtocolError: if the value does not fit the DAC.
+    """
+    if dac == NO_DAC:
+        return None
+    if not 0 <= dac <= DAC_MAX:
+        raise ProtocolError("DAC value %d out of range 0..%d" %
+                            (dac, DAC_MAX))
+    return dac
+
+
+class Header(object):
+    """ A frame header.
+
+    :param int type: MSG_* message type.
+    :param int length: payload bytes.
+
+    """
+
+    __slots__ = ("type", "flags", "length", "seq", "timestamp", "layout",
+                 "encoding", "dac_value", "request_id", "count")
+
+    def __init__(self, type, length=0, seq=0, timestamp=0.0,
+                 layout=LAYOUT_AB, encoding=ENC_RAW, dac_value=None,
+                 request_id=0, count=0, flags=0):
+        self.type = type
+        self.flags = flags
+        self.length = length
+        self.seq = seq
+        self.timestamp = timestamp
+        self.layout = layout
+        self.encoding = encoding
+        self.dac_value = dac_value
+        self.request_id = request_id
+        self.count = count
+
+    def pack(self):
+        flags = self.flags & ~FLAG_DAC
+        if self.dac_value is not None:
+            flags |= FLAG_DAC
+        return HEADER.pack(MAGIC, VERSION, self.type, flags,
+                           self.length, self.seq, self.timestamp,
+                           self.layout, self.encoding,
+                           0 if self.dac_value is None else self.dac_value,
+                           self.request_id, self.count)
+
+    @classmethod
+    def unpack(cls, data):
+        """ Parse a header.
+
+        :raises ProtocolError: if magic or version do not match.
+        """
+        (magic, version, type, flags, length, seq, timestamp, layout,
+         encoding, dac, request_id, count) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ProtocolError("bad frame magic %r" % (magic))
+        if version != VERSION:
+            raise ProtocolError("unsupported protocol version %d" %
+                                (version))
+        return cls(type, length, seq, timestamp, layout, encoding,
+                   dac if flags & FLAG_DAC else None, request_id, count,
+                   flags & ~FLAG_DAC)
+
+    def __repr__(self):
+        return ("Header(type=%d, length=%d, seq=%d, request_id=%d, "
+                "count=%d)" % (self.type, self.length, self.seq,
+                               self.request_id, self.count))
+
+
+class Request(object):
+    """ Parameters of a capture request.
+
+    :param int start: first word of the capture to send.
+    :param int count: number of words, 0 for all words from ``start``.
+    :param int dac_value: DAC value to acquire with, None for the server's.
+
+    """
+
+    def __init__(self, start=0, count=0, dac_value=None):
+        self.start = start
+        self.count = count
+        self.dac_value = dac_value
+
+    def pack(self):
+        return REQUEST.pack(self.start, self.count,
+                            NO_DAC if self.dac_value is None
+                            else self.dac_value, 0)
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < REQUEST.size:
+            raise ProtocolError("short request payload")
+        start, count, dac, _ = REQUEST.unpack_from(data)
+        return cls(start, count, _dac(dac))
+
+    def roi(self, words):
+        """ Clip the requested range to a capture of ``words`` words.
+
+        :returns: ``(start, stop)``
+        :raises ProtocolError: if the range is empty.
+        """
+        stop = words if not self.count else \
+            min(self.start + self.count, words)
+        if self.start >= stop:
+            raise ProtocolError("empty range %d+%d of %d words" %
+                                (self.start, self.count, words))
+        return self.start, stop
+
+
+class Subscription(Request):
+    """ Parameters of a capture stream.
+
+    :param float rate: captures per second, 0 for every capture.
+
+    """
+
+    def __init__(self, start=0, count=0, dac_value=None, rate=0.0):
+        super().__init__(start, count, dac_value)
+        self.rate = rate
+
+    def pack(self):
+        return SUBSCRIBE.pack(self.start, self.count,
+                              NO_DAC if self.dac_value is None
+                              else self.dac_value, 0, self.rate)
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < SUBSCRIBE.size:
+            raise ProtocolError("short subscribe payload")
+        start, count, dac, _, rate = SUBSCRIBE.unpack_from(data)
+        if not rate >= 0:
+            raise ProtocolError("invalid rate %r" % (rate))
+        return cls(start, count, _dac(dac), rate)
+
+
+class Hello(object):
+    """ Payload encoding of a connection.
+
+    :param int encoding: ENC_* payload encoding.
+    :param int codec: compression.CODEC_* codec of ENC_DELTA payloads.
+
+    """
+
+    def __init__(self, encoding=ENC_RAW, codec=compression.CODEC_ZLIB):
+        self.encoding = encoding
+        self.codec = codec
+
+    def pack(self):
+        return HELLO.pack(self.encoding, self.codec, 0)
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < HELLO.size:
+            raise ProtocolError("short hello payload")
+        encoding, codec, _ = HELLO.unpack_from(data)
+        return cls(encoding, codec)
+
+    def supported(self):
+        """ The nearest encoding this side can produce: unknown encodings
+        become ENC_RAW, unavailable codecs the best available one.
+
+        :rtype: Hello
+        """
+        if self.encoding not in ENCODING_NAMES:
+            return Hello(ENC_RAW, self.codec)
+        if self.encoding == ENC_DELTA and \
+                self.codec not in compression.available_codecs():
+            return Hello(ENC_DELTA, compression.default_codec())
+        return Hello(self.encoding, self.codec)
+
+
+def hello_frame(hello, request_id=0):
+    """ Build a MSG_HELLO frame.
+
+    :rtype: bytes
+    """
+    payload = hello.pack()
+    return Header(MSG_HELLO, len(payload),
+                  request_id=request_id).pack() + payload
+
+
+def request_frame(request_id, request=None):
+    """ Build a MSG_REQUEST frame.
+
+    :rtype: bytes
+    """
+    payload = (request or Request()).pack()
+    return Header(MSG_REQUEST, len(payload),
+                  request_id=request_id).pack() + payload
+
+
+def subscribe_frame(request_id, subscription=None):
+    """ Build a MSG_SUBSCRIBE frame.
+
+    :rtype: bytes
+    """
+    payload = (subscription or Subscription()).pack()
+    return Header(MSG_SUBSCRIBE, len(payload),
+                  request_id=request_id).pack() + payload
+
+
+def unsubscribe_frame(request_id):
+    """ Build a MSG_UNSUBSCRIBE frame ending stream ``request_id``.
+
+    :rtype: bytes
+    """
+    return Header(MSG_UNSUBSCRIBE, request_id=request_id).pack()
+
+
+def error_frame(request_id, message):
+    """ Build a MSG_ERROR frame.
+
+    :rtype: bytes
+    """
+    payload = message.encode("utf-8")
+    return Header(MSG_ERROR, len(payload),
+                  request_id=request_id).pack() + payload
+
+
+def capture_header(capture, start, stop, request_id=0, layout=LAYOUT_AB,
+                   encoding=ENC_RAW, length=None, count=None):
+    """ Build the header of a MSG_CAPTURE frame carrying words
+    ``start:stop`` of an acquisition.Capture.
+
+    :param int length: payload bytes, 4 per word if None.
+    :param int count: records in the payload, the words if None.
+    """
+    if count is None:
+        count = stop - start
+    return Header(MSG_CAPTURE, 4 * count if length is None else length,
+                  capture.seq, capture.timestamp, layout, encoding,
+                  capture.dac_value, request_id, count).pack()
+
+
+def encode_payload(raw, encoding, codec=compression.CODEC_ZLIB):
+    """ Encode raw capture words for a MSG_CAPTURE frame.
+
+    :param raw: buffer of 32-bit words.
+    :param int encoding: ENC_RAW, ENC_PACK12 or ENC_DELTA; ENC_PEAKS
+                         payloads are the bytes of a peaks.PeakDetector
+                         result.
+    :returns: ``(encoding used, payload)``, the payload is ``raw`` itself
+              for ENC_RAW.
+    """
+    if encoding == ENC_RAW:
+        return ENC_RAW, raw
+    samples = decode.as_samples(raw)
+    if encoding == ENC_PACK12:
+        if len(samples) and samples.max() > 0x0FFF:
+            return ENC_RAW, raw
+        return ENC_PACK12, compression.pack12(samples.reshape(-1))
+    if encoding == ENC_DELTA:
+        return ENC_DELTA, compression.encode_planes(samples.T, codec)
+    raise ValueError("unknown encoding %d" % (encoding))
+
+
+def decode_payload(payload, count, encoding):
+    """ Turn a MSG_CAPTURE payload into a (2, count) channel array, row 0
+    the low and row 1 the high half-word; a view into ``payload`` for
+    ENC_RAW. ENC_PEAKS payloads give a view of ``count`` PEAK_DTYPE
+    records instead.
+
+    :rtype: numpy.ndarray of uint16
+    """
+    if encoding == ENC_RAW:
+        return decode.as_samples(payload)[:count].T
+    if encoding == ENC_PACK12:
+        return compression.unpack12(payload, 2 * count).reshape(-1, 2).T
+    if encoding == ENC_DELTA:
+        planes = compression.decode_planes(payload)
+        if planes.shape != (2, count):
+            raise ProtocolError("payload holds %r samples, expected %d" %
+                                (planes.shape, count))
+        return planes
+    if encoding == ENC_PEAKS:
+        return np.frombuffer(payload, PEAK_DTYPE, count)
+    raise ProtocolError("unknown encoding %d" % (encoding))
+
+
+def recv_into_exactly(sock, view):
+    """ Fill a writable memoryview from a blocking socket.
+
+    :raises ConnectionError: if the peer closes the connection first.
+    """
+    while len(view):
+        n = sock.recv_into(view)
+        if not n:
+            raise ConnectionError("connection closed by peer")
+        view = view[n:]
+
+
+def recv_frame(sock, buf):
+    """ Read one frame from a blocking socket into ``buf``, which must be
+    large enough for header and payload.
+
+    :returns: ``(header, payload memoryview into buf)``
+    """
+    view = memoryview(buf)
+    recv_into_exactly(sock, view[:HEADER.size])
+    header = Header.unpack(view)
+    if HEADER.size + header.length > len(view):
+        raise ProtocolError("frame of %d bytes does not fit the buffer" %
+                            (header.length))
+    payload = view[HEADER.size:HEADER.size + header.length]
+    recv_into_exactly(sock, payload)
+    return header, payload